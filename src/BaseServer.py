@@ -0,0 +1,157 @@
+#/usr/bin/env python
+
+##########################################################################
+# BaseServer usage notes:
+#
+# 1. A BaseServer runs many programs over the same base relations. The
+#    base relations are fetched, flattened, and formatted once, through
+#    the Quest instance the server was made with, and installed once,
+#    together with their define statements, into a live c4 instance the
+#    server keeps in its own C4Session. Every program then only installs
+#    its own rules and dumps its outputs, so its cost depends on the
+#    rules and not on the size of the base data.
+#    Ex: bs = BaseServer.BaseServer( q, [ "b", "c" ] )
+#        results = bs.run( [ "a(K,Z) :- b(K,Y), c(Y,Z) ;" ], [ "a" ] )
+#        bs.close()
+#
+# 2. The idb relations of a program are renamed after a digest of its
+#    rules before they are installed, so programs never see each other's
+#    rules. Running the same rules again installs nothing new; the live
+#    program only grows with the rules of distinct programs.
+#
+# 3. c4 evaluates on a runtime thread, which fork() does not copy, so a
+#    live base cannot be handed to forked children, and children that
+#    install the base again gain nothing over a fresh run. Programs on
+#    several threads share the server; each run holds the session while
+#    it installs and collects its results.
+#
+# 4. Changes to the store after the server was made are not seen by its
+#    programs. Make a new server to pick them up.
+#
+##########################################################################
+
+#############
+#  IMPORTS  #
+#############
+# standard python packages
+import hashlib, logging, sys
+import C4Session
+
+# ------------------------------------------------------ #
+# ------------------------------------------------------ #
+
+class BaseServer( object ) :
+
+  ################
+  #  ATTRIBUTES  #
+  ################
+  quest       = None   # Quest instance supplying the schema and the base data
+  session     = None   # C4Session holding the installed base
+  baseTables  = None   # names of the base relations
+  baseArities = None   # edb arities of the base relations
+
+  ##########
+  #  INIT  #
+  ##########
+  # fetch, flatten, and format the base relations and install them into
+  # the live c4 instance of the server.
+  def __init__( self, quest, baseTables ) :
+
+    self.quest      = quest
+    self.baseTables = list( baseTables )
+
+    defines = quest.getDefineStatements( self.baseTables )
+    edbs    = quest.getEDBs( self.baseTables )
+
+    self.baseArities = dict( quest.edb_arities )
+
+    self.session = C4Session.C4Session()
+    try :
+      try :
+        self.session.install( defines + quest.factor_defines + edbs + quest.factor_rules )
+        if quest.bulk_load :
+          self.session.installFacts( quest.fact_data )
+      finally :
+        quest.fact_data = []   # the rows live in the session now
+
+    # a half installed base is of no use to anyone
+    except :
+      self.session.close()
+      raise
+
+    logging.debug( "  BASESERVER : installed base program for " + str( self.baseTables ) )
+
+
+  #########
+  #  RUN  #
+  #########
+  # evaluate rules over the base relations.
+  # relations of the rules missing from the base are defined empty.
+  # return the results of the relations in outputs ( every relation of
+  # the rules if None ), as a QuestResults instance if structured is set.
+  def run( self, rules, outputs=None, structured=False ) :
+
+    quest = self.quest
+
+    table_list = quest.getTableList( rules )
+    dump_list  = quest.getOutputList( table_list, outputs )
+
+    # only evaluate what the outputs depend on
+    queries    = quest.getRelevantQueries( dump_list, rules )
+    table_list = quest.getRelevantTables( table_list, queries, dump_list )
+    newTables  = [ t for t in table_list if not t in self.baseTables ]
+
+    # sanity checks
+    quest.verifyArities( table_list, rules, self.baseArities )
+    quest.verifyDataTypes( table_list, rules )
+
+    # namespace the idb relations
+    suffix = "_qs" + hashlib.md5( "\n".join( queries ) ).hexdigest()[:12]
+    names  = {}
+    for rule in quest.getRules( queries ) :
+      names[ rule.head.name ] = rule.head.name + suffix
+
+    defines    = []
+    run_schema = {}
+    for t in table_list :
+      run_schema[ names.get( t, t ) ] = quest.schema[t]
+      if t in names :
+        defines.append( quest.format_define_statement( names[t], quest.schema[t] ) )
+      elif t in newTables :
+        defines.extend( quest.getDefineStatements( [ t ] ) )
+
+    renamed_rules = [ rule.rename( names ).text for rule in quest.getRules( queries ) ]
+    helper_defines, renamed_rules = quest.getProgramRules( renamed_rules, run_schema )
+
+    # base values kept under idb names seed the renamed relations
+    for t in table_list :
+      if t in names and t in self.baseArities :
+        variables = ",".join( [ "C" + str( j ) for j in range( 0, len( quest.schema[t] ) ) ] )
+        renamed_rules.append( names[t] + "(" + variables + ") :- " + t + "(" + variables + ") ;" )
+
+    renamed_dump_list = []
+    for t in dump_list :
+      if not names.get( t, t ) in renamed_dump_list :
+        renamed_dump_list.append( names.get( t, t ) )
+
+    programData = [ defines + helper_defines + renamed_rules, renamed_dump_list ]
+
+    if structured :
+      results = self.session.run( programData, run_schema )
+    else :
+      results = quest.getResultBlocks( self.session.run( programData ) )
+
+    return quest.getRenamedResults( results, dump_list, names, structured )
+
+
+  ###########
+  #  CLOSE  #
+  ###########
+  # tear down the live c4 instance and the base with it.
+  def close( self ) :
+    self.session.close()
+
+
+#########
+#  EOF  #
+#########
@@ -0,0 +1,239 @@
+#/usr/bin/env python
+
+##########################################################################
+# C4Pool usage notes:
+#
+# 1. libc4 keeps process-global state, so one process evaluates one c4
+#    program at a time. A C4Pool forks a fixed number of worker processes
+#    up front, each with libc4 loaded and its runtime initialized for the
+#    life of the worker, and evaluates programs on them.
+#    Programs and results travel over one pipe per worker, so independent
+#    programs are evaluated in parallel on separate cores.
+#    Ex: pool    = C4Pool.C4Pool( 4 )
+#        results = pool.map( [ [ programData1, schema ], [ programData2, schema ] ] )
+#        pool.close()
+#
+# 2. A Quest instance hands its programs to the pool once setEnginePool
+#    was called. Runs on several threads, e.g. through run_async, then
+#    share the workers.
+#    Ex: q.setEnginePool( pool )
+#        jobs = [ q.run_async() for q in quests ]
+#
+# 3. A worker that died while idle is replaced before it is handed the
+#    next program. A worker dying while evaluating a program is replaced
+#    as well and the run aborts.
+#
+##########################################################################
+
+#############
+#  IMPORTS  #
+#############
+# standard python packages
+import logging, multiprocessing, sys
+from multiprocessing.pool import ThreadPool
+from Queue import Queue
+import C4Wrapper
+
+# ------------------------------------------------------ #
+# ------------------------------------------------------ #
+
+class C4Pool( object ) :
+
+  ################
+  #  ATTRIBUTES  #
+  ################
+  processes = 0      # number of worker processes
+  workers   = None   # list of [ process, pipe connection ] per worker
+  idle      = None   # queue of the indexes of the idle workers
+  restarts  = 0      # number of workers replaced after dying
+
+  ##########
+  #  INIT  #
+  ##########
+  def __init__( self, processes=None ) :
+
+    if processes is None :
+      processes = multiprocessing.cpu_count()
+
+    self.processes = processes
+    self.workers   = [ None ] * processes
+    self.idle      = Queue()
+    self.restarts  = 0
+
+    for i in range( 0, processes ) :
+      self.startWorker( i )
+      self.idle.put( i )
+
+
+  ##################
+  #  START WORKER  #
+  ##################
+  # fork worker i with a fresh pipe.
+  def startWorker( self, i ) :
+
+    parentConn, childConn = multiprocessing.Pipe()
+
+    process        = multiprocessing.Process( target=serveJobs, args=( childConn, ) )
+    process.daemon = True
+    process.start()
+    childConn.close()
+
+    self.workers[i] = [ process, parentConn ]
+
+
+  ####################
+  #  RESTART WORKER  #
+  ####################
+  # replace worker i after it died.
+  def restartWorker( self, i ) :
+
+    process, conn = self.workers[i]
+    conn.close()
+    process.join()
+
+    logging.debug( "  C4POOL : restarting worker " + str( i ) + ", exit code " + str( process.exitcode ) )
+    self.restarts += 1
+    self.startWorker( i )
+
+
+  #########
+  #  RUN  #
+  #########
+  # same contract as C4Wrapper.run, evaluated on an idle worker.
+  # streaming is not supported across processes.
+  def run( self, allProgramData, schema=None ) :
+    return self.runJob( [ allProgramData, schema ] )
+
+
+  ################
+  #  RUN CHUNKS  #
+  ################
+  # same contract as C4Wrapper.runChunks. the chunks are collected and
+  # sent to the worker as one program.
+  def runChunks( self, chunks, tableList, schema=None ) :
+
+    statements = []
+    factData   = []
+    for chunkStatements, chunkFactData in chunks :
+      statements.extend( chunkStatements )
+      factData.extend( chunkFactData )
+
+    return self.run( [ statements, tableList, factData ], schema )
+
+
+  #########
+  #  MAP  #
+  #########
+  # evaluate a list of [ allProgramData, schema ] jobs on all workers at
+  # once and return their results in job order.
+  def map( self, jobs ) :
+
+    if len( jobs ) == 0 :
+      return []
+
+    threads = ThreadPool( min( self.processes, len( jobs ) ) )
+    try :
+      return threads.map( self.runJob, jobs )
+    finally :
+      threads.close()
+      threads.join()
+
+
+  #############
+  #  RUN JOB  #
+  #############
+  # evaluate one [ allProgramData, schema ] job on the next idle worker.
+  def runJob( self, job ) :
+
+    if self.workers is None :
+      sys.exit( "ERROR : C4Pool : pool is closed. aborting..." )
+
+    i = self.idle.get()
+    try :
+      process, conn = self.workers[i]
+
+      # replace a worker that died while idle
+      if not process.is_alive() :
+        self.restartWorker( i )
+        process, conn = self.workers[i]
+
+      try :
+        conn.send( job )
+        results, error = conn.recv()
+      except ( EOFError, IOError ) :
+        self.restartWorker( i )
+        sys.exit( "ERROR : C4Pool : worker " + str( i ) + " died evaluating the program. aborting..." )
+
+    finally :
+      self.idle.put( i )
+
+    if not error is None :
+      sys.exit( error )
+
+    return results
+
+
+  ###########
+  #  CLOSE  #
+  ###########
+  # ask every worker to exit and wait for them. workers are never
+  # terminated, since that would run whatever SIGTERM handler the store
+  # installed in the parent.
+  def close( self ) :
+
+    if self.workers is None :
+      return
+
+    for process, conn in self.workers :
+      try :
+        conn.send( None )
+      except IOError :
+        pass
+      conn.close()
+
+    for process, conn in self.workers :
+      process.join()
+
+    self.workers = None
+
+
+################
+#  SERVE JOBS  #
+################
+# body of a worker process. evaluate [ allProgramData, schema ] jobs from
+# conn until None arrives, sending back [ results, error message ].
+def serveJobs( conn ) :
+
+  C4Wrapper.resetAfterFork()
+  w = C4Wrapper.C4Wrapper( ) # loads libc4 once per worker
+
+  # keep the runtime initialized for the life of the worker, so jobs only
+  # make and destroy their c4 instances
+  C4Wrapper.acquireRuntime( w.lib )
+
+  try :
+    while True :
+      try :
+        job = conn.recv()
+      except EOFError :
+        break
+
+      if job is None :
+        break
+
+      allProgramData, schema = job
+      try :
+        conn.send( [ w.run( allProgramData, schema ), None ] )
+      except SystemExit as e :
+        conn.send( [ None, str( e.code ) ] )
+      except Exception as e :
+        conn.send( [ None, "ERROR : C4Pool : " + repr( e ) + ". aborting..." ] )
+
+  finally :
+    C4Wrapper.releaseRuntime( w.lib )
+    conn.close()
+
+
+#########
+#  EOF  #
+#########
@@ -0,0 +1,221 @@
+#/usr/bin/env python
+
+##########################################################################
+# C4Session usage notes:
+#
+# 1. A C4Session keeps one libc4 instance alive across many Quest runs.
+#    libc4 is loaded and initialized once, and the instance made once. Every run only
+#    installs the statements the live program has not seen yet, so rules
+#    and facts installed by earlier runs are not submitted again. Bulk
+#    loaded fact rows are tracked the same way.
+#
+# 2. c4 programs only grow. Facts dropped from the store after a run
+#    remain in the live program until the session is reset or closed.
+#
+#    Ex: s = C4Session.C4Session()
+#        q.setSession( s )
+#        q.run()            # installs defines, facts, and rules
+#        q.setQuery( ... )
+#        q.run()            # installs only the new rule
+#        s.close()
+#
+# 3. reset replaces the live program with an empty one, and the next run
+#    installs its whole program again. A session made with maxInstalled
+#    resets itself before a run once it holds that many statements and
+#    fact rows, which bounds both the live program and the installed set.
+#    Ex: s = C4Session.C4Session( maxInstalled=100000 )
+#
+# 4. A session can be shared by Quest instances on several threads. Each
+#    run holds the session while it installs and collects its results.
+#
+##########################################################################
+
+#############
+#  IMPORTS  #
+#############
+# standard python packages
+import logging, os, sys
+import C4Wrapper, ResultCursor
+
+# ------------------------------------------------------ #
+# ------------------------------------------------------ #
+
+class C4Session( object ) :
+
+  ################
+  #  ATTRIBUTES  #
+  ################
+  wrapper      = None   # C4Wrapper instance owning the loaded libc4
+  c4_obj       = None   # pointer to the live c4 instance
+  installed    = None   # set of statements already installed in the live program
+  maxInstalled = None   # reset before a run once installed holds this many entries
+
+  ##########
+  #  INIT  #
+  ##########
+  def __init__( self, maxInstalled=None ) :
+    self.wrapper      = C4Wrapper.C4Wrapper( ) # loads libc4
+    self.installed    = set()
+    self.maxInstalled = maxInstalled
+
+    # initialize c4 instance
+    self.wrapper.open()
+    self.c4_obj = self.wrapper.c4_obj
+
+
+  #########
+  #  RUN  #
+  #########
+  # same contract as C4Wrapper.run, but the c4 instance is left alive.
+  def run( self, allProgramData, schema=None, stream=False ) :
+
+    allProgramLines = allProgramData[0] # := list of every code line in the generated C4 program.
+    tableList       = allProgramData[1] # := list of all tables in generated C4 program.
+
+    with self.wrapper.lock :
+      self.checkBound()
+      self.install( allProgramLines )
+      if len( allProgramData ) > 2 :
+        self.installFacts( allProgramData[2] )
+
+      return self.getResults( tableList, schema, stream )
+
+
+  ################
+  #  RUN CHUNKS  #
+  ################
+  # same contract as C4Wrapper.runChunks, but the c4 instance is left alive.
+  def runChunks( self, chunks, tableList, schema=None, stream=False ) :
+
+    with self.wrapper.lock :
+      self.checkBound()
+      for statements, factData in chunks :
+        self.install( statements )
+        if factData :
+          self.installFacts( factData )
+
+      return self.getResults( tableList, schema, stream )
+
+
+  #################
+  #  GET RESULTS  #
+  #################
+  def getResults( self, tableList, schema=None, stream=False ) :
+
+    if stream :
+      return ResultCursor.ResultCursor( self.wrapper.lib, self.c4_obj, tableList, schema, None, self.wrapper.lock )
+    elif schema is None :
+      return self.wrapper.saveC4Results_toArray( tableList )
+    else :
+      return self.wrapper.saveC4Results_toResults( tableList, schema )
+
+
+  #############
+  #  INSTALL  #
+  #############
+  # install every statement not yet present in the live program.
+  # statements are only recorded once c4 accepted them, so the statements
+  # of a failed install are submitted again by the next run.
+  # return the number of newly installed statements.
+  def install( self, allProgramLines ) :
+
+    with self.wrapper.lock :
+      if self.c4_obj is None :
+        sys.exit( "ERROR : C4Session : session is closed. aborting..." )
+
+      newLines = []
+      pending  = set()
+      for statement in allProgramLines :
+        if not statement in self.installed and not statement in pending :
+          pending.add( statement )
+          newLines.append( statement )
+
+      if len( newLines ) > 0 :
+        completeProg = "".join( newLines )
+        logging.debug( "  C4SESSION : SUBMITTING SUBPROG : " )
+        logging.debug( completeProg )
+        self.wrapper.install( completeProg )
+
+      self.installed.update( pending )
+      return len( newLines )
+
+
+  ###################
+  #  INSTALL FACTS  #
+  ###################
+  # load every fact row not yet present in the live program from fact
+  # files. rows are only recorded once c4 accepted them.
+  # return the number of newly installed rows.
+  def installFacts( self, factData ) :
+
+    with self.wrapper.lock :
+      if self.c4_obj is None :
+        sys.exit( "ERROR : C4Session : session is closed. aborting..." )
+
+      newFactData = []
+      pending     = set()
+      for relationName, typeList, rows in factData :
+        newRows = []
+        for row in rows :
+          key = ( relationName, tuple( row ) )
+          if not key in self.installed and not key in pending :
+            pending.add( key )
+            newRows.append( row )
+        newFactData.append( [ relationName, typeList, newRows ] )
+
+      numRows = self.wrapper.installFacts( newFactData )
+
+      self.installed.update( pending )
+      return numRows
+
+
+  ###########
+  #  RESET  #
+  ###########
+  # replace the live c4 instance with an empty one. everything installed
+  # so far is dropped and will be installed again by the next run.
+  def reset( self ) :
+
+    with self.wrapper.lock :
+      if self.c4_obj is None :
+        sys.exit( "ERROR : C4Session : session is closed. aborting..." )
+
+      logging.debug( "  C4SESSION : resetting after " + str( len( self.installed ) ) + " installed statements and rows" )
+
+      self.wrapper.close()
+      self.c4_obj    = None
+      self.installed = set()
+
+      self.wrapper.open()
+      self.c4_obj = self.wrapper.c4_obj
+
+
+  #################
+  #  CHECK BOUND  #
+  #################
+  # reset the session if it holds maxInstalled statements and rows.
+  def checkBound( self ) :
+
+    if not self.maxInstalled is None and len( self.installed ) >= self.maxInstalled :
+      self.reset()
+
+
+  ###########
+  #  CLOSE  #
+  ###########
+  # tear down the live c4 instance.
+  def close( self ) :
+
+    with self.wrapper.lock :
+      if self.c4_obj is None :
+        return
+
+      self.wrapper.close()
+
+      self.c4_obj    = None
+      self.installed = set()
+
+
+#########
+#  EOF  #
+#########
@@ -2,37 +2,132 @@
 
 # based on https://github.com/KDahlgren/pyLDFI/blob/master/src/wrappers/c4/C4Wrapper.py
 
+##########################################################################
+# C4Wrapper usage notes:
+#
+# 1. libc4 is loaded once per process and shared by every C4Wrapper.
+#    c4_initialize and c4_terminate set up and tear down process-global
+#    state, so they are reference counted : the runtime is initialized
+#    when the first c4 instance is made and terminated when the last one
+#    is destroyed. Wrappers used on different threads at the same time no
+#    longer tear down each other's runtime.
+#
+# 2. Every libc4 function has a ctypes prototype, and calls on one c4
+#    instance are serialized by the lock of its wrapper. ctypes releases
+#    the GIL for the duration of each call, so installs and dumps of
+#    different instances run in parallel.
+#
+##########################################################################
+
 #############
 #  IMPORTS  #
 #############
 # standard python packages
-import logging, inspect, os, string, sys, time
+import logging, inspect, os, string, sys, tempfile, threading, time
 from ctypes import *
 from types  import *
 
+import RelationBuffer, ResultCursor
+
 # ------------------------------------------------------ #
+
+C4_LIB_LOC = os.path.abspath( __file__ + '/../../lib/c4/build/src/libc4/libc4.dylib' )
+
+# pointer to a c4 instance
+C4_POINTER = POINTER(c_char)
+
+# ctypes prototype of every libc4 call : name => [ argtypes, restype ]
+C4_PROTOTYPES = { "c4_initialize"   : [ [],                       None ], \
+                  "c4_terminate"    : [ [],                       None ], \
+                  "c4_make"         : [ [ c_char_p, c_int ],      C4_POINTER ], \
+                  "c4_destroy"      : [ [ C4_POINTER ],           None ], \
+                  "c4_install_str"  : [ [ C4_POINTER, c_char_p ], c_int ], \
+                  "c4_install_file" : [ [ C4_POINTER, c_char_p ], c_int ], \
+                  "c4_dump_table"   : [ [ C4_POINTER, c_char_p ], c_char_p ] }   # c4_dump_table returns a char*
+
+library      = None               # libc4, loaded on first use
+runtimeLock  = threading.Lock()   # guards library and runtimeUsers
+runtimeUsers = 0                  # number of live c4 instances in the process
+
 # ------------------------------------------------------ #
 
 class C4Wrapper( object ) :
 
+  ################
+  #  ATTRIBUTES  #
+  ################
+  lib    = None   # loaded libc4
+  c4_obj = None   # pointer to the c4 instance of the current run
+  lock   = None   # serializes libc4 calls on c4_obj
 
   ##########
   #  INIT  #
   ##########
   def __init__( self ) :
-    c4_lib_loc                     = os.path.abspath( __file__ + '/../../lib/c4/build/src/libc4/libc4.dylib' )
-    self.lib                       = cdll.LoadLibrary( c4_lib_loc )
-    self.lib.c4_make.restype       = POINTER(c_char)
-    self.lib.c4_dump_table.restype = c_char_p   # c4_dump_table returns a char*
+    self.lib    = loadLibrary()
+    self.c4_obj = None
+    self.lock   = threading.RLock()
+
+
+  ##########
+  #  OPEN  #
+  ##########
+  # make a fresh c4 instance, initializing the runtime if it is the
+  # first live instance of the process.
+  def open( self ) :
+
+    with self.lock :
+      acquireRuntime( self.lib )
+      try :
+        self.c4_obj = self.lib.c4_make( None, 0 )
+      except :
+        releaseRuntime( self.lib )
+        raise
+
+
+  #############
+  #  INSTALL  #
+  #############
+  # install program text into the live c4 instance.
+  def install( self, completeProg ) :
+    with self.lock :
+      return self.lib.c4_install_str( self.c4_obj, bytes( completeProg ) )
+
+
+  ##################
+  #  INSTALL FILE  #
+  ##################
+  # install a program file into the live c4 instance.
+  def installFile( self, path ) :
+    with self.lock :
+      return self.lib.c4_install_file( self.c4_obj, bytes( path ) )
+
+
+  ################
+  #  DUMP TABLE  #
+  ################
+  # return the dump buffer of one relation of the live c4 instance.
+  def dumpTable( self, table ) :
+    with self.lock :
+      return self.lib.c4_dump_table( self.c4_obj, table )
 
 
   #########
   #  RUN  #
   #########
-  def run( self, allProgramData ) :
+  # when a schema is given, return a QuestResults instance decoded with
+  # the schema types instead of the flat results array.
+  # when stream is also set, return a ResultCursor instead. the cursor
+  # keeps the c4 instance alive and tears it down once it is exhausted.
+  # an optional third entry in allProgramData lists [ relation name,
+  # type list, rows ] fact data, loaded with installFacts after the program.
+  def run( self, allProgramData, schema=None, stream=False ) :
 
     allProgramLines = allProgramData[0] # := list of every code line in the generated C4 program.
     tableList       = allProgramData[1] # := list of all tables in generated C4 program.
+    factData        = None              # := optional edb rows loaded from fact files.
+    if len( allProgramData ) > 2 :
+      factData = allProgramData[2]
 
     completeProg    = "".join( allProgramLines )
 
@@ -43,29 +138,151 @@ class C4Wrapper( object ) :
 
     # ----------------------------------------- #
     # initialize c4 instance
-    self.lib.c4_initialize()
-    self.c4_obj = self.lib.c4_make( None, 0 )
+    self.open()
 
     # ---------------------------------------- #
     # load program
-    logging.debug( "SUBMITTING SUBPROG : " )
-    logging.debug( completeProg )
-    c_prog = bytes( completeProg )
-    self.lib.c4_install_str( self.c4_obj, c_prog )
+    try :
+      logging.debug( "SUBMITTING SUBPROG : " )
+      logging.debug( completeProg )
+      self.install( completeProg )
+
+      # ---------------------------------------- #
+      # load facts
+      if factData :
+        self.installFacts( factData )
+    except :
+      self.close()
+      raise
+
+    return self.getResults( tableList, schema, stream )
+
+
+  ################
+  #  RUN CHUNKS  #
+  ################
+  # same contract as run, but the program arrives as an iterable of
+  # [ statements, fact data ] chunks. each chunk is installed as soon as
+  # it is produced, so the complete program text never exists at once.
+  # the c4 instance is torn down if producing or installing a chunk fails.
+  def runChunks( self, chunks, tableList, schema=None, stream=False ) :
+
+    # ----------------------------------------- #
+    # initialize c4 instance
+    self.open()
+
+    # ---------------------------------------- #
+    # load program
+    try :
+      for statements, factData in chunks :
+        if len( statements ) > 0 :
+          logging.debug( "SUBMITTING SUBPROG CHUNK : " + str( len( statements ) ) + " statements" )
+          self.install( "".join( statements ) )
+        if factData :
+          self.installFacts( factData )
+    except :
+      self.close()
+      raise
+
+    return self.getResults( tableList, schema, stream )
+
+
+  #################
+  #  GET RESULTS  #
+  #################
+  # collect the results of the installed program and tear down the c4
+  # instance, or hand both to a ResultCursor when streaming.
+  def getResults( self, tableList, schema=None, stream=False ) :
+
+    # ---------------------------------------- #
+    # stream program results from the live instance
+    if stream :
+      return ResultCursor.ResultCursor( self.lib, self.c4_obj, tableList, schema, self.close, self.lock )
 
     # ---------------------------------------- #
     # dump program results to file
-    results_array = self.saveC4Results_toArray( tableList )
+    if schema is None :
+      results_array = self.saveC4Results_toArray( tableList )
+    else :
+      results_array = self.saveC4Results_toResults( tableList, schema )
 
     # ---------------------------------------- #
     # close c4 program
-    self.lib.c4_destroy( self.c4_obj )
-    self.lib.c4_terminate( )
+    self.close()
 
     # ---------------------------------------- #
     return results_array
 
 
+  ###########
+  #  CLOSE  #
+  ###########
+  # tear down the c4 instance, and the runtime with the last instance.
+  # closing twice is harmless.
+  def close( self ) :
+
+    with self.lock :
+      if self.c4_obj is None :
+        return
+
+      self.lib.c4_destroy( self.c4_obj )
+      self.c4_obj = None
+      releaseRuntime( self.lib )
+
+
+  ###################
+  #  INSTALL FACTS  #
+  ###################
+  # load [ relation name, type list, rows ] fact data into the live c4
+  # instance from fact files. this is not a bulk insert : libc4 has no call
+  # for inserting tuples directly, so every row is still written as one
+  # fact statement, and c4 parses each of them again when the file is
+  # installed. what it saves is on the python side : the rows go straight
+  # to one file per relation with a single c4_install_file call, without
+  # a per row statement list or a joined program string.
+  # return the number of installed rows.
+  def installFacts( self, factData ) :
+
+    numRows = 0
+
+    for relationName, typeList, rows in factData :
+      if len( rows ) == 0 :
+        continue
+
+      fd, path = tempfile.mkstemp( prefix="quest_" + relationName + "_", suffix=".olg" )
+      try :
+        factFile = os.fdopen( fd, "w" )
+        try :
+          self.writeFacts( factFile, relationName, typeList, rows )
+        finally :
+          factFile.close()
+
+        logging.debug( "  INSTALL FACTS : installing " + str( len( rows ) ) + " rows of '" + relationName + "' from " + path )
+        self.installFile( path )
+      finally :
+        os.remove( path )
+
+      numRows += len( rows )
+
+    return numRows
+
+
+  #################
+  #  WRITE FACTS  #
+  #################
+  # write the rows of one relation to an open fact file, one line per row.
+  # string values are escaped as in Quest.format_edb_statements.
+  def writeFacts( self, factFile, relationName, typeList, rows ) :
+
+    if isinstance( rows, RelationBuffer.RelationBuffer ) :
+      facts = rows.formatFacts( relationName )
+    else :
+      facts = RelationBuffer.formatRows( relationName, typeList, rows )
+
+    for fact in facts :
+      factFile.write( fact + "\n" )
+
+
   ##############################
   #  SAVE C4 RESULTS TO ARRAY  #
   ##############################
@@ -77,22 +294,94 @@ class C4Wrapper( object ) :
 
     for table in tableList :
 
+      table_results_str = self.dumpTable( table )
+
       # output to stdout
       logging.debug( "---------------------------" )
       logging.debug( table )
-      logging.debug( self.lib.c4_dump_table( self.c4_obj, table ) )
+      logging.debug( table_results_str )
 
       # save in array
       results_array.append( "---------------------------" )
       results_array.append( table )
 
-      table_results_str   = self.lib.c4_dump_table( self.c4_obj, table )
       table_results_array = table_results_str.split( '\n' )
       results_array.extend( table_results_array[:-1] ) # don't add the last empty space
 
     return results_array
 
 
+  ################################
+  #  SAVE C4 RESULTS TO RESULTS  #
+  ################################
+  # save c4 results to a QuestResults instance.
+  # each dump buffer is decoded into typed tuples in a single pass.
+  def saveC4Results_toResults( self, tableList, schema ) :
+    return ResultCursor.ResultCursor( self.lib, self.c4_obj, tableList, schema, None, self.lock ).toResults()
+
+
+##################
+#  LOAD LIBRARY  #
+##################
+# return libc4, loading it and declaring its prototypes on first use.
+def loadLibrary( ) :
+
+  global library
+
+  with runtimeLock :
+    if library is None :
+      lib = cdll.LoadLibrary( C4_LIB_LOC )
+      for name, prototype in C4_PROTOTYPES.iteritems() :
+        getattr( lib, name ).argtypes = prototype[0]
+        getattr( lib, name ).restype  = prototype[1]
+      library = lib
+
+  return library
+
+
+#####################
+#  ACQUIRE RUNTIME  #
+#####################
+# register a new c4 instance, initializing the runtime for the first one.
+def acquireRuntime( lib ) :
+
+  global runtimeUsers
+
+  with runtimeLock :
+    if runtimeUsers == 0 :
+      lib.c4_initialize()
+    runtimeUsers += 1
+
+
+#####################
+#  RELEASE RUNTIME  #
+#####################
+# unregister a destroyed c4 instance, terminating the runtime after the
+# last one.
+def releaseRuntime( lib ) :
+
+  global runtimeUsers
+
+  with runtimeLock :
+    runtimeUsers -= 1
+    if runtimeUsers == 0 :
+      lib.c4_terminate()
+
+
+######################
+#  RESET AFTER FORK  #
+######################
+# forget the runtime state a fork()ed child inherited from its parent.
+# the parent's c4 instances did not survive the fork, and a parent thread
+# holding runtimeLock at fork time would never release the child's copy.
+def resetAfterFork( ) :
+
+  global runtimeLock, runtimeUsers
+
+  runtimeLock  = threading.Lock()
+  runtimeUsers = 0
+
+
 #########
 #  EOF  #
 #########
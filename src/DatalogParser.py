@@ -0,0 +1,474 @@
+#/usr/bin/env python
+
+##########################################################################
+# DatalogParser usage notes:
+#
+# 1. parseRule turns one query string into a Rule AST :
+#      head       : the goal Atom
+#      body       : list of subgoal Atoms, in order. notin subgoals are
+#                   Atoms with negated set.
+#      qualifiers : list of Qualifiers ( comparisons like X > 3 )
+#    Atom arguments are Terms of kind "variable", "wildcard", "constant",
+#    or "expression".
+#    Ex: parseRule( "a(Z) :- c(_,Y,_,Z), notin b(_,_,Y,_) ;" )
+#        => head a(Z), body [ c(_,Y,_,Z), notin b(_,_,Y,_) ]
+#
+# 2. Parsed rules are cached on the exact rule text in RULE_CACHE, which
+#    is shared across every Quest instance. Rules are never modified
+#    after parsing, so cached ASTs are safe to share. At most
+#    RULE_CACHE_SIZE rules are kept, the least recently used rule is
+#    evicted first.
+#
+##########################################################################
+
+#############
+#  IMPORTS  #
+#############
+# standard python packages
+import logging, sys, threading
+from collections import OrderedDict
+
+# ------------------------------------------------------ #
+
+RULE_CACHE      = OrderedDict()      # rule text => Rule, least recently used first
+RULE_CACHE_SIZE = 4096               # maximum number of cached rules
+RULE_CACHE_LOCK = threading.Lock()   # guards RULE_CACHE
+
+OPERATORS   = [ ":-", "==", "!=", "<=", ">=", "<", ">", "=", "+", "-", "*", "/", "%" ]
+IDENT_CHARS = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_"
+DIGITS      = "0123456789"
+
+# ------------------------------------------------------ #
+# ------------------------------------------------------ #
+
+##########
+#  TERM  #
+##########
+class Term( object ) :
+
+  ################
+  #  ATTRIBUTES  #
+  ################
+  kind      = None   # one of "variable", "wildcard", "constant", "expression"
+  value     = None   # source text of the term
+  variables = None   # variable names referenced by the term
+
+  ##########
+  #  INIT  #
+  ##########
+  def __init__( self, kind, value, variables ) :
+    self.kind      = kind
+    self.value     = value
+    self.variables = variables
+
+  def __repr__( self ) :
+    return self.value
+
+
+##########
+#  ATOM  #
+##########
+class Atom( object ) :
+
+  ################
+  #  ATTRIBUTES  #
+  ################
+  name    = None    # relation name
+  args    = None    # list of Terms
+  negated = False   # True for notin subgoals
+
+  ##########
+  #  INIT  #
+  ##########
+  def __init__( self, name, args, negated=False ) :
+    self.name    = name
+    self.args    = args
+    self.negated = negated
+
+  def getArity( self ) :
+    return len( self.args )
+
+  def __repr__( self ) :
+    atomStr = self.name + "(" + ",".join( [ a.value for a in self.args ] ) + ")"
+    if self.negated :
+      atomStr = "notin " + atomStr
+    return atomStr
+
+
+###############
+#  QUALIFIER  #
+###############
+class Qualifier( object ) :
+
+  ################
+  #  ATTRIBUTES  #
+  ################
+  value     = None   # source text of the qualifier
+  variables = None   # variable names referenced by the qualifier
+
+  ##########
+  #  INIT  #
+  ##########
+  def __init__( self, value, variables ) :
+    self.value     = value
+    self.variables = variables
+
+  def __repr__( self ) :
+    return self.value
+
+
+##########
+#  RULE  #
+##########
+class Rule( object ) :
+
+  ################
+  #  ATTRIBUTES  #
+  ################
+  text       = None   # original query string
+  head       = None   # goal Atom
+  body       = None   # list of subgoal Atoms
+  qualifiers = None   # list of Qualifiers
+
+  ##########
+  #  INIT  #
+  ##########
+  def __init__( self, text, head, body, qualifiers ) :
+    self.text       = text
+    self.head       = head
+    self.body       = body
+    self.qualifiers = qualifiers
+
+  # every atom in the rule, goal first
+  def getAtoms( self ) :
+    return [ self.head ] + self.body
+
+  # every relation referenced by the rule, in order of appearance
+  def getTableNames( self ) :
+    names = []
+    for atom in self.getAtoms() :
+      if not atom.name in names :
+        names.append( atom.name )
+    return names
+
+  # copy of the rule with relation names replaced according to the names
+  # dictionary. the copy's text is its canonical form.
+  def rename( self, names ) :
+
+    def renameAtom( atom ) :
+      return Atom( names.get( atom.name, atom.name ), atom.args, atom.negated )
+
+    rule      = Rule( None, renameAtom( self.head ), [ renameAtom( a ) for a in self.body ], self.qualifiers )
+    rule.text = repr( rule )
+    return rule
+
+  def __repr__( self ) :
+    ruleStr = repr( self.head )
+    items   = [ repr( a ) for a in self.body ] + [ q.value for q in self.qualifiers ]
+    if len( items ) > 0 :
+      ruleStr += " :- " + ", ".join( items )
+    return ruleStr + " ;"
+
+
+################
+#  PARSE RULE  #
+################
+# parse a query string into a Rule, reusing the cached AST when possible.
+# a hit becomes the most recently used rule.
+def parseRule( queryStr ) :
+
+  with RULE_CACHE_LOCK :
+    rule = RULE_CACHE.pop( queryStr, None )
+    if not rule is None :
+      RULE_CACHE[ queryStr ] = rule
+      return rule
+
+  rule = Parser( queryStr ).parseRule()
+
+  with RULE_CACHE_LOCK :
+    RULE_CACHE[ queryStr ] = rule
+    while len( RULE_CACHE ) > RULE_CACHE_SIZE :
+      RULE_CACHE.popitem( last=False )
+
+  return rule
+
+
+##############
+#  TOKENIZE  #
+##############
+# split a query string into ( kind, text ) tokens.
+# kinds : "name", "variable", "wildcard", "number", "string", "op", "punct"
+def tokenize( queryStr ) :
+
+  tokens = []
+  i      = 0
+  n      = len( queryStr )
+
+  while i < n :
+    c = queryStr[i]
+
+    # whitespace
+    if c.isspace() :
+      i += 1
+
+    # line comments
+    elif queryStr.startswith( "//", i ) :
+      end = queryStr.find( "\n", i )
+      if end < 0 :
+        end = n
+      i = end
+
+    # string literals
+    elif c == '"' :
+      j = i + 1
+      while j < n and not queryStr[j] == '"' :
+        if queryStr[j] == "\\" :
+          j += 1
+        j += 1
+      if j >= n :
+        sys.exit( "ERROR : unterminated string literal in query '" + queryStr + "'. aborting..." )
+      tokens.append( ( "string", queryStr[ i : j+1 ] ) )
+      i = j + 1
+
+    # numbers
+    elif c in DIGITS :
+      j = i
+      while j < n and ( queryStr[j] in DIGITS or queryStr[j] == "." ) :
+        j += 1
+      tokens.append( ( "number", queryStr[ i : j ] ) )
+      i = j
+
+    # identifiers
+    elif c in IDENT_CHARS :
+      j = i
+      while j < n and queryStr[j] in IDENT_CHARS :
+        j += 1
+      ident = queryStr[ i : j ]
+      if ident == "_" :
+        tokens.append( ( "wildcard", ident ) )
+      elif ident[0].isupper() :
+        tokens.append( ( "variable", ident ) )
+      else :
+        tokens.append( ( "name", ident ) )
+      i = j
+
+    # punctuation
+    elif c in "(),;" :
+      tokens.append( ( "punct", c ) )
+      i += 1
+
+    # location specifiers are kept as part of the following term
+    elif c == "@" :
+      tokens.append( ( "op", c ) )
+      i += 1
+
+    # operators
+    else :
+      for op in OPERATORS :
+        if queryStr.startswith( op, i ) :
+          tokens.append( ( "op", op ) )
+          i += len( op )
+          break
+      else :
+        sys.exit( "ERROR : unrecognized character '" + c + "' in query '" + queryStr + "'. aborting..." )
+
+  return tokens
+
+
+############
+#  PARSER  #
+############
+# recursive descent parser over the token list of a single rule.
+class Parser( object ) :
+
+  ################
+  #  ATTRIBUTES  #
+  ################
+  text   = None   # query string under consideration
+  tokens = None   # token list
+  pos    = 0      # index of the next token
+
+  ##########
+  #  INIT  #
+  ##########
+  def __init__( self, queryStr ) :
+    self.text   = queryStr
+    self.tokens = tokenize( queryStr )
+    self.pos    = 0
+
+
+  ################
+  #  PARSE RULE  #
+  ################
+  # rule := atom [ ":-" item { "," item } ] [ ";" ]
+  def parseRule( self ) :
+
+    head       = self.parseAtom( False )
+    body       = []
+    qualifiers = []
+
+    if self.peek() == ( "op", ":-" ) :
+      self.pos += 1
+      while True :
+        item = self.parseBodyItem()
+        if isinstance( item, Atom ) :
+          body.append( item )
+        else :
+          qualifiers.append( item )
+
+        if self.peek() == ( "punct", "," ) :
+          self.pos += 1
+        else :
+          break
+
+    if self.peek() == ( "punct", ";" ) :
+      self.pos += 1
+
+    if self.pos < len( self.tokens ) :
+      self.fail( "unexpected '" + self.tokens[ self.pos ][1] + "'" )
+
+    return Rule( self.text, head, body, qualifiers )
+
+
+  #####################
+  #  PARSE BODY ITEM  #
+  #####################
+  # item := "notin" atom | atom | qualifier
+  def parseBodyItem( self ) :
+
+    tok = self.peek()
+
+    if tok == ( "name", "notin" ) :
+      self.pos += 1
+      return self.parseAtom( True )
+
+    elif tok and tok[0] == "name" and self.peek( 1 ) == ( "punct", "(" ) :
+      return self.parseAtom( False )
+
+    else :
+      tokens = self.collect( [ ",", ";" ] )
+      if len( tokens ) == 0 :
+        self.fail( "empty subgoal" )
+      return Qualifier( joinTokens( tokens ), getVariables( tokens ) )
+
+
+  ################
+  #  PARSE ATOM  #
+  ################
+  # atom := name "(" [ term { "," term } ] ")"
+  def parseAtom( self, negated ) :
+
+    tok = self.peek()
+    if not tok or not tok[0] == "name" :
+      self.fail( "expected relation name" )
+    self.pos += 1
+
+    if not self.peek() == ( "punct", "(" ) :
+      self.fail( "expected '(' after '" + tok[1] + "'" )
+    self.pos += 1
+
+    args = []
+    if self.peek() == ( "punct", ")" ) :
+      self.pos += 1
+      return Atom( tok[1], args, negated )
+
+    while True :
+      tokens = self.collect( [ ",", ")" ] )
+      if len( tokens ) == 0 :
+        self.fail( "empty argument in '" + tok[1] + "'" )
+      args.append( makeTerm( tokens ) )
+
+      nxt = self.peek()
+      self.pos += 1
+      if nxt == ( "punct", ")" ) :
+        break
+      elif not nxt == ( "punct", "," ) :
+        self.fail( "unterminated argument list in '" + tok[1] + "'" )
+
+    return Atom( tok[1], args, negated )
+
+
+  #############
+  #  COLLECT  #
+  #############
+  # gather tokens up to the next depth-zero punctuation in stops.
+  def collect( self, stops ) :
+
+    tokens = []
+    depth  = 0
+
+    while self.pos < len( self.tokens ) :
+      kind, text = self.tokens[ self.pos ]
+      if kind == "punct" :
+        if depth == 0 and text in stops :
+          break
+        elif text == "(" :
+          depth += 1
+        elif text == ")" :
+          depth -= 1
+      tokens.append( ( kind, text ) )
+      self.pos += 1
+
+    return tokens
+
+
+  ##########
+  #  PEEK  #
+  ##########
+  def peek( self, offset=0 ) :
+    if self.pos + offset < len( self.tokens ) :
+      return self.tokens[ self.pos + offset ]
+    return None
+
+
+  ##########
+  #  FAIL  #
+  ##########
+  def fail( self, reason ) :
+    sys.exit( "ERROR : could not parse query '" + self.text + "' : " + reason + ". aborting..." )
+
+
+###############
+#  MAKE TERM  #
+###############
+# build a Term from the tokens of one atom argument
+def makeTerm( tokens ) :
+
+  if len( tokens ) == 1 :
+    kind, text = tokens[0]
+    if kind == "variable" :
+      return Term( "variable", text, [ text ] )
+    elif kind == "wildcard" :
+      return Term( "wildcard", text, [] )
+    elif kind in [ "number", "string", "name" ] :
+      return Term( "constant", text, [] )
+
+  return Term( "expression", joinTokens( tokens ), getVariables( tokens ) )
+
+
+###################
+#  GET VARIABLES  #
+###################
+def getVariables( tokens ) :
+  variables = []
+  for kind, text in tokens :
+    if kind == "variable" and not text in variables :
+      variables.append( text )
+  return variables
+
+
+#################
+#  JOIN TOKENS  #
+#################
+def joinTokens( tokens ) :
+  joined = []
+  for kind, text in tokens :
+    if len( joined ) > 0 and not joined[-1] == "@" :
+      joined.append( " " )
+    joined.append( text )
+  return "".join( joined )
+
+
+#########
+#  EOF  #
+#########
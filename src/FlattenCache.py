@@ -0,0 +1,154 @@
+#/usr/bin/env python
+
+##########################################################################
+# FlattenCache usage notes:
+#
+# 1. A FlattenCache keeps the flattened and formatted facts of single
+#    top-level keys of dict relations across Quest runs. Entries are
+#    keyed by the relation, the top-level key, the relation schema and a
+#    digest of the key's value, so a key whose value changed in the store
+#    simply misses and is flattened again.
+#    Ex: cache = FlattenCache.FlattenCache( 64 * 1024 * 1024 )
+#        q.setFlattenCache( cache )
+#        q.run()   # flattens every key
+#        q.run()   # only flattens keys whose values changed
+#
+# 2. The least recently used entries are evicted once the estimated size
+#    of all entries exceeds the memory budget in bytes. A single cache
+#    can be shared by several Quest instances, also on several threads.
+#
+##########################################################################
+
+#############
+#  IMPORTS  #
+#############
+# standard python packages
+import hashlib, logging, sys, threading
+from collections import OrderedDict
+
+# ------------------------------------------------------ #
+# ------------------------------------------------------ #
+
+class FlattenCache( object ) :
+
+  ################
+  #  ATTRIBUTES  #
+  ################
+  maxBytes  = 0      # memory budget of all entries, in bytes
+  usedBytes = 0      # estimated size of all entries, in bytes
+  entries   = None   # ordered dictionary mapping cache keys to
+                     # [ value, size ], least recently used first
+  hits      = 0      # number of lookups served from the cache
+  misses    = 0      # number of lookups that had to be computed
+  lock      = None   # threading.Lock guarding the entries and the counters
+
+  ##########
+  #  INIT  #
+  ##########
+  def __init__( self, maxBytes ) :
+    self.maxBytes  = maxBytes
+    self.usedBytes = 0
+    self.entries   = OrderedDict()
+    self.hits      = 0
+    self.misses    = 0
+    self.lock      = threading.Lock()
+
+
+  #########
+  #  GET  #
+  #########
+  # return the cached value for key, or None. a hit becomes the most
+  # recently used entry.
+  def get( self, key ) :
+
+    with self.lock :
+      entry = self.entries.pop( key, None )
+
+      if entry is None :
+        self.misses += 1
+        return None
+
+      self.entries[ key ] = entry
+      self.hits += 1
+      return entry[0]
+
+
+  #########
+  #  PUT  #
+  #########
+  # store value under key, evicting least recently used entries until the
+  # cache fits its budget again. values larger than the budget are not
+  # stored.
+  def put( self, key, value, size ) :
+
+    with self.lock :
+      old = self.entries.pop( key, None )
+      if old :
+        self.usedBytes -= old[1]
+
+      if size > self.maxBytes :
+        return
+
+      self.entries[ key ] = [ value, size ]
+      self.usedBytes     += size
+
+      while self.usedBytes > self.maxBytes :
+        evictedKey, evicted = self.entries.popitem( last=False )
+        self.usedBytes     -= evicted[1]
+        logging.debug( "  FLATTENCACHE : evicted " + str( evictedKey[:2] ) )
+
+
+  ################
+  #  INVALIDATE  #
+  ################
+  # drop every entry of the given relation, or every entry if None.
+  def invalidate( self, relationName=None ) :
+
+    with self.lock :
+      if relationName is None :
+        self.entries   = OrderedDict()
+        self.usedBytes = 0
+        return
+
+      for key in self.entries.keys() :
+        if key[0] == relationName :
+          self.usedBytes -= self.entries.pop( key )[1]
+
+
+  #########
+  #  LEN  #
+  #########
+  def __len__( self ) :
+    with self.lock :
+      return len( self.entries )
+
+
+##############
+#  MAKE KEY  #
+##############
+# build the cache key of one top-level key of a relation. mode separates
+# entries holding rows from entries holding formatted statements.
+def makeKey( relationName, key, value, typeList, mode ) :
+  digest = hashlib.md5( repr( value ) ).hexdigest()
+  return ( relationName, key, tuple( typeList ), mode, digest )
+
+
+###################
+#  ESTIMATE SIZE  #
+###################
+# rough memory footprint of a list of statements or rows, in bytes.
+def estimateSize( values ) :
+
+  size = sys.getsizeof( values )
+  for v in values :
+    size += sys.getsizeof( v )
+    if type( v ) is list or type( v ) is tuple :
+      for item in v :
+        size += sys.getsizeof( item )
+
+  return size
+
+
+#########
+#  EOF  #
+#########
@@ -21,8 +21,10 @@
 #  IMPORTS  #
 #############
 # standard python packages
-import copy, logging, math, os, pickledb, string, sys, unittest
-import C4Wrapper
+import copy, hashlib, logging, os, pickledb, string, sys, unittest
+from itertools import islice, product
+from multiprocessing.pool import ThreadPool
+import C4Session, C4Wrapper, DatalogParser, FlattenCache, QuestJob, QuestResults, RelationBuffer, RelationTemplate, ResultCache, RuleOptimizer
 
 # ------------------------------------------------------ #
 
@@ -42,6 +44,21 @@ import settings
 
 DEBUG = settings.DEBUG
 
+# python types accepted for each schema data type
+SCHEMA_TYPES = RelationBuffer.SCHEMA_TYPES
+
+# value types treated as primatives when flattening relation data
+PRIMATIVE_TYPES = RelationTemplate.PRIMATIVE_TYPES
+
+# getRelationData work stack operations
+FLATTEN    = 0   # flatten a raw value
+RESULT     = 1   # push an already flattened sub relation
+MERGE_LIST = 2   # cross product of the last n sub relations
+MERGE_DICT = 3   # concatenation of the last n sub relations
+
+# rows of a list relation handed to a RelationBuffer at a time
+BUFFER_BATCH = 10000
+
 class Quest( object ) :
 
   ################
@@ -50,16 +67,59 @@ class Quest( object ) :
   nosql_type = None   # the type of nosql database under consideration
   dbcursor   = None   # pointer to target database instance
 
-  queryList  = []     # list of query strings
-  schema     = {}     # dictionary mapping each EDB and IDB relation name 
+  queryList  = None   # list of query strings
+  schema     = None   # dictionary mapping each EDB and IDB relation name 
                       # to an array listing the datatypes for each attribute.
 
+  session    = None   # optional C4Session reused across runs
+  outputs    = None   # optional list of relations to dump. all tables if None.
+
+  engine_pool = None   # optional C4Pool evaluating programs in worker processes
+
+  edb_arities = None  # dictionary mapping relation names to the arity of
+                      # the edb rows formatted during the last run.
+
+  templates       = None    # dictionary mapping relation names to RelationTemplates
+  infer_templates = False   # infer and cache a template per relation on first fetch
+
+  factorize_threshold = None   # emit cross products of at least this many rows
+                               # as helper relations plus a rule. off if None.
+  factor_defines      = None   # define statements of the helper relations
+  factor_rules        = None   # rules rebuilding the factorized cross products
+  factor_layouts      = None   # relation name => { part widths : helper names }
+
+  bulk_load = False   # hand edb rows to c4 as per relation fact files
+  columnar  = False   # collect edb rows in RelationBuffers instead of lists
+
+  share_subexpressions = False   # derive rule bodies shared by several rules once
+
+  flatten_cache = None   # optional FlattenCache of per key facts of dict relations
+  result_cache  = None   # optional ResultCache of whole runs
+  prefetched    = None   # raw values already read for the current run
+
+  fetch_concurrency = None   # maximum number of concurrent store reads.
+                             # relations are fetched one by one if None.
+
+  flatten_pool       = None    # optional multiprocessing.Pool flattening large
+                               # relations. everything stays in-process if None.
+  parallel_threshold = 10000   # minimum number of top-level keys for a dict
+                               # relation to be flattened in the process pool.
+  fact_data = None    # list of [ relation name, type list, rows ] for bulk loading
+
   ##########
   #  INIT  #
   ##########
   def __init__( self, nosql_type, dbcursor ) :
     self.dbcursor   = dbcursor
     self.nosql_type = nosql_type
+    self.templates  = {}
+
+    # per instance, so Quests on other threads never see these rules
+    self.queryList      = []
+    self.schema         = {}
+    self.factor_defines = []
+    self.factor_rules   = []
+    self.fact_data      = []
 
 
   ################
@@ -78,12 +138,128 @@ class Quest( object ) :
   #########
   # execute the queries over the target database and 
   # use c4 to complete the evaluation process.
-  def run( self ) :
+  # if structured is set, results come back as a QuestResults instance
+  # mapping each relation to a list of typed tuples.
+  # if stream is set, results come back as a ResultCursor which dumps
+  # and decodes one relation at a time.
+  # if outputs is set ( or setOutputs was called ), only those relations
+  # are dumped and parsed.
+  # if setBulkLoad was called, edb facts are loaded from per relation fact
+  # files and do not appear in the returned program statements.
+  # if batch_size is set, the program is installed in chunks as it is
+  # produced : defines, then edb facts in batches of batch_size, then rules.
+  # if keep_program is not set, the program statements are not kept and
+  # None is returned in their place.
+  # if setResultCache was called, runs over unchanged data are served
+  # from the cache. streamed runs and runs through a session, whose
+  # results also depend on earlier runs, are always evaluated.
+  # rules and relations that cannot contribute to the dumped relations
+  # are left out of the program and never fetched.
+  def run( self, structured=False, stream=False, outputs=None, batch_size=None, keep_program=True ) :
 
     # --------------------------------------- #
     # get the table list
     table_list = self.getTableList()
 
+    # --------------------------------------- #
+    # only dump the requested relations
+    dump_list = self.getOutputList( table_list, outputs )
+
+    # --------------------------------------- #
+    # only evaluate what the dumped relations depend on
+    queries    = self.getRelevantQueries( dump_list )
+    table_list = self.getRelevantTables( table_list, queries, dump_list )
+
+    # --------------------------------------- #
+    # look up the run in the result cache
+    cacheKey = None
+    if not self.result_cache is None and not stream and not self.session :
+      fetched  = list( self.iterRawValues( table_list ) )
+      cacheKey = self.getResultKey( table_list, dump_list, structured, fetched, queries )
+      cached   = self.result_cache.get( cacheKey, keep_program )
+
+      if not cached is None :
+        logging.debug( "  RUN : serving run from the result cache" )
+        if keep_program :
+          return [ cached[0], table_list, cached[1] ]
+        return [ None, table_list, cached[1] ]
+
+      # reuse the raw values when evaluating
+      self.prefetched = fetched
+
+    try :
+      allProgramData = self.evaluate( table_list, dump_list, structured, stream, batch_size, keep_program, queries )
+    finally :
+      self.prefetched = None
+
+    if cacheKey :
+      self.result_cache.put( cacheKey, allProgramData[0], allProgramData[2], table_list )
+
+    return allProgramData
+
+
+  ###############
+  #  RUN ASYNC  #
+  ###############
+  # start run on a background thread and return its QuestJob right away.
+  # takes the same arguments as run. callback, if set, is called with the
+  # job once the run has finished, failed, or been cancelled.
+  # only one run per Quest instance may be in flight at a time.
+  def run_async( self, structured=False, stream=False, outputs=None, batch_size=None, keep_program=True, callback=None ) :
+
+    def target( ) :
+      return self.run( structured, stream, outputs, batch_size, keep_program )
+
+    return QuestJob.QuestJob( target, callback ).start()
+
+
+  #####################
+  #  CHECK CANCELLED  #
+  #####################
+  # raise RunCancelled if the QuestJob running on this thread was cancelled.
+  # called between relation reads, program chunks, and before c4 runs, so
+  # the c4 wrappers tear down their instance on the way out.
+  def checkCancelled( self ) :
+    job = QuestJob.currentJob()
+    if not job is None and job.cancelled() :
+      raise QuestJob.RunCancelled( "run cancelled" )
+
+
+  ##############
+  #  EVALUATE  #
+  ##############
+  # fetch, flatten, and format the edbs, then evaluate the program with c4.
+  # see run for the arguments. queries lists the rules to install.
+  def evaluate( self, table_list, dump_list, structured, stream, batch_size, keep_program, queries ) :
+
+    # --------------------------------------- #
+    # run c4 program evaluation
+    if structured or stream :
+      schema = self.schema
+    else :
+      schema = None
+
+    # --------------------------------------- #
+    # install the program chunk by chunk
+    if batch_size :
+
+      if keep_program :
+        formatted_statements = []
+      else :
+        formatted_statements = None
+
+      chunks = self.iterProgram( table_list, batch_size, formatted_statements, queries )
+
+      if self.session :
+        results_array = self.session.runChunks( chunks, dump_list, schema, stream )
+      elif self.engine_pool and not stream :
+        results_array = self.engine_pool.runChunks( chunks, dump_list, schema )
+      else :
+        w             = C4Wrapper.C4Wrapper( ) # initializes c4 wrapper instance
+        results_array = w.runChunks( chunks, dump_list, schema, stream )
+
+      return [ formatted_statements, table_list, results_array ]
+
     # --------------------------------------- #
     # get define statements
     c4_define_statements = self.getDefineStatements( table_list )
@@ -94,34 +270,402 @@ class Quest( object ) :
 
     # --------------------------------------- #
     # sanity checks
-    self.verifyArities( c4_define_statements, c4_edb_statements, self.queryList, table_list )
-    self.verifyDataTypes( c4_define_statements, c4_edb_statements, self.queryList, table_list )
+    self.verifyArities( table_list )
+    self.verifyDataTypes( table_list )
 
     # --------------------------------------- #
     # format results
-    formatted_statements = c4_define_statements + c4_edb_statements + self.queryList
+    helper_defines, rules = self.getProgramRules( queries )
+    formatted_statements  = c4_define_statements + helper_defines + self.factor_defines + c4_edb_statements + rules + self.factor_rules
 
     # --------------------------------------- #
     # run c4 program evaluation
-    w             = C4Wrapper.C4Wrapper( ) # initializes c4 wrapper instance
-    results_array = w.run( [ formatted_statements, table_list ] )
+    self.checkCancelled()
+
+    programData = [ formatted_statements, dump_list ]
+    if self.bulk_load :
+      programData.append( self.fact_data )
+
+    # the rows are installed in c4 now, the instance must not keep them
+    try :
+      results_array = self.evaluateProgram( programData, schema, stream )
+    finally :
+      self.fact_data = []
 
     # --------------------------------------- #
-    logging.debug( "  RUN : formatted_statements = " + str( formatted_statements ) )
-    logging.debug( "  RUN : table_list           = " + str( table_list ) )
-    logging.debug( "  RUN : results_array        = " + str( results_array ) )
+    if logging.getLogger().isEnabledFor( logging.DEBUG ) :
+      logging.debug( "  RUN : formatted_statements = " + str( formatted_statements ) )
+      logging.debug( "  RUN : table_list           = " + str( table_list ) )
+      logging.debug( "  RUN : results_array        = " + str( results_array ) )
+
+    if not keep_program :
+      formatted_statements = None
 
     return [ formatted_statements, table_list, results_array ]
 
 
+  ######################
+  #  EVALUATE PROGRAM  #
+  ######################
+  # hand complete program data to the session, the engine pool, or a fresh
+  # c4 wrapper, and return the results.
+  def evaluateProgram( self, programData, schema, stream ) :
+
+    if self.session :
+      return self.session.run( programData, schema, stream )
+    elif self.engine_pool and not stream :
+      return self.engine_pool.run( programData, schema )
+    else :
+      w = C4Wrapper.C4Wrapper( ) # initializes c4 wrapper instance
+      return w.run( programData, schema, stream )
+
+
+  ###############
+  #  RUN BATCH  #
+  ###############
+  # evaluate several independent rule sets in a single c4 program.
+  # ruleSets is a list of query lists. outputsList optionally lists the
+  # relations to dump for each rule set, None meaning all of its tables.
+  # the idb relations of rule set i, the relations its rules derive, are
+  # renamed to <name>_qb<i> so rule sets never see each other's
+  # derivations. every relation is fetched, formatted, and installed once
+  # for the whole batch, and the dumped results are split back per rule
+  # set under the original relation names. as in run, store values kept
+  # under idb names are fetched too, and copied into each rule set's
+  # renamed relation.
+  # return one [ formatted_statements, table_list, results ] entry per rule
+  # set, like run would for that rule set alone. formatted_statements is
+  # the batch program, shared by every entry.
+  # the query list of the instance is not used.
+  def runBatch( self, ruleSets, outputsList=None, structured=False ) :
+
+    if outputsList is None :
+      outputsList = [ None ] * len( ruleSets )
+
+    table_lists = []   # tables of each rule set
+    dump_lists  = []   # outputs of each rule set
+    renamings   = []   # idb name => namespaced name, per rule set
+    edb_list    = []   # relations fetched for the whole batch
+    queryLists  = []   # rules of each rule set the outputs depend on
+
+    for i in range( 0, len( ruleSets ) ) :
+      table_list = self.getTableList( ruleSets[i] )
+      dump_list  = self.getOutputList( table_list, outputsList[i] )
+
+      # only evaluate what the outputs depend on
+      queries    = self.getRelevantQueries( dump_list, ruleSets[i] )
+      table_list = self.getRelevantTables( table_list, queries, dump_list )
+
+      names = {}
+      for rule in self.getRules( queries ) :
+        names[ rule.head.name ] = rule.head.name + "_qb" + str( i )
+
+      for t in table_list :
+        if not t in edb_list :
+          edb_list.append( t )
+
+      table_lists.append( table_list )
+      dump_lists.append( dump_list )
+      renamings.append( names )
+      queryLists.append( queries )
+
+    # --------------------------------------- #
+    # get EDBs once for the whole batch
+    c4_edb_statements = self.getEDBs( edb_list )
+
+    # --------------------------------------- #
+    # sanity checks, per rule set under its own names
+    for i in range( 0, len( ruleSets ) ) :
+      self.verifyArities( table_lists[i], ruleSets[i] )
+      self.verifyDataTypes( table_lists[i], ruleSets[i] )
+
+    # --------------------------------------- #
+    # namespace the idb relations
+    c4_define_statements = self.getDefineStatements( edb_list )
+    batch_rules          = []
+    batch_schema         = dict( [ ( t, self.schema[t] ) for t in edb_list ] )
+    batch_dump_list      = []
+
+    for i in range( 0, len( ruleSets ) ) :
+      names = renamings[i]
+
+      for t in table_lists[i] :
+        if t in names :
+          c4_define_statements.append( self.format_define_statement( names[t], self.schema[t] ) )
+          batch_schema[ names[t] ] = self.schema[t]
+
+      for t in dump_lists[i] :
+        if not names.get( t, t ) in batch_dump_list :
+          batch_dump_list.append( names.get( t, t ) )
+
+      batch_rules.extend( [ rule.rename( names ).text for rule in self.getRules( queryLists[i] ) ] )
+
+    helper_defines, batch_rules = self.getProgramRules( batch_rules, batch_schema )
+
+    # store values kept under idb names seed the renamed relations
+    for i in range( 0, len( ruleSets ) ) :
+      for t in table_lists[i] :
+        if t in renamings[i] and t in self.edb_arities :
+          variables = ",".join( [ "C" + str( j ) for j in range( 0, len( self.schema[t] ) ) ] )
+          batch_rules.append( renamings[i][t] + "(" + variables + ") :- " + t + "(" + variables + ") ;" )
+
+    formatted_statements        = c4_define_statements + helper_defines + self.factor_defines + c4_edb_statements + batch_rules + self.factor_rules
+
+    # --------------------------------------- #
+    # run c4 program evaluation
+    self.checkCancelled()
+
+    programData = [ formatted_statements, batch_dump_list ]
+    if self.bulk_load :
+      programData.append( self.fact_data )
+
+    try :
+      if structured :
+        results = self.evaluateProgram( programData, batch_schema, False )
+      else :
+        results = self.getResultBlocks( self.evaluateProgram( programData, None, False ) )
+    finally :
+      self.fact_data = []
+
+    # --------------------------------------- #
+    # split the results per rule set
+    allProgramData = []
+
+    for i in range( 0, len( ruleSets ) ) :
+      results_array = self.getRenamedResults( results, dump_lists[i], renamings[i], structured )
+      allProgramData.append( [ formatted_statements, table_lists[i], results_array ] )
+
+    return allProgramData
+
+
+  #######################
+  #  GET PROGRAM RULES  #
+  #######################
+  # return [ helper define statements, rule texts ] to install for the
+  # given queries ( the query list of the instance if None ). if
+  # setShareSubexpressions was called, bodies shared by several rules are
+  # derived once into helper relations typed from schema ( the schema of
+  # the instance if None ).
+  def getProgramRules( self, queryList=None, schema=None ) :
+
+    if queryList is None :
+      queryList = self.queryList
+
+    if not self.share_subexpressions :
+      return [ [], list( queryList ) ]
+
+    if schema is None :
+      schema = self.schema
+
+    helpers, rules = RuleOptimizer.shareSubexpressions( self.getRules( queryList ), schema )
+    defines        = [ self.format_define_statement( name, typeList ) for name, typeList in helpers ]
+
+    return [ defines, rules ]
+
+
+  #########################
+  #  GET RENAMED RESULTS  #
+  #########################
+  # results of the relations in dump_list, read under their renamed names
+  # from results, a QuestResults instance if structured is set or else a
+  # dictionary from getResultBlocks. return them under the original names
+  # as run would.
+  def getRenamedResults( self, results, dump_list, names, structured ) :
+
+    if structured :
+      results_array = QuestResults.QuestResults()
+      for t in dump_list :
+        results_array.addRelation( t, results.getRelation( names.get( t, t ) ) )
+      return results_array
+
+    results_array = []
+    for t in dump_list :
+      results_array.append( "---------------------------" )
+      results_array.append( t )
+      results_array.extend( results[ names.get( t, t ) ] )
+
+    return results_array
+
+
+  #######################
+  #  GET RESULT BLOCKS  #
+  #######################
+  # split a flat results array into a dictionary mapping each dumped
+  # relation name to its list of result lines.
+  def getResultBlocks( self, results_array ) :
+
+    blocks = {}
+    rows   = None
+    i      = 0
+
+    while i < len( results_array ) :
+      if results_array[i] == "---------------------------" and i + 1 < len( results_array ) :
+        rows = blocks.setdefault( results_array[ i+1 ], [] )
+        i   += 2
+      else :
+        rows.append( results_array[i] )
+        i   += 1
+
+    return blocks
+
+
+  ####################
+  #  GET RESULT KEY  #
+  ####################
+  # build the result cache key of a run from the canonical rule texts,
+  # the schema of every relation in table_list, the fingerprint of every
+  # fetched raw value, and the requested outputs. queries overrides the
+  # query list of the instance.
+  def getResultKey( self, table_list, dump_list, structured, fetched, queries=None ) :
+
+    rules  = [ repr( rule ) for rule in self.getRules( queries ) ]
+    schema = [ ( t, self.schema.get( t, [] ) ) for t in table_list ]
+
+    fingerprints = []
+    for relationName, raw_value, error in fetched :
+      if error :
+        fingerprints.append( ( relationName, "error:" + type( error ).__name__ ) )
+      else :
+        fingerprints.append( ( relationName, ResultCache.fingerprint( raw_value ) ) )
+
+    return ResultCache.makeKey( rules, schema, fingerprints, dump_list, structured )
+
+
+  ##########################
+  #  GET RELEVANT QUERIES  #
+  ##########################
+  # return the queries that can contribute to the relations in dump_list.
+  # the rules form a dependency graph from each goal relation to every
+  # relation in its body, notin subgoals included. a rule is relevant if
+  # its goal is reachable from a dumped relation in that graph.
+  # queryList overrides the query list of the instance.
+  def getRelevantQueries( self, dump_list, queryList=None ) :
+
+    if queryList is None :
+      queryList = self.queryList
+
+    rules = self.getRules( queryList )
+
+    dependencies = {} # goal relation => relations read by its rules
+    for rule in rules :
+      dependencies.setdefault( rule.head.name, set() ).update( [ atom.name for atom in rule.body ] )
+
+    relevant = set()
+    stack    = list( dump_list )
+    while len( stack ) > 0 :
+      relationName = stack.pop()
+      if not relationName in relevant :
+        relevant.add( relationName )
+        stack.extend( dependencies.get( relationName, [] ) )
+
+    queries = [ queryList[i] for i in range( 0, len( rules ) ) if rules[i].head.name in relevant ]
+
+    if len( queries ) < len( queryList ) :
+      logging.debug( "  GETRELEVANTQUERIES : dropped " + str( len( queryList ) - len( queries ) ) + " rules not contributing to " + str( dump_list ) )
+
+    return queries
+
+
+  #########################
+  #  GET RELEVANT TABLES  #
+  #########################
+  # narrow table_list, in order, to the tables of queries and dump_list.
+  def getRelevantTables( self, table_list, queries, dump_list ) :
+
+    relevant = set( self.getTableList( queries ) ).union( dump_list )
+    return [ t for t in table_list if t in relevant ]
+
+
+  #####################
+  #  GET OUTPUT LIST  #
+  #####################
+  # pick the relations to dump after evaluation.
+  # explicit outputs take precedence over outputs marked with setOutputs.
+  def getOutputList( self, table_list, outputs=None ) :
+
+    if outputs is None :
+      outputs = self.outputs
+
+    if outputs is None :
+      return table_list
+
+    for relationName in outputs :
+      if not relationName in table_list :
+        sys.exit( "ERROR : output relation '" + str( relationName ) + "' does not appear in any query. aborting..." )
+
+    return list( outputs )
+
+
   #######################
   #  VERIFY DATA TYPES  #
   #######################
   # make sure the relation primitive data types match across relevant 
   # define, edb, and sub/goal statements.
   # supported primitive data types are : strings, ints, floats, bools
-  def verifyDataTypes( self, c4_define_statements, c4_edb_statements, queryList, table_list ) :
-    return None
+  # edb values are checked against the schema as rows are formatted in
+  # format_edb_statements. this pass checks every rule constant against the
+  # schema and makes sure each rule variable is bound to a single type.
+  # queryList overrides the query list of the instance.
+  def verifyDataTypes( self, table_list, queryList=None ) :
+
+    for rule in self.getRules( queryList ) :
+
+      varTypes = {} # variable name => ( type, relation name )
+
+      # body atoms bind variables before the goal is checked against them
+      for atom in rule.body + [ rule.head ] :
+
+        typeList = self.schema.get( atom.name, [] )
+
+        for i in range( 0, min( len( atom.args ), len( typeList ) ) ) :
+          term      = atom.args[i]
+          attribute = typeList[i]
+
+          if term.kind == "constant" :
+            if not self.isConstantOfType( term.value, attribute ) :
+              sys.exit( "ERROR : query '" + rule.text + "' uses constant " + term.value + " for attribute " + str( i ) + " of table '" + atom.name + "', which has type " + attribute + ". aborting..." )
+
+          elif term.kind == "variable" :
+            if not term.value in varTypes :
+              varTypes[ term.value ] = ( attribute, atom.name )
+            elif not self.isCompatibleType( varTypes[ term.value ][0], attribute ) :
+              sys.exit( "ERROR : query '" + rule.text + "' uses variable " + term.value + " as type " + varTypes[ term.value ][0] + " in table '" + varTypes[ term.value ][1] + "' and as type " + attribute + " in table '" + atom.name + "'. aborting..." )
+
+
+  ########################
+  #  IS COMPATIBLE TYPE  #
+  ########################
+  # check if values of two schema types can be joined
+  def isCompatibleType( self, type1, type2 ) :
+
+    numeric = [ "int", "float" ]
+
+    if type1 == type2 :
+      return True
+    elif type1 in numeric and type2 in numeric :
+      return True
+    elif not type1 in SCHEMA_TYPES or not type2 in SCHEMA_TYPES :
+      return True # unknown types are left to c4
+    else :
+      return False
+
+
+  #########################
+  #  IS CONSTANT OF TYPE  #
+  #########################
+  # check if a constant from a query fits the given schema type
+  def isConstantOfType( self, value, attribute ) :
+
+    if attribute == "string" :
+      return value.startswith( '"' )
+    elif attribute == "int" :
+      return value.isdigit()
+    elif attribute == "float" :
+      return value.replace( ".", "", 1 ).isdigit()
+    elif attribute == "bool" :
+      return value in [ "true", "false" ]
+    else :
+      return True # unknown types are left to c4
 
 
   ####################
@@ -129,22 +673,23 @@ class Quest( object ) :
   ####################
   # make sure the relation arities match across relevant 
   # define, edb, and sub/goal statements.
-  def verifyArities( self, c4_define_statements, c4_edb_statements, queryList, table_list  ) :
+  # define arities come straight from the schema, edb arities are recorded
+  # while formatting rows, and query arities come from one pass over the
+  # parsed rules. queryList overrides the query list of the instance, and
+  # edbArities the edb arities of the last run.
+  def verifyArities( self, table_list, queryList=None, edbArities=None ) :
 
-    #print "c4_define_statements : " + str( c4_define_statements )
-    #print "c4_edb_statements    : " + str( c4_edb_statements )
-    #print "queryList            : " + str( queryList )
-    #print "table_list           : " + str( table_list )
+    if queryList is None :
+      queryList = self.queryList
+    if edbArities is None :
+      edbArities = self.edb_arities
 
-    for table in table_list :
-      define_arity    = self.getDefineArity( c4_define_statements, table )
-      edb_arity       = self.getEDBArity( c4_edb_statements, table )
-      queryList_arity = self.getQueryListArity( queryList, table )
+    queryArities = self.getQueryArities( queryList )
 
-      #print ">> table = " + table,
-      #print "define_arity    : " + str( define_arity )
-      #print "edb_arity       : " + str( edb_arity )
-      #print "queryList_arity : " + str( queryList_arity )
+    for table in table_list :
+      define_arity    = self.getDefineArity( table )
+      edb_arity       = edbArities.get( table, -1 )
+      queryList_arity = queryArities.get( table, -1 )
 
       # make sure every table has a define statement and appears in a query
       if define_arity < 0 :
@@ -165,224 +710,625 @@ class Quest( object ) :
         sys.exit( "ERROR : table '" + str( table ) + "' has inconsitent arities: define_arity = " + str( define_arity ) + ", queryList_arity = " + str( queryList_arity ) )
 
 
+  #######################
+  #  GET QUERY ARITIES  #
+  #######################
+  # grab the arity of every table across all query statements in one pass.
+  # make sure the arities of each table are identical.
+  # return a dictionary mapping table names to integer arities.
+  def getQueryArities( self, queryList ) :
+
+    arities = {}
+
+    for q in queryList :
+      for atom in DatalogParser.parseRule( q ).getAtoms() :
+        arity = atom.getArity()
+        if not atom.name in arities :
+          arities[ atom.name ] = arity
+        elif not arities[ atom.name ] == arity :
+          sys.exit( "ERROR : schema definitions for table '" + str( atom.name ) + "' have inconsistent arities : " + str( [ arities[ atom.name ], arity ] ) )
+
+    return arities
+
+
   ##########################
   #  GET QUERY LIST ARITY  #
   ##########################
-  # grab the arities of the given table across all relevant query statements
-  # make sure the arities are identical
-  # return the arity as an integer
+  # grab the arity of the given table across all relevant query statements.
+  # return -1 if the table appears in no query.
   def getQueryListArity( self, queryList, table ) :
+    return self.getQueryArities( queryList ).get( table, -1 )
 
-    #print "==========================="
-    #print "queryList = " + str( queryList )
-    #print "table     = " + str( table )
 
-    arity     = -1
-    arityList = []
+  ######################
+  #  GET DEFINE ARITY  #
+  ######################
+  # grab the arity of the given table from its schema.
+  def getDefineArity( self, table ) :
 
-    for q in queryList :
+    arity = len( self.schema.get( table, [] ) )
 
-      searchStr = table + "("
+    # make sure arity is greater than zero
+    if arity <= 0 :
+      sys.exit( "ERROR : table '" + str( table ) + "' has arity " + str( arity ) + ". relation arities must be positive integers." )
+
+    return arity
+
+
+  ##############
+  #  GET EDBS  #
+  ##############
+  # grab EDB data from the target database instance.
+  # when bulk loading, the checked rows are collected in fact_data instead
+  # of being formatted into statements.
+  def getEDBs( self, table_list ) :
 
-      if searchStr in q :
+    #print "table_list : " + str( table_list )
 
-        q    = q.translate( None, string.whitespace )
-        q    = q.split( ":-" )
-        goal = q[0]
-        body = q[1]
+    c4_edb_statements = []
+    self.fact_data    = []
 
-        #print "------------------------"
-        #print "searchStr = " + str( searchStr )
-        #print "q         = " + str( q )
-        #print "goal      = " + str( goal )
-        #print "body      = " + str( body )
+    for fact in self.iterEDBs( table_list ) :
 
-        # check query goal for table instances
-        if searchStr in goal :
+      factName, typeList, relationData = fact[:3]
 
-          openParenIndex = goal.index( "(" )
-          closParenIndex = goal.index( ")" )
+      if logging.getLogger().isEnabledFor( logging.DEBUG ) :
+        logging.debug( "  GETEDBS : submitting relationName '" + str( factName ) + "' and relationData '" + str( relationData ) + "' to format_ebd_statements" )
 
-          contents = goal[ openParenIndex+1 : closParenIndex-1 ]
-          contents = contents.split( "," )
+      if self.bulk_load :
+        self.checkFact( fact )
+        self.fact_data.append( [ factName, typeList, relationData ] )
+      elif len( fact ) > 3 :
+        c4_edb_statements.extend( fact[3] )
+      else :
+        c4_edb_statements.extend( self.format_edb_statements( factName, relationData, typeList ) )
 
-          arity    = len( contents )
-          arityList.append( arity )
+    #sys.exit( "c4_edb_statements : " + str( c4_edb_statements ) )
+    return c4_edb_statements
 
-        # check query body for table instances
-        # this is an 'if' condition because the goal could appear in the body
-        # in recursive queries.
-        if searchStr in body :
 
-          for i in range( 0, len( body ) ) :
+  ###############
+  #  ITER EDBS  #
+  ###############
+  # lazily fetch and flatten EDB data one relation at a time.
+  # yield [ relation name, type list, rows ] entries. rows are not checked
+  # against the type list yet, unless the entry carries a fourth item
+  # holding the already formatted statements ( None when bulk loading ).
+  # rows may be None when the statements are all that is needed.
+  # edb_arities and the factorized helper relations are filled in as
+  # relations are produced.
+  def iterEDBs( self, table_list ) :
 
-            startContentsIndex = body.find( searchStr, i )
+    self.edb_arities = {}
 
-            if startContentsIndex > 0 :
-              startContentsIndex = startContentsIndex + len( searchStr ) - 1 # first index of contents
-              endContentsIndex   = body.find( ")", startContentsIndex )
-              contents           = body[ startContentsIndex : endContentsIndex ]
-              contents           = contents.split( "," )
+    # helper relations of factorized cross products
+    self.factor_defines = []
+    self.factor_rules   = []
+    self.factor_layouts = {}
 
-              arity              = len( contents )
-              arityList.append( arity )
-              currStartIndex = endContentsIndex
+    for relationName, raw_value, error in self.iterRawValues( table_list ) :
 
-    # make sure all arities are identical
-    if len( arityList ) > 0 :
-      if all( a == arityList[0] for a in arityList ) :
-        arity = arityList[0]
-      else :
-        sys.exit( "ERROR : schema definitions for table '" + str( table ) + "' have inconsistent arities : " + str( arityList ) )
+      self.checkCancelled()
 
-    # make sure arity is an integer
-    if not arity == math.floor( arity ) :
-      sys.exit( "ERROR : table '" + str( table ) + "' has arity " + str( arity ) + ". relation arities must be positive integers." )
+      # store errors skip the relation, exits abort the run
+      if isinstance( error, SystemExit ) :
+        raise error
+      elif error :
+        continue
 
-    return arity
+      try :
+        if self.factorize_threshold is None and not self.flatten_cache is None and type( raw_value ) is dict :
+          facts = [ self.extractCachedFacts( relationName, raw_value ) ]
+        elif self.factorize_threshold is None and self.isParallelRelation( raw_value ) :
+          facts = [ self.flattenParallel( relationName, raw_value ) ]
+        elif self.factorize_threshold is None and self.columnar :
+          relationData = self.extractRelationBuffer( relationName, raw_value )
+          facts        = [ [ relationName, self.schema[ relationName ], relationData ] ]
+        elif self.factorize_threshold is None :
+          relationData = self.extractRelationData( relationName, raw_value )
+          facts        = [ [ relationName, self.schema[ relationName ], relationData ] ]
+        else :
+          blocks = self.getRelationBlocks( relationName, raw_value )
+          facts  = self.getFactorizedFacts( relationName, blocks )
+      except SystemExit :
+        raise
+      except :
+        continue
+
+      # every formatted row matches the schema length
+      if sum( [ self.getFactSize( fact ) for fact in facts ] ) > 0 :
+        self.edb_arities[ relationName ] = len( self.schema[ relationName ] )
+
+      for fact in facts :
+        yield fact
+
+
+  ##########################
+  #  IS PARALLEL RELATION  #
+  ##########################
+  # check if raw_value is a dict large enough to be worth flattening in the
+  # process pool.
+  def isParallelRelation( self, raw_value ) :
+    return not self.flatten_pool is None and type( raw_value ) is dict and len( raw_value ) >= self.parallel_threshold
+
+
+  ######################
+  #  FLATTEN PARALLEL  #
+  ######################
+  # split the top-level keys of a dict relation into shards of a quarter of
+  # parallel_threshold keys, so every such relation is split at least four
+  # ways, then flatten, check, and format the shards in the flatten pool.
+  # workers send back only the rows when bulk loading and only the
+  # statements otherwise. the shards are merged back in key order, so the
+  # result matches the in-process one.
+  # return a checked [ relation name, type list, rows, statements ] entry.
+  def flattenParallel( self, relationName, raw_value ) :
+
+    typeList  = self.schema[ relationName ]
+    items     = raw_value.items()
+    shardSize = max( 1, self.parallel_threshold / 4 )
+
+    entryShape = self.getEntryShape( relationName )
+
+    tasks = [ [ relationName, items[ i : i + shardSize ], typeList, entryShape, not self.bulk_load ] for i in xrange( 0, len( items ), shardSize ) ]
+
+    logging.debug( "  FLATTENPARALLEL : flattening relation '" + str( relationName ) + "' in " + str( len( tasks ) ) + " shards" )
+
+    merged = []
+    for shardData, error in self.flatten_pool.imap( flattenShard, tasks ) :
+      if error :
+        raise error
+      merged.extend( shardData )
+
+    if self.bulk_load :
+      return [ relationName, typeList, merged, None ]
+    else :
+      return [ relationName, typeList, None, merged ]
+
+
+  #############################
+  #  EXTRACT RELATION BUFFER  #
+  #############################
+  # flatten raw_value into a RelationBuffer. dict relations are flattened
+  # one top-level key at a time, so only the rows of a single key exist as
+  # row lists at any point. list relations are split into the parts of
+  # their cross product, whose rows are generated and buffered
+  # BUFFER_BATCH at a time.
+  def extractRelationBuffer( self, relationName, raw_value ) :
+
+    buf = RelationBuffer.RelationBuffer( relationName, self.schema[ relationName ] )
+
+    if type( raw_value ) is dict :
+      if self.infer_templates and not relationName in self.templates :
+        try :
+          self.templates[ relationName ] = RelationTemplate.inferTemplate( raw_value )
+        except RelationTemplate.TemplateMismatch :
+          pass
+
+      for rows in iterItemRows( self, relationName, raw_value.iteritems(), self.getEntryShape( relationName ) ) :
+        buf.extend( rows )
+
+    elif type( raw_value ) is list and not relationName in self.templates :
+      rows = iterProductRows( self.getProductBlock( relationName, [], raw_value ) )
+      for batch in iter( lambda : list( islice( rows, BUFFER_BATCH ) ), [] ) :
+        buf.extend( batch )
+
+    else :
+      buf.extend( self.extractRelationData( relationName, raw_value ) )
+
+    return buf
+
+
+  #####################
+  #  GET ENTRY SHAPE  #
+  #####################
+  # the entry shape of the relation template, if the template covers
+  # every top-level key of a dict relation with a single entry shape.
+  # only such templates apply key by key.
+  def getEntryShape( self, relationName ) :
+
+    template = self.templates.get( relationName )
+    if template and template.shape[0] == "dict" :
+      return template.shape[1]
+
+    return None
+
+
+  ##########################
+  #  EXTRACT CACHED FACTS  #
+  ##########################
+  # flatten a dict relation key by key through the flatten cache. each
+  # top-level key whose value is unchanged since an earlier run reuses its
+  # checked rows ( when bulk loading ) or its formatted statements.
+  # return a checked [ relation name, type list, rows, statements ] entry.
+  def extractCachedFacts( self, relationName, raw_value ) :
+
+    typeList   = self.schema[ relationName ]
+    entryShape = self.getEntryShape( relationName )
+    mode       = "rows" if self.bulk_load else "statements"
+
+    relationData = []
+    statements   = []
+
+    for key in raw_value :
+      value    = raw_value[ key ]
+      cacheKey = FlattenCache.makeKey( relationName, key, value, typeList, mode )
+      cached   = self.flatten_cache.get( cacheKey )
+
+      if cached is None :
+        rows = iterItemRows( self, relationName, [ ( key, value ) ], entryShape ).next()
+        self.checkRelationData( relationName, rows, typeList )
+        if self.bulk_load :
+          cached = rows
+        else :
+          cached = list( self.iter_edb_statements( relationName, rows, typeList ) )
+        self.flatten_cache.put( cacheKey, cached, FlattenCache.estimateSize( cached ) )
+
+      if self.bulk_load :
+        relationData.extend( cached )
+      else :
+        statements.extend( cached )
+
+    if self.bulk_load :
+      return [ relationName, typeList, relationData, None ]
+    else :
+      return [ relationName, typeList, None, statements ]
 
 
   ###################
-  #  GET EDB ARITY  #
+  #  GET FACT SIZE  #
   ###################
-  # grab the arities of the given table across all relevant edb statements
-  # make sure the arities are identical
-  # return the arity as an integer
-  # a negative integer indicates table is IDB
-  def getEDBArity( self, c4_edb_statements, table ) :
-
-    arity = -1
-    arityList = []
-    for stmt in c4_edb_statements :
-      stmt = stmt.replace( ";", "" )
-      stmt = stmt.split( "(" )
-      relationName = stmt[0]
-
-      if relationName == table :
-        dataList = stmt[1]
-        dataList = dataList.replace( ")", "" )
-        dataList = dataList.split( "," )
-        arityList.append( len( dataList ) )
-
-    # make sure all arities are identical
-    if len( arityList ) > 0 :
-      if all( a == arityList[0] for a in arityList ) :
-        arity = arityList[0]
-      else :
-        sys.exit( "ERROR : edb definitions for table '" + str( table ) + "' have inconsistent arities : " + str( arityList ) )
+  # number of rows described by an iterEDBs entry.
+  def getFactSize( self, fact ) :
+    if fact[2] is None :
+      return len( fact[3] )
+    return len( fact[2] )
 
-    # make sure arity is an integer
-    if not arity == math.floor( arity ) :
-      sys.exit( "ERROR : table '" + str( table ) + "' has arity " + str( arity ) + ". relation arities must be positive integers." )
 
-    return arity
+  ################
+  #  CHECK FACT  #
+  ################
+  # check the rows of an iterEDBs entry, unless they were checked already.
+  def checkFact( self, fact ) :
+    if len( fact ) < 4 :
+      self.checkRelationData( fact[0], fact[2], fact[1] )
+
+
+  #####################
+  #  ITER RAW VALUES  #
+  #####################
+  # yield [ relation name, raw value, error ] for every relation in
+  # table_list, in table_list order. error is None unless the read raised.
+  # adapters with a get_many method serve the whole table list in one call.
+  # otherwise, with a fetch_concurrency, all reads are issued at once to a
+  # pool of at most fetch_concurrency threads, and each value is handed out
+  # as soon as it and the values before it have arrived.
+  def iterRawValues( self, table_list ) :
+
+    # values read ahead for the result cache
+    if not self.prefetched is None :
+      fetched, self.prefetched = self.prefetched, None
+      for entry in fetched :
+        yield entry
+      return
 
+    ad = Adapter.Adapter( self.nosql_type )
 
-  ########################
-  #  GET DEFINE ARITIES  #
-  ########################
-  # given a list of c4 define statements and a table.
-  # get the define statement for the table.
-  # extract the list of data types.
-  # return the arity of the list.
-  def getDefineArity( self, c4_define_statements, table ) :
-
-    arity = 0
-
-    for stmt in c4_define_statements :
-      stmt = stmt.replace( "define(","" )
-      stmt = stmt.replace( ");","" )
-      stmt = stmt.split( ",{" )
-      relationName = stmt[0]
-      typeList = stmt[1]
-      typeList = typeList.replace( "}", "" )
-      typeList = typeList.split( "," )
-
-      #print relationName,
-      #print "typeList : " + str( typeList )
-
-      if relationName == table :
-        arity = len( typeList )
-        break
-
-    # make sure arity is greater than zero and integer
-    if arity <= 0 or not arity == math.floor( arity ) :
-      sys.exit( "ERROR : table '" + str( table ) + "' has arity " + str( arity ) + ". relation arities must be positive integers." )
+    if hasattr( ad, "get_many" ) :
+      values = self.fetchMany( ad, table_list )
+      if not values is None :
+        for relationName in table_list :
+          if relationName in values :
+            yield [ relationName, values[ relationName ], None ]
+          else :
+            yield [ relationName, None, KeyError( relationName ) ]
+        return
 
-    return arity
+    if not self.fetch_concurrency or self.fetch_concurrency < 2 or len( table_list ) < 2 :
+      for relationName in table_list :
+        yield self.fetchRelation( relationName, ad )
+      return
 
+    pool = ThreadPool( min( self.fetch_concurrency, len( table_list ) ) )
+    try :
+      for fetched in pool.imap( self.fetchRelation, table_list ) :
+        yield fetched
+    finally :
+      pool.terminate()
 
-  ##############
-  #  GET EDBS  #
-  ##############
-  # grab EDB data from the target database instance
-  def getEDBs( self, table_list ) :
 
-    #print "table_list : " + str( table_list )
+  ################
+  #  FETCH MANY  #
+  ################
+  # read every relation in table_list with one get_many call.
+  # get_many( relations, dbcursor ) returns a dictionary mapping each
+  # relation it could read to its raw value. missing relations are skipped
+  # like a failed get. return None if the call fails, so the caller falls
+  # back to reading the relations one by one.
+  def fetchMany( self, ad, table_list ) :
 
-    c4_edb_statements = []
+    try :
+      return ad.get_many( table_list, self.dbcursor )
+    except SystemExit :
+      raise
+    except Exception as e :
+      logging.debug( "  FETCHMANY : get_many failed, falling back to get : " + str( e ) )
+      return None
 
-    ad = Adapter.Adapter( self.nosql_type )
 
-    for relationName in table_list :
-      try :
-        raw_value    = ad.get( relationName, self.dbcursor )
-        relationData = self.getRelationData( relationName, raw_value )
+  ####################
+  #  FETCH RELATION  #
+  ####################
+  # read the raw value of one relation from the store.
+  # errors are returned instead of raised so a worker thread never dies on
+  # them. pool threads build their own adapter.
+  def fetchRelation( self, relationName, ad=None ) :
+
+    try :
+      if ad is None :
+        ad = Adapter.Adapter( self.nosql_type )
+      return [ relationName, ad.get( relationName, self.dbcursor ), None ]
+    except BaseException as e :
+      return [ relationName, None, e ]
 
-        logging.debug( "  GETEDBS : submitting relationName '" + str( relationName ) + "' and relationData '" + str( relationData ) + "' to format_ebd_statements" )
 
-        c4_edb_statements.extend( self.format_edb_statements( relationName, relationData ) )
-      except SystemExit :
-        raise
-      except :
-        pass
+  ##################
+  #  ITER PROGRAM  #
+  ##################
+  # lazily build the c4 program as [ statements, fact data ] chunks :
+  # the define statements, then the edb facts in batches of at most
+  # batch_size statements ( or rows, when bulk loading ), then the rules.
+  # the sanity checks run once every edb has been produced, before the
+  # rules are handed out. if program is a list, every statement is also
+  # appended to it. queryList overrides the query list of the instance.
+  def iterProgram( self, table_list, batch_size, program=None, queryList=None ) :
 
-    #sys.exit( "c4_edb_statements : " + str( c4_edb_statements ) )
-    return c4_edb_statements
+    chunks = self.iterProgramChunks( table_list, batch_size, queryList )
+
+    for statements, factData in chunks :
+      self.checkCancelled()
+      if not program is None :
+        program.extend( statements )
+      yield [ statements, factData ]
+
+
+  #########################
+  #  ITER PROGRAM CHUNKS  #
+  #########################
+  # the chunks handed out by iterProgram.
+  def iterProgramChunks( self, table_list, batch_size, queryList=None ) :
+
+    helper_defines, rules = self.getProgramRules( queryList )
+
+    yield [ self.getDefineStatements( table_list ) + helper_defines, [] ]
+
+    batch      = []
+    numDefines = 0
+
+    for fact in self.iterEDBs( table_list ) :
+
+      factName, typeList, relationData = fact[:3]
+
+      # helper relations must be defined before their facts arrive
+      if len( self.factor_defines ) > numDefines :
+        yield [ self.factor_defines[ numDefines : ], [] ]
+        numDefines = len( self.factor_defines )
+
+      self.checkFact( fact )
+
+      if self.bulk_load :
+        for i in xrange( 0, len( relationData ), batch_size ) :
+          yield [ [], [ [ factName, typeList, relationData[ i : i + batch_size ] ] ] ]
+
+      else :
+        if len( fact ) > 3 :
+          factStatements = fact[3]
+        else :
+          factStatements = self.iter_edb_statements( factName, relationData, typeList )
+
+        for statement in factStatements :
+          batch.append( statement )
+          if len( batch ) >= batch_size :
+            yield [ batch, [] ]
+            batch = []
+
+    if len( batch ) > 0 :
+      yield [ batch, [] ]
+
+    # sanity checks
+    self.verifyArities( table_list )
+    self.verifyDataTypes( table_list )
+
+    yield [ rules + self.factor_rules, [] ]
 
 
   ###########################
   #  FORMAT EDB STATEMENTS  #
   ###########################
   # build c4 edb statements per relation name, given all data for that relation.
-  def format_edb_statements( self, relationName, relationData ) :
+  # every value is checked against its schema type first.
+  # typeList overrides the schema of the relation, e.g. for helper relations.
+  def format_edb_statements( self, relationName, relationData, typeList=None ) :
 
-    logging.debug( "  FORMAT_EDB_STATEMENTS : relation name is '" + str( relationName ) + "'"  )
-    logging.debug( "  FORMAT_EDB_STATEMENTS : relationData  is '" + str( relationData ) + "'"  )
+    if typeList is None :
+      typeList = self.schema[ relationName ]
 
-    statements = []
-    for row in relationData :
+    # dumping whole relations is only worth it when debugging
+    debug = logging.getLogger().isEnabledFor( logging.DEBUG )
 
-      currStatement = []
-      currStatement.append( relationName + "(" )
+    if debug :
+      logging.debug( "  FORMAT_EDB_STATEMENTS : relation name is '" + str( relationName ) + "'"  )
+      logging.debug( "  FORMAT_EDB_STATEMENTS : relationData  is '" + str( relationData ) + "'"  )
 
-      logging.debug( "  FORMAT_EDB_STATEMENTS : self.schema['" + str( relationName ) + "'] = " + str( self.schema[ relationName ] ) )
-      logging.debug( "  FORMAT_EDB_STATEMENTS : '" + str( relationName ) + "' data : " + str( row ) )
+    self.checkRelationData( relationName, relationData, typeList )
 
-      # make sure schema aligns with number of data items in table rows
-      if not len( self.schema[ relationName ] ) == len( row ) :
-        sys.exit( "  FORMAT_EDB_STATEMENTS : ERROR : table '" + str( relationName ) + "' has edb definition inconsistent with length of table schema : edb = " + str( row ) + ", table schema = " + str( self.schema[ relationName ] ) )
+    statements = list( self.iter_edb_statements( relationName, relationData, typeList ) )
 
-      for i in range(0,len(row)) :
+    if debug :
+      logging.debug( "  FORMAT_EDB_STATEMENTS : statements = " + str( statements ) )
+    return statements
 
-        # last value
-        if i == len(row) - 1 :
-          if self.schema[ relationName ][i] == "string" : # string values need quotes
-            currStatement.append( '"' +  row[i] + '");' )
-          else :
-            currStatement.append( str( row[i] ) + ");" )
 
-        # middle value
+  #########################
+  #  ITER EDB STATEMENTS  #
+  #########################
+  # lazily build one c4 edb statement per row, without checking the rows.
+  # RelationBuffers are formatted column by column. other rows are filled
+  # into a format string built once from the schema, so there is no per
+  # value type dispatch.
+  def iter_edb_statements( self, relationName, relationData, typeList ) :
+
+    if isinstance( relationData, RelationBuffer.RelationBuffer ) :
+      return iter( relationData.formatFacts( relationName ) )
+
+    return RelationBuffer.formatRows( relationName, typeList, relationData )
+
+
+  #########################
+  #  CHECK RELATION DATA  #
+  #########################
+  # make sure every row matches the length and attribute types of typeList,
+  # with one pass over the rows and one per column ( see
+  # RelationBuffer.checkRows ). RelationBuffers were checked as they were
+  # filled.
+  def checkRelationData( self, relationName, relationData, typeList ) :
+
+    if isinstance( relationData, RelationBuffer.RelationBuffer ) :
+      return
+
+    # formatting every row for the log is only worth it when debugging
+    if logging.getLogger().isEnabledFor( logging.DEBUG ) :
+      logging.debug( "  FORMAT_EDB_STATEMENTS : schema of '" + str( relationName ) + "' = " + str( typeList ) )
+      for row in relationData :
+        logging.debug( "  FORMAT_EDB_STATEMENTS : '" + str( relationName ) + "' data : " + str( row ) )
+
+    RelationBuffer.checkRows( relationName, typeList, relationData )
+
+
+  #########################
+  #  GET RELATION BLOCKS  #
+  #########################
+  # flatten raw_value like getRelationData, but keep the outermost cross
+  # products unexpanded. return a list of blocks. each block is a list of
+  # parts ( lists of rows ) whose cross product, first part varying fastest,
+  # gives the rows getRelationData would produce for that block.
+  def getRelationBlocks( self, relationName, raw_value ) :
+
+    if type( raw_value ) is str or type( raw_value ) is int :
+      raw_value = [ raw_value ]
+
+    if type( raw_value ) is list :
+      return [ self.getProductBlock( relationName, [], raw_value ) ]
+
+    elif type( raw_value ) is dict :
+      blocks = []
+      for key in raw_value :
+        value = raw_value[ key ]
+        if type( value ) is list and ( self.getPrimativeSuffix( value ) > 0 or not type( key ) in PRIMATIVE_TYPES ) :
+          blocks.append( self.getProductBlock( relationName, [ key ], value ) )
         else :
-          if self.schema[ relationName ][i] == "string" : # string values need quotes
-            currStatement.append( '"' +  row[i] + '",' )
-          else :
-            currStatement.append( str( row[i] ) + "," )
+          blocks.append( [ self.getRelationData( relationName, { key : value } ) ] )
+      return blocks
 
-      statements.append( "".join( currStatement ) )
+    else :
+      return [ [ self.getRelationData( relationName, raw_value ) ] ]
 
-    logging.debug( "  FORMAT_EDB_STATEMENTS : statements = " + str( statements ) )
-    return statements
+
+  #######################
+  #  GET PRODUCT BLOCK  #
+  #######################
+  # the parts of the list prefix + raw_value. empty parts are dropped since
+  # they leave the cross product unchanged.
+  def getProductBlock( self, relationName, prefix, raw_value ) :
+
+    start = self.getPrimativeSuffix( raw_value )
+
+    parts = [ self.getRelationData( relationName, element ) for element in prefix ]
+    for i in xrange( 0, start ) :
+      parts.append( self.getRelationData( relationName, raw_value[i] ) )
+    parts.append( [ [ raw_value[i] ] for i in xrange( start, len( raw_value ) ) ] )
+
+    return [ part for part in parts if len( part ) > 0 ]
+
+
+  ##########################
+  #  GET FACTORIZED FACTS  #
+  ##########################
+  # turn a list of relation blocks into [ relation name, type list, rows ]
+  # entries. blocks with at least factorize_threshold rows become one helper
+  # relation per part, keyed by a block id, plus a rule joining the helpers
+  # back into the relation. the fact count then grows with the sum of the
+  # part sizes instead of their product. other blocks are expanded.
+  def getFactorizedFacts( self, relationName, blocks ) :
+
+    typeList = self.schema[ relationName ]
+    layouts  = self.factor_layouts.setdefault( relationName, {} )
+    facts    = []
+
+    for block in blocks :
+
+      # empty parts, e.g. from keys holding empty lists, add no rows
+      block = [ part for part in block if len( part ) > 0 ]
+      if len( block ) == 0 :
+        continue
+
+      size = 1
+      for part in block :
+        size *= len( part )
+
+      widths = [ len( part[0] ) for part in block ]
+      if len( block ) < 2 or size < self.factorize_threshold or not sum( widths ) == len( typeList ) or \
+         not all( len( row ) == widths[i] for i in range( 0, len( block ) ) for row in block[i] ) :
+        relationData = block[-1]
+        for part in reversed( block[:-1] ) :
+          relationData = self.mergeSubRelations( part, relationData )
+        facts.append( [ relationName, typeList, relationData ] )
+        continue
+
+      # one set of helper relations per distinct layout of part widths
+      layout = tuple( widths )
+      if not layout in layouts :
+        layouts[ layout ] = self.addFactorHelpers( relationName, layout, len( layouts ) )
+
+      # ids come from the block contents, so a session that kept the helper
+      # facts of an earlier run sees the same facts again, not new ones
+      blockID = getBlockID( relationName, block )
+
+      offset = 0
+      for i in range( 0, len( block ) ) :
+        helperName = layouts[ layout ][i]
+        helperRows = [ [ blockID ] + row for row in block[i] ]
+        facts.append( [ helperName, [ "int" ] + typeList[ offset : offset + widths[i] ], helperRows ] )
+        offset += widths[i]
+
+    return facts
+
+
+  ########################
+  #  ADD FACTOR HELPERS  #
+  ########################
+  # define the helper relations for one layout of part widths and add the
+  # rule rebuilding the relation from them. return the helper names.
+  def addFactorHelpers( self, relationName, layout, layoutIndex ) :
+
+    typeList    = self.schema[ relationName ]
+    helperNames = []
+    subgoals    = []
+    offset      = 0
+
+    for i in range( 0, len( layout ) ) :
+      helperName = relationName + "_qf" + str( layoutIndex ) + "p" + str( i )
+      variables  = [ "C" + str( j ) for j in range( offset, offset + layout[i] ) ]
+
+      self.factor_defines.append( self.format_define_statement( helperName, [ "int" ] + typeList[ offset : offset + layout[i] ] ) )
+      subgoals.append( helperName + "(" + ",".join( [ "P" ] + variables ) + ")" )
+      helperNames.append( helperName )
+      offset += layout[i]
+
+    goal = relationName + "(" + ",".join( [ "C" + str( j ) for j in range( 0, offset ) ] ) + ")"
+    self.factor_rules.append( goal + " :- " + ", ".join( subgoals ) + " ;" )
+
+    return helperNames
 
 
   #######################
@@ -393,11 +1339,27 @@ class Quest( object ) :
   # of strings, arrays, or dictionaries.
   # other objects are not currently supported.
   # return an array of arrays. each inner array represents a tuple of data derived from the raw value.
+  #
+  # the value is flattened with an explicit work stack instead of recursion :
+  #   * a list is split into its trailing run of primatives, which becomes
+  #     one unary row per primative, and the elements before that run. the
+  #     sub relations of those elements are merged right to left into a
+  #     cross product.
+  #   * a dictionary is the concatenation of the sub relations of its kv
+  #     pairs. a pair of primatives ( or a primative key and a list of
+  #     primatives ) becomes [ key, value ] rows, any other pair is
+  #     flattened as the list [ key ] + value.
+  # every node is classified once, list tails are never copied, and
+  # raw_value is never modified.
   def getRelationData( self, relationName, raw_value ) :
 
-    logging.debug( "----------------------------------------------------" )
-    logging.debug( "  GETRELATIONDATA : relationName : " + str( relationName ) )
-    logging.debug( "  GETRELATIONDATA : raw_value    : " + str( raw_value ) )
+    # dumping whole relations is only worth it when debugging
+    debug = logging.getLogger().isEnabledFor( logging.DEBUG )
+
+    if debug :
+      logging.debug( "----------------------------------------------------" )
+      logging.debug( "  GETRELATIONDATA : relationName : " + str( relationName ) )
+      logging.debug( "  GETRELATIONDATA : raw_value    : " + str( raw_value ) )
 
     # ---------------------------------------------------------- #
     # PRE PROCESS raw_value -> CONVERT STRINGS AND INTS TO ARRAYS
@@ -405,122 +1367,143 @@ class Quest( object ) :
     if type( raw_value ) is str or type( raw_value ) is int :
       raw_value = [ raw_value ]
 
-    # ---------------------------------------------------------- #
-    # BASE CASE : empty raw_value
-    if len( raw_value ) < 1 :
-      logging.debug( "  GETRELATIONDATA : returning relationData as " + str( [] ) )
-      return []
+    results = []                           # stack of finished sub relations
+    stack   = [ ( FLATTEN, raw_value ) ]   # stack of pending work
+
+    while len( stack ) > 0 :
+
+      op, node = stack.pop()
+
+      # ---------------------------------------------------------- #
+      # finished sub relation
+      if op == RESULT :
+        results.append( node )
+
+      # ---------------------------------------------------------- #
+      # cross product of the sub relations of list elements
+      elif op == MERGE_LIST :
+        count, relationData = node
+        parts = results[ len( results ) - count : ]
+        del results[ len( results ) - count : ]
+        for subRelation in reversed( parts ) :
+          relationData = self.mergeSubRelations( subRelation, relationData )
+        results.append( relationData )
+
+      # ---------------------------------------------------------- #
+      # concatenation of the sub relations of dictionary entries
+      elif op == MERGE_DICT :
+        relationData = []
+        for subRelation in results[ len( results ) - node : ] :
+          relationData.extend( subRelation )
+        del results[ len( results ) - node : ]
+        results.append( relationData )
+
+      # ---------------------------------------------------------- #
+      # BASE CASE : primative
+      elif type( node ) is str or type( node ) is int :
+        results.append( [ [ node ] ] )
+
+      # ---------------------------------------------------------- #
+      # CASE : node is a list
+      elif type( node ) is list :
+
+        start        = self.getPrimativeSuffix( node )
+        relationData = [ [ node[i] ] for i in xrange( start, len( node ) ) ]
+
+        if start == 0 :
+          results.append( relationData )
+        else :
+          stack.append( ( MERGE_LIST, ( start, relationData ) ) )
+          for i in xrange( start-1, -1, -1 ) :
+            stack.append( ( FLATTEN, node[i] ) )
 
-    # ---------------------------------------------------------- #
-    # BASE CASE : list of primatives
-    elif self.isPrimativeList( raw_value ) :
-      relationData = [ [ x ] for x in raw_value  ] # transform data into tuples (i.e. unary arrays)
-      logging.debug( "  GETRELATIONDATA : returning relationData as " + str( relationData ) )
-      return relationData
+      # ---------------------------------------------------------- #
+      # CASE : node is a dict
+      elif type( node ) is dict :
 
-    # ---------------------------------------------------------- #
-    # BASE CASE : dictionary of primatives (both keys and valus are primatives)
-    elif self.isPrimativeDict( raw_value ) :
+        stack.append( ( MERGE_DICT, len( node ) ) )
+        work = [] # one list of stack operations per kv pair
 
-      relationData = []
-      for key in raw_value :
-        currTup = []
+        for key in node :
+          value = node[ key ]
 
-        if type( raw_value[ key ] ) is list :
-          for val in raw_value[ key ] :
-            relationData.append( [ key, val ] )
+          if type( key ) in PRIMATIVE_TYPES and type( value ) in PRIMATIVE_TYPES :
+            work.append( [ ( RESULT, [ [ key, value ] ] ) ] )
 
-        else :
-          currTup = [ key, raw_value[key] ]
-          relationData.append( currTup )
+          elif type( value ) is list :
+            start = self.getPrimativeSuffix( value )
 
-      logging.debug( "  GETRELATIONDATA : returning relationData as " + str( relationData ) )
-      return relationData
+            if start == 0 and type( key ) in PRIMATIVE_TYPES :
+              work.append( [ ( RESULT, [ [ key, val ] for val in value ] ) ] )
 
+            # flatten the pair as the list [ key ] + value
+            else :
+              relationData = [ [ value[i] ] for i in xrange( start, len( value ) ) ]
+              ops          = [ ( MERGE_LIST, ( start + 1, relationData ) ) ]
+              for i in xrange( start-1, -1, -1 ) :
+                ops.append( ( FLATTEN, value[i] ) )
+              ops.append( ( FLATTEN, key ) )
+              work.append( ops )
 
-    # ---------------------------------------------------------- #
-    # RECURSIVE CASE : still stuff to process in raw_value
-    elif self.isUnaryDict( raw_value ) :
-      key = raw_value.keys()
-      key = key[0]
-      return self.getRelationData( relationName, [key] + raw_value[key] )
+          else :
+            raise TypeError( "relation '" + str( relationName ) + "' cannot merge key " + repr( key ) + " with value " + repr( value ) )
 
-    # ---------------------------------------------------------- #
-    # RECURSIVE CASE : still stuff to process in raw_value
-    else :
+        for ops in reversed( work ) :
+          stack.extend( ops )
 
-      ##########################################
-      # CASE : raw_value is a list
-      if type( raw_value ) is list :
+      # ---------------------------------------------------------- #
+      else :
+        raise TypeError( "relation '" + str( relationName ) + "' contains unsupported value " + repr( node ) )
 
-        # set left_subRelation
-        logging.debug( "  GETRELATIONDATA : launching left_subRelation on " + str( raw_value[0] ) )
-        left_subRelation = self.getRelationData( relationName, raw_value[0] )
+    relationData = results.pop()
+    if debug :
+      logging.debug( "  GETRELATIONDATA : returning relationData as " + str( relationData ) )
+    return relationData
 
-        # set right_subRelation
-        try :
-          logging.debug( "  GETRELATIONDATA : launching right_subRelation on " + str( raw_value[1:] ) )
-          right_subRelation = self.getRelationData( relationName, raw_value[1:] )
-        except IndexError :
-          right_subrelation = []
-
-        # merge sub relations
-        logging.debug( "  GETRELATIONDATA : left_subRelation  is " + str( left_subRelation ) )
-        logging.debug( "  GETRELATIONDATA : right_subRelation is " + str( right_subRelation ) )
-  
-        if left_subRelation == [] and not right_subRelation == [] :
-          relationData = right_subRelation
-  
-        elif not left_subRelation == [] and right_subRelation == [] :
-          relationData = left_subRelation
-  
-        else :
-          relationData = []
-          row          = []
-          for row1 in right_subRelation :
-            for row2 in left_subRelation :
-              row.extend( row2 )
-              row.extend( row1 )
-              relationData.append( row )
-              row = []
-              logging.debug( "  GETRELATIONDATA : added " + str( row ) + " to relationData" )
-  
-        logging.debug( "  GETRELATIONDATA : returning relationData as " + str( relationData ) )
-        return relationData
-
-      ##########################################
-      # CASE : raw_value is a dict
-      elif type( raw_value ) is dict :
-
-        # set left_subRelation
-        allKeys = raw_value.keys() # should never be empty
-        logging.debug( "  GETRELATIONDATA : launching left_subRelation on " + str( { allKeys[0] : raw_value[allKeys[0]] } ) )
-        left_subRelation = self.getRelationData( relationName, { allKeys[0] : raw_value.pop( allKeys[0] ) } )
-
-        # set right_subRelation
-        try :
-          logging.debug( "  GETRELATIONDATA : launching right_subRelation on " + str( raw_value ) )
-          right_subRelation = self.getRelationData( relationName, raw_value )
-        except IndexError :
-          right_subrelation = []
 
-        # merge sub relations
-        logging.debug( "  GETRELATIONDATA : left_subRelation  is " + str( left_subRelation ) )
-        logging.debug( "  GETRELATIONDATA : right_subRelation is " + str( right_subRelation ) )
+  ##########################
+  #  GET PRIMATIVE SUFFIX  #
+  ##########################
+  # return the index where the trailing run of primatives in a list starts
+  def getPrimativeSuffix( self, raw_value ) :
+    return RelationTemplate.getPrimativeSuffix( raw_value )
+
 
-        if left_subRelation == [] and not right_subRelation == [] :
-          relationData = right_subRelation
+  #########################
+  #  MERGE SUB RELATIONS  #
+  #########################
+  # merge the sub relation of a list element with the sub relation of the
+  # elements following it. an empty side leaves the other side unchanged,
+  # otherwise the result is the cross product of both sides.
+  def mergeSubRelations( self, left_subRelation, right_subRelation ) :
+    return RelationTemplate.mergeSubRelations( left_subRelation, right_subRelation )
 
-        elif not left_subRelation == [] and right_subRelation == [] :
-          relationData = left_subRelation
 
-        else :
-          relationData = left_subRelation + right_subRelation
+  ###########################
+  #  EXTRACT RELATION DATA  #
+  ###########################
+  # flatten raw_value with the compiled template of the relation, if one was
+  # registered with setTemplate or inferred on an earlier run.
+  # values that do not fit the template go through getRelationData.
+  def extractRelationData( self, relationName, raw_value ) :
+
+    template = self.templates.get( relationName )
 
-        logging.debug( "  GETRELATIONDATA : returning relationData as " + str( relationData ) )
-        return relationData
+    if template :
+      try :
+        return template.extract( raw_value )
+      except RelationTemplate.TemplateMismatch as e :
+        logging.debug( "  EXTRACTRELATIONDATA : template mismatch for relation '" + str( relationName ) + "' : " + str( e ) )
+        if not self.infer_templates :
+          return self.getRelationData( relationName, raw_value )
 
-      ##########################################
+    if self.infer_templates :
+      try :
+        self.templates[ relationName ] = RelationTemplate.inferTemplate( raw_value )
+      except RelationTemplate.TemplateMismatch :
+        self.templates.pop( relationName, None )
+
+    return self.getRelationData( relationName, raw_value )
 
 
   ###################
@@ -544,7 +1527,8 @@ class Quest( object ) :
   # return boolean
   def containsUnrecognized( self, raw_value ) :
 
-    logging.debug( "  CONTAINSUNRECGONIZED : checking raw_value for unrecognized types : " + str( raw_value ) )
+    if logging.getLogger().isEnabledFor( logging.DEBUG ) :
+      logging.debug( "  CONTAINSUNRECGONIZED : checking raw_value for unrecognized types : " + str( raw_value ) )
 
     assert( type( raw_value ) is list or type( raw_value ) is dict )
 
@@ -665,18 +1649,24 @@ class Quest( object ) :
         sys.exit( "ERROR : getDefineStatements : schema does not support relation name '" + str( relationName ) + "'. aborting..." )
 
       if relSchema :
-        relSchema = str( relSchema )
-        relSchema = relSchema.replace( "'", "" )
-        relSchema = relSchema.replace( '"', '' )
-        relSchema = relSchema.replace( "[", "{" )
-        relSchema = relSchema.replace( "]", "}" )
-        statement = "define(" + relationName + "," + relSchema + ");"
-        c4_define_statements.append( statement )
+        c4_define_statements.append( self.format_define_statement( relationName, relSchema ) )
 
     #sys.exit( "c4_define_statements : " + str( c4_define_statements ) )
     return c4_define_statements
 
 
+  #############################
+  #  FORMAT DEFINE STATEMENT  #
+  #############################
+  def format_define_statement( self, relationName, typeList ) :
+    relSchema = str( typeList )
+    relSchema = relSchema.replace( "'", "" )
+    relSchema = relSchema.replace( '"', '' )
+    relSchema = relSchema.replace( "[", "{" )
+    relSchema = relSchema.replace( "]", "}" )
+    return "define(" + relationName + "," + relSchema + ");"
+
+
   ###############
   #  SET QUERY  #
   ###############
@@ -685,6 +1675,132 @@ class Quest( object ) :
     self.queryList.append( queryStr )
 
 
+  #################
+  #  SET SESSION  #
+  #################
+  # evaluate subsequent runs in a long-lived C4Session instead of
+  # a fresh c4 instance per run.
+  def setSession( self, session ) :
+    self.session = session
+
+
+  #####################
+  #  SET ENGINE POOL  #
+  #####################
+  # evaluate the programs of subsequent runs on the worker processes of a
+  # C4Pool. pass None to evaluate in-process again. streamed runs and runs
+  # through a session are always evaluated in-process.
+  def setEnginePool( self, pool ) :
+    self.engine_pool = pool
+
+
+  #################
+  #  SET OUTPUTS  #
+  #################
+  # mark the relations dumped by subsequent runs.
+  # pass None to dump every table again.
+  def setOutputs( self, relationList ) :
+    self.outputs = relationList
+
+
+  ##################
+  #  SET TEMPLATE  #
+  ##################
+  # register the shape of a relation's stored value.
+  # template is either a RelationTemplate or a sample value to infer it from.
+  def setTemplate( self, relationName, template ) :
+    if not isinstance( template, RelationTemplate.RelationTemplate ) :
+      template = RelationTemplate.inferTemplate( template )
+    self.templates[ relationName ] = template
+
+
+  #########################
+  #  SET INFER TEMPLATES  #
+  #########################
+  # infer and cache a template for every relation the first time it is
+  # fetched, and re-infer it whenever a fetched value no longer fits.
+  def setInferTemplates( self, flag ) :
+    self.infer_templates = flag
+
+
+  ##############################
+  #  SET FACTORIZE THRESHOLD  #
+  ##############################
+  # emit edb cross products of at least threshold rows in factorized form.
+  # pass None to always emit the full cross product.
+  def setFactorizeThreshold( self, threshold ) :
+    self.factorize_threshold = threshold
+
+
+  ###########################
+  #  SET FETCH CONCURRENCY  #
+  ###########################
+  # fetch up to n relations from the store at once.
+  # pass None to fetch relations one by one.
+  def setFetchConcurrency( self, n ) :
+    self.fetch_concurrency = n
+
+
+  ###########################
+  #  SET PARALLEL FLATTEN  #
+  ###########################
+  # flatten and format dict relations with at least threshold top-level
+  # keys on the workers of a multiprocessing.Pool, kept across runs and
+  # shared by any number of Quest instances. pass None to stay in-process.
+  # the caller owns the pool : close and join it when done, rather than
+  # terminating it, which would run whatever SIGTERM handler the store
+  # installed in the workers.
+  def setParallelFlatten( self, pool, threshold=10000 ) :
+    self.flatten_pool       = pool
+    self.parallel_threshold = threshold
+
+
+  ######################
+  #  SET RESULT CACHE  #
+  ######################
+  # serve repeated runs over unchanged data from a ResultCache.
+  # pass None to evaluate every run.
+  def setResultCache( self, cache ) :
+    self.result_cache = cache
+
+
+  #######################
+  #  SET FLATTEN CACHE  #
+  #######################
+  # reuse the facts of unchanged top-level keys of dict relations across
+  # runs. pass None to flatten every key on every run.
+  def setFlattenCache( self, cache ) :
+    self.flatten_cache = cache
+
+
+  ##################
+  #  SET COLUMNAR  #
+  ##################
+  # collect the rows of each relation in a RelationBuffer, one typed
+  # column per attribute, instead of one list per row.
+  def setColumnar( self, flag ) :
+    self.columnar = flag
+
+
+  ###################
+  #  SET BULK LOAD  #
+  ###################
+  # load edb facts into c4 from per relation fact files instead of
+  # submitting them as part of the program text. c4 still parses every
+  # fact; only building the statements in python is skipped.
+  def setBulkLoad( self, flag ) :
+    self.bulk_load = flag
+
+
+  ##############################
+  #  SET SHARE SUBEXPRESSIONS  #
+  ##############################
+  # derive every rule body shared by several rules, up to variable
+  # renaming, once into a helper relation the rules then read from.
+  def setShareSubexpressions( self, flag ) :
+    self.share_subexpressions = flag
+
+
   ################
   #  SET SCHEMA  #
   ################
@@ -705,29 +1821,34 @@ class Quest( object ) :
       return "KeyError : relation name '" + str( relationName ) + "' has no saved schema."
 
 
+  ###############
+  #  GET RULES  #
+  ###############
+  # parse every query into a DatalogParser.Rule.
+  # ASTs are cached on the query text and shared across Quest instances.
+  # queryList overrides the query list of the instance.
+  def getRules( self, queryList=None ) :
+
+    if queryList is None :
+      queryList = self.queryList
+
+    return [ DatalogParser.parseRule( q ) for q in queryList ]
+
+
   ####################
   #  GET TABLE LIST  #
   ####################
   # examine all queries and grab all edb and idb tables.
-  def getTableList( self ) :
+  # queryList overrides the query list of the instance.
+  def getTableList( self, queryList=None ) :
 
     table_list = []
 
-    for q in self.queryList :
-
-      q = q.replace( "notin", "" )
-
-      # remove whitespace
-      q = q.translate( None, string.whitespace )
-
-      # get the tables in this query
-      tables = self.getTables( q )
-
-      for t in tables :
+    for rule in self.getRules( queryList ) :
+      for t in rule.getTableNames() :
         if not t in table_list :
           table_list.append( t )
 
-    #sys.exit( "table_list : " + str( table_list ) )
     return table_list
 
 
@@ -736,85 +1857,88 @@ class Quest( object ) :
   ################
   # get all tables referenced in a query statment.
   def getTables( self, queryLine ) :
+    return DatalogParser.parseRule( queryLine ).getTableNames()
 
-    # initialize return structure to empty
-    tables = []
 
-    # remove all whitespace
-    queryLine = queryLine.translate( None, string.whitespace )
+###################
+#  FLATTEN SHARD  #
+###################
+# process pool worker. flatten the ( key, value ) pairs of one shard of a
+# dict relation in order, then check the rows and, if formatStatements is
+# set, format them. entryShape is the entry shape of the relation template,
+# if any. kept at module level so the pool can pickle it.
+# return [ statements if formatStatements is set else rows, error ].
+# errors are returned rather than raised so a SystemExit does not take
+# down the worker.
+def flattenShard( task ) :
 
-    # create array on open paren
-    queryLine = queryLine.split( "(" )
+  relationName, items, typeList, entryShape, formatStatements = task
 
-    # examine each component for a valid table name
-    for component in queryLine :
+  try :
+    q = Quest( None, None )
 
-      for i in range( 0, len( component ) ) :
+    relationData = []
+    for rows in iterItemRows( q, relationName, items, entryShape ) :
+      relationData.extend( rows )
 
-        c = component[i]
+    q.checkRelationData( relationName, relationData, typeList )
 
-        if self.isOp( c ) or self.isComma( c ) :
+    if formatStatements :
+      return [ list( q.iter_edb_statements( relationName, relationData, typeList ) ), None ]
 
-          try :
-            remainingStr = component[i+1:]
-            if self.hasSymbols( remainingStr ) :
-              pass
-            else :
-              tables.append( component[i+1:] )
-              break
+    return [ relationData, None ]
 
-          except :
-            break
+  except BaseException as e :
+    return [ None, e ]
 
-        elif i == len(component) - 1 and not self.hasSymbols( component ) :
-          tables.append( component )
 
-        else :
-          pass
+####################
+#  ITER ITEM ROWS  #
+####################
+# yield the rows of each ( key, value ) pair of a dict relation, in order.
+# pairs are flattened with the compiled entry shape when one is given and
+# the pair fits it, and with q.getRelationData otherwise.
+def iterItemRows( q, relationName, items, entryShape ) :
 
-    #print "GET TABLES"
-    #print "queryLine : " + str( queryLine )
-    #print "tables    : " + str( tables )
-    #sys.exit( "GET TABLES" )
+  extractEntry = None
+  if entryShape :
+    extractEntry = RelationTemplate.compileEntry( entryShape )
 
-    return tables
-
-
-  ###########
-  #  IS OP  #
-  ###########
-  # check if input character is the "-" in ":-"
-  def isOp( self, c ) :
-    if c == "-" :
-      return True
-    else :
-      return False
-
-
-  ##############
-  #  IS COMMA  #
-  ##############
-  # check if input character is a comma
-  def isComma( self, c ) :
-    if c == "," :
-      return True
-    else :
-      return False
-
-
-  #################
-  #  HAS SYMBOLS  #
-  #################
-  # check if input string contains any of the query language symbols.
-  def hasSymbols( self, cstr ) :
-
-    symbols = [ ":-", "(", ")", ",", ";" ]
-
-    for s in symbols :
-      if s in cstr :
-        return True
-
-    return False
+  for key, value in items :
+    if extractEntry :
+      try :
+        yield extractEntry( key, value )
+        continue
+      except RelationTemplate.TemplateMismatch :
+        pass
+    yield q.getRelationData( relationName, { key : value } )
+
+
+##################
+#  GET BLOCK ID  #
+##################
+# id of the helper facts of one factorized block : a digest of the
+# relation name and the block values, small enough for a c4 int.
+def getBlockID( relationName, block ) :
+  return int( hashlib.md5( repr( ( relationName, block ) ) ).hexdigest()[:15], 16 )
+
+
+#######################
+#  ITER PRODUCT ROWS  #
+#######################
+# yield the rows of the cross product of the parts of a product block one
+# at a time, in the order mergeSubRelations builds them : the first part
+# varies fastest.
+def iterProductRows( parts ) :
+
+  if len( parts ) == 0 :
+    return
+
+  for combo in product( *reversed( parts ) ) :
+    row = []
+    for subRow in reversed( combo ) :
+      row.extend( subRow )
+    yield row
 
 
 #########
@@ -0,0 +1,171 @@
+#/usr/bin/env python
+
+##########################################################################
+# QuestJob usage notes:
+#
+# 1. A QuestJob runs a Quest evaluation on a background thread, so the
+#    calling thread ( e.g. a request handler ) is free while the store is
+#    read and c4 evaluates the program.
+#    Ex: job = q.run_async( structured=True )
+#        ...
+#        allProgramData = job.result( timeout=30 )
+#
+# 2. cancel() asks the run to stop. The run checks for cancellation
+#    between relation reads, program chunks, and before handing the
+#    program to c4, and tears down its c4 instance on the way out. A
+#    single libc4 call in progress is never interrupted. result() then
+#    raises RunCancelled, also when the run got past its last check.
+#
+# 3. Only one run per Quest instance may be in flight at a time.
+#
+##########################################################################
+
+#############
+#  IMPORTS  #
+#############
+# standard python packages
+import logging, sys, threading
+
+# ------------------------------------------------------ #
+# ------------------------------------------------------ #
+
+###################
+#  RUN CANCELLED  #
+###################
+class RunCancelled( Exception ) :
+  pass
+
+
+running = threading.local()   # running.job is the QuestJob of the current thread
+
+#################
+#  CURRENT JOB  #
+#################
+# return the QuestJob running on the calling thread, or None.
+def currentJob( ) :
+  return getattr( running, "job", None )
+
+
+class QuestJob( object ) :
+
+  ################
+  #  ATTRIBUTES  #
+  ################
+  target      = None   # function performing the run, returning its results
+  cancelEvent = None   # threading.Event set once cancel() is called
+  doneEvent   = None   # threading.Event set once the run has finished
+  thread      = None   # background thread performing the run
+  value       = None   # return value of target
+  error       = None   # exception raised by target, if any
+  callback    = None   # optional function called with the job when done
+
+  ##########
+  #  INIT  #
+  ##########
+  def __init__( self, target, callback=None ) :
+    self.target      = target
+    self.callback    = callback
+    self.cancelEvent = threading.Event()
+    self.doneEvent   = threading.Event()
+
+    self.thread        = threading.Thread( target=self.work, name="QuestJob" )
+    self.thread.daemon = True
+
+
+  ###########
+  #  START  #
+  ###########
+  def start( self ) :
+    self.thread.start()
+    return self
+
+
+  ##########
+  #  WORK  #
+  ##########
+  # body of the background thread.
+  # SystemExits are kept as well, so fatal Quest errors reach result().
+  def work( self ) :
+
+    running.job = self
+
+    try :
+      self.value = self.target()
+
+    except BaseException as e :
+      logging.debug( "  QUESTJOB : run failed : " + repr( e ) )
+      self.error = e
+
+    finally :
+      # results nobody will read must not keep a c4 instance alive
+      if self.cancelEvent.is_set() :
+        self.closeResults()
+
+      running.job = None
+
+      self.doneEvent.set()
+      if self.callback :
+        self.callback( self )
+
+
+  ############
+  #  CANCEL  #
+  ############
+  # ask the run to stop. return False if it already finished.
+  def cancel( self ) :
+
+    self.cancelEvent.set()
+
+    if self.doneEvent.is_set() :
+      self.closeResults()
+      return False
+
+    return True
+
+
+  ###################
+  #  CLOSE RESULTS  #
+  ###################
+  # close a ResultCursor the run returned, releasing its c4 instance.
+  def closeResults( self ) :
+    if self.value and hasattr( self.value[2], "close" ) :
+      self.value[2].close()
+
+
+  ###############
+  #  CANCELLED  #
+  ###############
+  def cancelled( self ) :
+    return self.cancelEvent.is_set()
+
+
+  ##########
+  #  DONE  #
+  ##########
+  def done( self ) :
+    return self.doneEvent.is_set()
+
+
+  ############
+  #  RESULT  #
+  ############
+  # wait for the run and return its results. raise the exception the run
+  # failed with, or RunCancelled if it was cancelled. results of a run
+  # cancelled after its last check were closed and are not returned.
+  def result( self, timeout=None ) :
+
+    if not self.doneEvent.wait( timeout ) :
+      raise RuntimeError( "QuestJob : run did not finish within " + str( timeout ) + " seconds" )
+
+    if self.error :
+      raise self.error
+
+    if self.cancelEvent.is_set() :
+      raise RunCancelled( "run cancelled" )
+
+    return self.value
+
+
+#########
+#  EOF  #
+#########
@@ -0,0 +1,154 @@
+#/usr/bin/env python
+
+##########################################################################
+# QuestResults usage notes:
+#
+# 1. A QuestResults instance maps each dumped relation name to a list of
+#    tuples. Values are decoded once using the relation schema types
+#    ( "int", "float", "bool", anything else is kept as a string ).
+#    Ex: r = q.run( structured=True )[2]
+#        r[ "a" ]            => [ (11,), (12,) ]
+#        r.getTableList()    => [ "a", "d", "b", "c" ]
+#
+# 2. c4 dumps rows as comma-joined values without quoting strings.
+#    Numeric and bool values never contain commas, so any extra fields
+#    in a row belong to a string attribute. When a relation has several
+#    string attributes the split is ambiguous and the extra fields are
+#    assigned to the first string attribute.
+#
+##########################################################################
+
+#############
+#  IMPORTS  #
+#############
+# standard python packages
+import logging, sys
+
+# ------------------------------------------------------ #
+
+BOOL_TRUE = [ "true", "True", "1" ]
+
+DECODERS = { "int"   : int, \
+             "float" : float, \
+             "bool"  : lambda v : v in BOOL_TRUE }
+
+# ------------------------------------------------------ #
+# ------------------------------------------------------ #
+
+class QuestResults( object ) :
+
+  ################
+  #  ATTRIBUTES  #
+  ################
+  relations = None   # dictionary mapping relation names to lists of tuples
+  tableList = None   # relation names in dump order
+
+  ##########
+  #  INIT  #
+  ##########
+  def __init__( self ) :
+    self.relations = {}
+    self.tableList = []
+
+
+  ##################
+  #  ADD RELATION  #
+  ##################
+  def addRelation( self, relationName, rows ) :
+    if not relationName in self.relations :
+      self.tableList.append( relationName )
+    self.relations[ relationName ] = rows
+
+
+  ##################
+  #  GET RELATION  #
+  ##################
+  # return the list of tuples for the given relation, or an empty list
+  def getRelation( self, relationName ) :
+    return self.relations.get( relationName, [] )
+
+
+  ####################
+  #  GET TABLE LIST  #
+  ####################
+  def getTableList( self ) :
+    return self.tableList
+
+
+  #######################
+  #  DICTIONARY ACCESS  #
+  #######################
+  def __getitem__( self, relationName ) :
+    return self.relations[ relationName ]
+
+  def __contains__( self, relationName ) :
+    return relationName in self.relations
+
+  def __iter__( self ) :
+    return iter( self.tableList )
+
+  def __len__( self ) :
+    return len( self.tableList )
+
+
+################
+#  PARSE DUMP  #
+################
+# decode one c4_dump_table buffer into a list of tuples in a single pass.
+def parseDump( dump, typeList ) :
+  return list( iterDump( dump, typeList ) )
+
+
+###############
+#  ITER DUMP  #
+###############
+# lazily decode one c4_dump_table buffer, yielding one tuple per row.
+# rows are sliced straight out of the buffer; no list of lines is built.
+def iterDump( dump, typeList ) :
+
+  if not dump :
+    return
+
+  decoders = [ DECODERS.get( t ) for t in typeList ]
+
+  start = 0
+  end   = dump.find( "\n" )
+  while end >= 0 :
+    if end > start :
+      yield decodeRow( dump[ start : end ], decoders )
+    start = end + 1
+    end   = dump.find( "\n", start )
+
+  # c4 terminates every row with a newline, but be lenient
+  if start < len( dump ) :
+    yield decodeRow( dump[ start : ], decoders )
+
+
+################
+#  DECODE ROW  #
+################
+# split a single dumped row into a typed tuple.
+# decoders holds one decoding function per attribute ( None for strings ).
+def decodeRow( rowStr, decoders ) :
+
+  fields = rowStr.split( "," )
+  arity  = len( decoders )
+  extra  = len( fields ) - arity
+
+  if extra < 0 :
+    sys.exit( "ERROR : dumped row '" + rowStr + "' has fewer values than its schema arity " + str( arity ) + ". aborting..." )
+
+  # fold extra fields back into the first string attribute
+  elif extra > 0 :
+    try :
+      i = decoders.index( None )
+    except ValueError :
+      sys.exit( "ERROR : dumped row '" + rowStr + "' has more values than its schema arity " + str( arity ) + ". aborting..." )
+    fields[ i : i + extra + 1 ] = [ ",".join( fields[ i : i + extra + 1 ] ) ]
+
+  return tuple( [ f if d is None else d( f ) for d, f in zip( decoders, fields ) ] )
+
+
+#########
+#  EOF  #
+#########
@@ -0,0 +1,301 @@
+#/usr/bin/env python
+
+##########################################################################
+# RelationBuffer usage notes:
+#
+# 1. A RelationBuffer stores the rows of one relation column by column,
+#    one column per schema attribute :
+#      int    : array of signed longs
+#      float  : array of doubles
+#      bool   : array of signed chars
+#      string : list of interned strings, so repeated values share one
+#               object
+#    Rows are checked against the schema types batch by batch as they are
+#    appended, one pass per column, so a filled buffer never needs to be
+#    verified again.
+#    Ex: buf = RelationBuffer.RelationBuffer( "b", [ "string", "int" ] )
+#        buf.extend( [ [ "id0", 1 ], [ "id0", 2 ] ] )
+#        list( buf )   => [ ( "id0", 1 ), ( "id0", 2 ) ]
+#
+# 2. Values a typed array cannot hold exactly ( ints beyond the range of a
+#    long, ints in a float column ) turn their column into a plain list,
+#    so every value reads back exactly as it was appended.
+#
+# 3. formatFacts turns a buffer into c4 fact statements straight from the
+#    typed columns, using a single format string per relation. formatRows
+#    does the same for plain lists of rows. string values are escaped, so
+#    quotes and semicolons inside them never end a fact early.
+#    Ex: buf.formatFacts()   => [ 'b("id0",1);', 'b("id0",2);' ]
+#
+##########################################################################
+
+#############
+#  IMPORTS  #
+#############
+# standard python packages
+import logging, sys
+from array     import array
+from itertools import imap, izip
+
+# ------------------------------------------------------ #
+
+# python types accepted for each schema data type
+SCHEMA_TYPES = { "int"    : [ int, long ], \
+                 "float"  : [ float, int, long ], \
+                 "string" : [ str, unicode ], \
+                 "bool"   : [ bool ] }
+
+# array typecodes of the typed columns
+TYPECODES = { "int"   : "l", \
+              "float" : "d", \
+              "bool"  : "b" }
+
+# fact text of the values stored in bool columns
+BOOL_NAMES = [ "False", "True" ]
+
+# ------------------------------------------------------ #
+# ------------------------------------------------------ #
+
+class RelationBuffer( object ) :
+
+  ################
+  #  ATTRIBUTES  #
+  ################
+  relationName = None   # name of the buffered relation
+  typeList     = None   # schema data type of each attribute
+  kinds        = None   # storage of each column : "int", "float", "bool",
+                        # "string", or "object" for a plain list
+  columns      = None   # one array or list per attribute
+  strings      = None   # intern table shared by the string columns
+  numRows      = 0      # number of buffered rows
+
+  ##########
+  #  INIT  #
+  ##########
+  def __init__( self, relationName, typeList ) :
+    self.relationName = relationName
+    self.typeList     = list( typeList )
+    self.kinds        = []
+    self.columns      = []
+    self.strings      = {}
+    self.numRows      = 0
+
+    for t in self.typeList :
+      if t in TYPECODES :
+        self.kinds.append( t )
+        self.columns.append( array( TYPECODES[ t ] ) )
+      elif t == "string" :
+        self.kinds.append( "string" )
+        self.columns.append( [] )
+      else :
+        self.kinds.append( "object" )
+        self.columns.append( [] )
+
+
+  ############
+  #  APPEND  #
+  ############
+  def append( self, row ) :
+    self.extend( [ row ] )
+
+
+  ############
+  #  EXTEND  #
+  ############
+  # check a batch of rows against the schema with checkRows and append it
+  # column by column. values are interned, converted, and stored by whole
+  # columns, without any per value dispatch in python.
+  def extend( self, rows ) :
+
+    if not type( rows ) is list :
+      rows = list( rows )
+
+    columns = checkRows( self.relationName, self.typeList, rows )
+
+    for i in range( 0, len( columns ) ) :
+      kind   = self.kinds[i]
+      column = columns[i]
+
+      if kind == "string" :
+        self.columns[i].extend( imap( self.strings.setdefault, column, column ) )
+        continue
+
+      # ints in a float column read back as ints from a plain list only
+      if kind == "float" and not set( imap( type, column ) ) == set( [ float ] ) :
+        self.toObjectColumn( i )
+        kind = "object"
+
+      if kind == "object" :
+        self.columns[i].extend( column )
+        continue
+
+      size = len( self.columns[i] )
+      try :
+        self.columns[i].extend( column )
+      except OverflowError :
+        del self.columns[i][ size: ]
+        self.toObjectColumn( i )
+        self.columns[i].extend( column )
+
+    self.numRows += len( rows )
+
+
+  ######################
+  #  TO OBJECT COLUMN  #
+  ######################
+  # turn column i into a plain list holding the values as read back.
+  def toObjectColumn( self, i ) :
+    self.columns[i] = list( self.getColumn( i ) )
+    self.kinds[i]   = "object"
+
+
+  ################
+  #  GET COLUMN  #
+  ################
+  # return an iterable over the values of column i.
+  def getColumn( self, i ) :
+    if self.kinds[i] == "bool" :
+      return imap( bool, self.columns[i] )
+    return self.columns[i]
+
+
+  ##########
+  #  ROWS  #
+  ##########
+  def __len__( self ) :
+    return self.numRows
+
+  # yield one tuple per row
+  def __iter__( self ) :
+    return izip( *[ self.getColumn( i ) for i in range( 0, len( self.columns ) ) ] )
+
+  # a row tuple for an index, a new RelationBuffer for a slice
+  def __getitem__( self, index ) :
+
+    if isinstance( index, slice ) :
+      buf         = RelationBuffer( self.relationName, self.typeList )
+      buf.kinds   = list( self.kinds )
+      buf.columns = [ col[ index ] for col in self.columns ]
+      buf.strings = self.strings
+      if len( buf.columns ) > 0 :
+        buf.numRows = len( buf.columns[0] )
+      return buf
+
+    row = []
+    for i in range( 0, len( self.columns ) ) :
+      value = self.columns[i][ index ]
+      if self.kinds[i] == "bool" :
+        value = bool( value )
+      row.append( value )
+    return tuple( row )
+
+  def __repr__( self ) :
+    return "RelationBuffer(" + str( self.relationName ) + ", " + str( self.numRows ) + " rows)"
+
+
+  ##################
+  #  FORMAT FACTS  #
+  ##################
+  # return one c4 fact statement per row. the typed columns are handed to
+  # a single format string built once from the schema, which converts and
+  # quotes the values without any per value dispatch in python. only bool
+  # columns are mapped to their names and string columns escaped first.
+  def formatFacts( self, relationName=None ) :
+
+    if relationName is None :
+      relationName = self.relationName
+
+    columns = []
+    for i in range( 0, len( self.columns ) ) :
+      if self.kinds[i] == "bool" :
+        columns.append( map( BOOL_NAMES.__getitem__, self.columns[i] ) )
+      elif self.kinds[i] == "string" :
+        columns.append( map( escapeString, self.columns[i] ) )
+      else :
+        columns.append( self.columns[i] )
+
+    rowFormat = getFactFormat( relationName, self.typeList )
+    return map( rowFormat.__mod__, izip( *columns ) )
+
+
+################
+#  CHECK ROWS  #
+################
+# check a batch of rows against the schema of a relation : the row lengths
+# in one pass over the rows, then the python types in one pass per column.
+# only a failing check looks for the offending row.
+# return the columns of the batch, one tuple per attribute.
+def checkRows( relationName, typeList, rows ) :
+
+  if len( rows ) == 0 :
+    return [ () for t in typeList ]
+
+  # make sure schema aligns with number of data items in table rows
+  if not set( imap( len, rows ) ) == set( [ len( typeList ) ] ) :
+    row = next( r for r in rows if not len( r ) == len( typeList ) )
+    sys.exit( "  FORMAT_EDB_STATEMENTS : ERROR : table '" + str( relationName ) + "' has edb definition inconsistent with length of table schema : edb = " + str( row ) + ", table schema = " + str( typeList ) )
+
+  columns = zip( *rows )
+
+  # make sure every value agrees with the schema type
+  for i in range( 0, len( columns ) ) :
+    allowedTypes = SCHEMA_TYPES.get( typeList[i] )
+    if allowedTypes and not set( imap( type, columns[i] ) ).issubset( allowedTypes ) :
+      row = next( r for r in rows if not type( r[i] ) in allowedTypes )
+      sys.exit( "  FORMAT_EDB_STATEMENTS : ERROR : table '" + str( relationName ) + "' has edb value " + repr( row[i] ) + " inconsistent with table schema type '" + typeList[i] + "' : edb = " + str( row ) + ", table schema = " + str( typeList ) )
+
+  return columns
+
+
+#####################
+#  GET FACT FORMAT  #
+#####################
+# build the format string of one c4 fact for a relation. values of string
+# attributes are quoted, everything else is inserted as its str().
+# Ex: getFactFormat( "b", [ "string", "int" ] ) => 'b("%s",%s);'
+def getFactFormat( relationName, typeList ) :
+
+  attributes = []
+  for t in typeList :
+    if t == "string" : # string values need quotes
+      attributes.append( '"%s"' )
+    else :
+      attributes.append( "%s" )
+
+  return relationName + "(" + ",".join( attributes ) + ");"
+
+
+#################
+#  FORMAT ROWS  #
+#################
+# return an iterator over one c4 fact statement per row of a plain list of
+# rows, escaping the values of string attributes.
+def formatRows( relationName, typeList, rows ) :
+
+  rowFormat = getFactFormat( relationName, typeList )
+  strings   = [ i for i in range( 0, len( typeList ) ) if typeList[i] == "string" ]
+
+  if len( strings ) == 0 :
+    return imap( rowFormat.__mod__, imap( tuple, rows ) )
+
+  def escapeRow( row ) :
+    row = list( row )
+    for i in strings :
+      row[i] = escapeString( row[i] )
+    return tuple( row )
+
+  return imap( rowFormat.__mod__, imap( escapeRow, rows ) )
+
+
+###################
+#  ESCAPE STRING  #
+###################
+# escape a string value for use between the quotes of a c4 fact.
+# Ex: escapeString( 'say "hi";' ) => 'say \\"hi\\";'
+def escapeString( value ) :
+  return value.replace( "\\", "\\\\" ).replace( '"', '\\"' )
+
+
+#########
+#  EOF  #
+#########
@@ -0,0 +1,307 @@
+#/usr/bin/env python
+
+##########################################################################
+# RelationTemplate usage notes:
+#
+# 1. A RelationTemplate records the nesting shape of a relation's stored
+#    value and compiles it into an extractor. The extractor produces the
+#    same rows as Quest.getRelationData, but walks the value with loops
+#    specialized to the shape instead of classifying every node.
+#    Ex: t = RelationTemplate.inferTemplate( { "id0": [ { 0:1 }, [11,12] ] } )
+#        t.extract( { "id7": [ { 5:6 }, [13] ] } )  => [ [ "id7", 5, 6, 13 ] ]
+#
+# 2. Shapes :
+#      ( "scalar", )                 a string or an int
+#      ( "list", ( s1, ..., sn ) )   a list whose first n elements have the
+#                                    shapes s1 ... sn, followed by any
+#                                    number of primatives
+#      ( "dict", e )                 a dict whose kv pairs all have entry
+#                                    shape e ( None for an empty dict )
+#      ( "dict_keyed", { k : e } )   a dict with exactly the keys k, where
+#                                    each kv pair has its own entry shape
+#    Entry shapes :
+#      ( "pair", )                   a primative key with a primative value
+#                                    or a list of primatives
+#      ( "keyed", k, ( s1, ..., sn ) ) a key with shape k and a list value,
+#                                    flattened as [ key ] + value
+#
+# 3. Values that do not fit the template raise TemplateMismatch, so
+#    callers can fall back to the generic flattener.
+#
+##########################################################################
+
+#############
+#  IMPORTS  #
+#############
+# standard python packages
+import logging, sys
+
+# ------------------------------------------------------ #
+
+PRIMATIVE_TYPES = [ str, int, float, bool ]
+
+# ------------------------------------------------------ #
+# ------------------------------------------------------ #
+
+#######################
+#  TEMPLATE MISMATCH  #
+#######################
+class TemplateMismatch( Exception ) :
+  pass
+
+
+#######################
+#  RELATION TEMPLATE  #
+#######################
+class RelationTemplate( object ) :
+
+  ################
+  #  ATTRIBUTES  #
+  ################
+  shape     = None   # nested shape tuple, see usage notes
+  extractor = None   # compiled function mapping a raw value to rows
+
+  ##########
+  #  INIT  #
+  ##########
+  def __init__( self, shape ) :
+    self.shape     = shape
+    self.extractor = compileShape( shape )
+
+
+  #############
+  #  EXTRACT  #
+  #############
+  # flatten a raw value into rows. raises TemplateMismatch if the value
+  # does not fit the template.
+  def extract( self, raw_value ) :
+
+    if type( raw_value ) is str or type( raw_value ) is int :
+      raw_value = [ raw_value ]
+
+    return self.extractor( raw_value )
+
+
+####################
+#  INFER TEMPLATE  #
+####################
+# build a template from a sample raw value.
+# raises TemplateMismatch if the value cannot be described by a template.
+def inferTemplate( raw_value ) :
+
+  if type( raw_value ) is str or type( raw_value ) is int :
+    raw_value = [ raw_value ]
+
+  return RelationTemplate( inferShape( raw_value ) )
+
+
+#################
+#  INFER SHAPE  #
+#################
+def inferShape( node ) :
+
+  if type( node ) is str or type( node ) is int :
+    return ( "scalar", )
+
+  elif type( node ) is list :
+    start = getPrimativeSuffix( node )
+    return ( "list", tuple( [ inferShape( node[i] ) for i in xrange( 0, start ) ] ) )
+
+  elif type( node ) is dict :
+    entries = [ ( key, inferEntryShape( key, node[ key ] ) ) for key in node ]
+
+    if len( entries ) == 0 :
+      return ( "dict", None )
+    elif all( e == entries[0][1] for key, e in entries ) :
+      return ( "dict", entries[0][1] )
+    else :
+      return ( "dict_keyed", dict( entries ) )
+
+  else :
+    raise TemplateMismatch( "unsupported value " + repr( node ) )
+
+
+#######################
+#  INFER ENTRY SHAPE  #
+#######################
+def inferEntryShape( key, value ) :
+
+  if type( key ) in PRIMATIVE_TYPES and type( value ) in PRIMATIVE_TYPES :
+    return ( "pair", )
+
+  elif type( value ) is list :
+    start = getPrimativeSuffix( value )
+    if start == 0 and type( key ) in PRIMATIVE_TYPES :
+      return ( "pair", )
+    else :
+      return ( "keyed", inferShape( key ), tuple( [ inferShape( value[i] ) for i in xrange( 0, start ) ] ) )
+
+  else :
+    raise TemplateMismatch( "cannot merge key " + repr( key ) + " with value " + repr( value ) )
+
+
+###################
+#  COMPILE SHAPE  #
+###################
+# turn a shape into an extractor function mapping a value to rows
+def compileShape( shape ) :
+
+  kind = shape[0]
+
+  # ---------------------------------------------------------- #
+  if kind == "scalar" :
+    def extractScalar( node ) :
+      if not ( type( node ) is str or type( node ) is int ) :
+        raise TemplateMismatch( "expected a primative, got " + repr( node ) )
+      return [ [ node ] ]
+    return extractScalar
+
+  # ---------------------------------------------------------- #
+  elif kind == "list" :
+    return compileList( [ compileShape( s ) for s in shape[1] ] )
+
+  # ---------------------------------------------------------- #
+  elif kind == "dict" :
+
+    if shape[1] is None :
+      def extractEmptyDict( node ) :
+        if not type( node ) is dict or len( node ) > 0 :
+          raise TemplateMismatch( "expected an empty dict, got " + repr( node ) )
+        return []
+      return extractEmptyDict
+
+    extractEntry = compileEntry( shape[1] )
+    def extractDict( node ) :
+      if not type( node ) is dict :
+        raise TemplateMismatch( "expected a dict, got " + repr( node ) )
+      relationData = []
+      for key in node :
+        relationData.extend( extractEntry( key, node[ key ] ) )
+      return relationData
+    return extractDict
+
+  # ---------------------------------------------------------- #
+  elif kind == "dict_keyed" :
+
+    extractors = {}
+    for key in shape[1] :
+      extractors[ key ] = compileEntry( shape[1][ key ] )
+
+    def extractKeyedDict( node ) :
+      if not type( node ) is dict or not len( node ) == len( extractors ) :
+        raise TemplateMismatch( "expected a dict with keys " + repr( extractors.keys() ) )
+      relationData = []
+      for key in node :
+        try :
+          extractEntry = extractors[ key ]
+        except KeyError :
+          raise TemplateMismatch( "unexpected key " + repr( key ) )
+        relationData.extend( extractEntry( key, node[ key ] ) )
+      return relationData
+    return extractKeyedDict
+
+  # ---------------------------------------------------------- #
+  else :
+    sys.exit( "ERROR : unrecognized relation template shape '" + str( kind ) + "'. aborting..." )
+
+
+##################
+#  COMPILE LIST  #
+##################
+# extractor for a list of n shaped elements followed by primatives
+def compileList( prefixExtractors ) :
+
+  n = len( prefixExtractors )
+
+  def extractList( node ) :
+    if not type( node ) is list or len( node ) < n :
+      raise TemplateMismatch( "expected a list of at least " + str( n ) + " elements, got " + repr( node ) )
+
+    relationData = []
+    for i in xrange( n, len( node ) ) :
+      if not type( node[i] ) in PRIMATIVE_TYPES :
+        raise TemplateMismatch( "expected a primative, got " + repr( node[i] ) )
+      relationData.append( [ node[i] ] )
+
+    for i in xrange( n-1, -1, -1 ) :
+      relationData = mergeSubRelations( prefixExtractors[i]( node[i] ), relationData )
+
+    return relationData
+
+  return extractList
+
+
+###################
+#  COMPILE ENTRY  #
+###################
+# turn an entry shape into a function mapping one kv pair to rows
+def compileEntry( shape ) :
+
+  # ---------------------------------------------------------- #
+  if shape[0] == "pair" :
+    def extractPair( key, value ) :
+      if not type( key ) in PRIMATIVE_TYPES :
+        raise TemplateMismatch( "expected a primative key, got " + repr( key ) )
+
+      if type( value ) in PRIMATIVE_TYPES :
+        return [ [ key, value ] ]
+
+      elif type( value ) is list :
+        relationData = []
+        for val in value :
+          if not type( val ) in PRIMATIVE_TYPES :
+            raise TemplateMismatch( "expected a primative, got " + repr( val ) )
+          relationData.append( [ key, val ] )
+        return relationData
+
+      raise TemplateMismatch( "expected a primative value, got " + repr( value ) )
+    return extractPair
+
+  # ---------------------------------------------------------- #
+  # [ key ] + value, without building the combined list
+  else :
+    extractKey   = compileShape( shape[1] )
+    extractValue = compileList( [ compileShape( s ) for s in shape[2] ] )
+    def extractKeyed( key, value ) :
+      return mergeSubRelations( extractKey( key ), extractValue( value ) )
+    return extractKeyed
+
+
+##########################
+#  GET PRIMATIVE SUFFIX  #
+##########################
+# return the index where the trailing run of primatives in a list starts
+def getPrimativeSuffix( raw_value ) :
+
+  start = len( raw_value )
+  while start > 0 and type( raw_value[ start-1 ] ) in PRIMATIVE_TYPES :
+    start -= 1
+
+  return start
+
+
+#########################
+#  MERGE SUB RELATIONS  #
+#########################
+# merge the sub relation of a list element with the sub relation of the
+# elements following it. an empty side leaves the other side unchanged,
+# otherwise the result is the cross product of both sides.
+def mergeSubRelations( left_subRelation, right_subRelation ) :
+
+  if len( left_subRelation ) == 0 :
+    return right_subRelation
+
+  elif len( right_subRelation ) == 0 :
+    return left_subRelation
+
+  relationData = []
+  for row1 in right_subRelation :
+    for row2 in left_subRelation :
+      relationData.append( row2 + row1 )
+
+  return relationData
+
+
+#########
+#  EOF  #
+#########
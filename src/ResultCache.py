@@ -0,0 +1,156 @@
+#/usr/bin/env python
+
+##########################################################################
+# ResultCache usage notes:
+#
+# 1. A ResultCache keeps the results of whole Quest runs in memory.
+#    Entries are keyed by a canonical hash of the rule set, the schema of
+#    every referenced relation, a fingerprint of every relation's raw
+#    store value, and the requested outputs. Running the same program
+#    over unchanged data then skips flattening, c4 evaluation, and
+#    dumping. The store is still read to compute the fingerprints.
+#    Ex: cache = ResultCache.ResultCache( 64 )
+#        q.setResultCache( cache )
+#        q.run()   # evaluates and fills the cache
+#        q.run()   # served from the cache
+#
+# 2. At most maxEntries runs are kept, the least recently used entry is
+#    evicted first. Adapters that learn about store changes can drop the
+#    affected entries with invalidate( relationName ).
+#
+# 3. Cached results are shared between the runs they are returned to and
+#    must not be modified.
+#
+# 4. Runs with keep_program unset are cached without their program
+#    statements. A later run of the same program asking for them is
+#    evaluated again and replaces the entry.
+#
+##########################################################################
+
+#############
+#  IMPORTS  #
+#############
+# standard python packages
+import hashlib, logging, sys, threading
+from collections import OrderedDict
+
+# ------------------------------------------------------ #
+# ------------------------------------------------------ #
+
+class ResultCache( object ) :
+
+  ################
+  #  ATTRIBUTES  #
+  ################
+  maxEntries = 0      # maximum number of cached runs
+  entries    = None   # ordered dictionary mapping run keys to
+                      # [ program statements, results, relation names ],
+                      # least recently used first
+  hits       = 0      # number of runs served from the cache
+  misses     = 0      # number of runs that had to be evaluated
+  lock       = None   # threading.Lock guarding the entries and the counters
+
+  ##########
+  #  INIT  #
+  ##########
+  def __init__( self, maxEntries=128 ) :
+    self.maxEntries = maxEntries
+    self.entries    = OrderedDict()
+    self.hits       = 0
+    self.misses     = 0
+    self.lock       = threading.Lock()
+
+
+  #########
+  #  GET  #
+  #########
+  # return [ program statements, results ] cached for key, or None.
+  # a hit becomes the most recently used entry. if withStatements is set,
+  # runs cached without their program statements count as misses.
+  def get( self, key, withStatements=False ) :
+
+    with self.lock :
+      entry = self.entries.get( key )
+
+      if entry is None or ( withStatements and entry[0] is None ) :
+        self.misses += 1
+        return None
+
+      del self.entries[ key ]
+      self.entries[ key ] = entry
+      self.hits += 1
+      return entry[:2]
+
+
+  #########
+  #  PUT  #
+  #########
+  # store the outcome of a run over the given relations, evicting the
+  # least recently used runs beyond maxEntries.
+  def put( self, key, statements, results, relationNames ) :
+
+    with self.lock :
+      self.entries.pop( key, None )
+      self.entries[ key ] = [ statements, results, set( relationNames ) ]
+
+      while len( self.entries ) > self.maxEntries :
+        evictedKey, evicted = self.entries.popitem( last=False )
+        logging.debug( "  RESULTCACHE : evicted run " + str( evictedKey ) )
+
+
+  ################
+  #  INVALIDATE  #
+  ################
+  # drop every run that read the given relation, or every run if None.
+  def invalidate( self, relationName=None ) :
+
+    with self.lock :
+      if relationName is None :
+        self.entries = OrderedDict()
+        return
+
+      for key in self.entries.keys() :
+        if relationName in self.entries[ key ][2] :
+          del self.entries[ key ]
+
+
+  #########
+  #  LEN  #
+  #########
+  def __len__( self ) :
+    with self.lock :
+      return len( self.entries )
+
+
+##############
+#  MAKE KEY  #
+##############
+# build the key of one run.
+#   rules        : list of rule texts in canonical form
+#   schema       : list of ( relation name, type list ) pairs
+#   fingerprints : list of ( relation name, fingerprint ) pairs
+#   outputs      : relation names to dump
+#   structured   : whether results are decoded into a QuestResults
+# rules are sorted since their order does not change the results.
+def makeKey( rules, schema, fingerprints, outputs, structured ) :
+
+  canonical = repr( ( sorted( rules ), \
+                      sorted( [ ( name, tuple( types ) ) for name, types in schema ] ), \
+                      sorted( fingerprints ), \
+                      list( outputs ), \
+                      bool( structured ) ) )
+
+  return hashlib.md5( canonical ).hexdigest()
+
+
+#################
+#  FINGERPRINT  #
+#################
+# digest of one raw store value.
+def fingerprint( raw_value ) :
+  return hashlib.md5( repr( raw_value ) ).hexdigest()
+
+
+#########
+#  EOF  #
+#########
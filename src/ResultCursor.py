@@ -0,0 +1,108 @@
+#/usr/bin/env python
+
+##########################################################################
+# ResultCursor usage notes:
+#
+# 1. A ResultCursor lazily walks the dumped relations of a live c4
+#    instance. Each relation is dumped only when the cursor reaches it,
+#    and its rows are decoded from the dump buffer as they are consumed,
+#    so at most one relation's raw dump is held at any time.
+#    Ex: cursor = q.run( stream=True )[2]
+#        for relationName, rows in cursor :
+#          for row in rows :
+#            out.write( relationName + str( row ) + "\n" )
+#
+# 2. The cursor owns the c4 instance it reads from when it was returned
+#    by a plain run(). The instance is torn down once the last relation
+#    has been produced, or when close() is called.
+#
+##########################################################################
+
+#############
+#  IMPORTS  #
+#############
+# standard python packages
+import logging, sys, threading
+import QuestResults
+
+# ------------------------------------------------------ #
+# ------------------------------------------------------ #
+
+class ResultCursor( object ) :
+
+  ################
+  #  ATTRIBUTES  #
+  ################
+  lib       = None   # loaded libc4
+  c4_obj    = None   # pointer to the c4 instance holding the results
+  tableList = None   # relation names to dump, in order
+  schema    = None   # dictionary mapping relation names to attribute types
+  closeFunc = None   # optional teardown called once the cursor is done
+  lock      = None   # lock serializing libc4 calls on c4_obj
+
+  ##########
+  #  INIT  #
+  ##########
+  # lock is the lock of the wrapper owning c4_obj, if it is shared.
+  def __init__( self, lib, c4_obj, tableList, schema, closeFunc=None, lock=None ) :
+    self.lib       = lib
+    self.c4_obj    = c4_obj
+    self.tableList = tableList
+    self.schema    = schema
+    self.closeFunc = closeFunc
+    self.lock      = lock
+
+    if self.lock is None :
+      self.lock = threading.RLock()
+
+
+  ##########
+  #  ITER  #
+  ##########
+  # yield ( relationName, row iterator ) pairs, dumping one table at a time.
+  def __iter__( self ) :
+
+    try :
+      for table in self.tableList :
+        if self.c4_obj is None :
+          sys.exit( "ERROR : ResultCursor : cursor is closed. aborting..." )
+
+        logging.debug( "  RESULTCURSOR : dumping table '" + str( table ) + "'" )
+        with self.lock :
+          dump = self.lib.c4_dump_table( self.c4_obj, table )
+        yield table, QuestResults.iterDump( dump, self.schema[ table ] )
+        dump = None
+
+    finally :
+      self.close()
+
+
+  ###########
+  #  CLOSE  #
+  ###########
+  def close( self ) :
+
+    if self.closeFunc :
+      self.closeFunc()
+
+    self.closeFunc = None
+    self.c4_obj    = None
+
+
+  ################
+  #  TO RESULTS  #
+  ################
+  # drain the cursor into a QuestResults instance.
+  def toResults( self ) :
+
+    results = QuestResults.QuestResults()
+
+    for table, rows in self :
+      results.addRelation( table, list( rows ) )
+
+    return results
+
+
+#########
+#  EOF  #
+#########
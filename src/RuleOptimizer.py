@@ -0,0 +1,166 @@
+#/usr/bin/env python
+
+##########################################################################
+# RuleOptimizer usage notes:
+#
+# 1. shareSubexpressions finds rules whose bodies are identical up to
+#    variable renaming and evaluates each such body once, into a helper
+#    relation named after the first rule's goal. The rules then read the
+#    helper instead of repeating the join.
+#    Ex: d(Y,Z) :- c(_,Y,_,Z) ;
+#        e(A)   :- c(_,B,_,A) ;
+#        => d_qc0(Y,Z) :- c(_,Y,_,Z) ;
+#           d(Y,Z) :- d_qc0(Y,Z) ;
+#           e(A)   :- d_qc0(B,A) ;
+#    The helper keeps only the body variables some goal of its group uses.
+#
+# 2. Bodies must match atom by atom, in order, including notin subgoals,
+#    constants, and qualifiers. Groups whose helper attributes cannot all
+#    be typed from the schema are left alone.
+#
+##########################################################################
+
+#############
+#  IMPORTS  #
+#############
+# standard python packages
+import logging, sys
+import DatalogParser
+
+# ------------------------------------------------------ #
+# ------------------------------------------------------ #
+
+##########################
+#  SHARE SUBEXPRESSIONS  #
+##########################
+# rewrite a list of Rules so every body shared by several rules is
+# derived once. schema maps relation names to type lists.
+# return [ helpers, rules ] where helpers lists [ relation name, type list ]
+# per helper relation and rules lists the rewritten rule texts, helper
+# rules first.
+def shareSubexpressions( rules, schema ) :
+
+  # group rules by canonical body, in order of first appearance
+  groups = []
+  keys   = {}
+  for rule in rules :
+    if len( rule.body ) == 0 :
+      continue
+    key, variables = getBodyKey( rule )
+    if not key in keys :
+      keys[ key ] = len( groups )
+      groups.append( [] )
+    groups[ keys[ key ] ].append( [ rule, variables ] )
+
+  helpers     = []
+  helperRules = []
+  rewritten   = {}   # id of a rule => rewritten rule text
+
+  for group in groups :
+    if len( group ) < 2 :
+      continue
+
+    # canonical positions of the body variables read by any goal
+    positions = []
+    for rule, variables in group :
+      for arg in rule.head.args :
+        for v in arg.variables :
+          if v in variables and not variables.index( v ) in positions :
+            positions.append( variables.index( v ) )
+    positions.sort()
+
+    first, firstVariables = group[0]
+    typeList = getVariableTypes( first, [ firstVariables[p] for p in positions ], schema )
+    if len( positions ) == 0 or typeList is None :
+      continue
+
+    name = first.head.name + "_qc" + str( len( helpers ) )
+    helpers.append( [ name, typeList ] )
+
+    helperRules.append( formatRule( name, [ firstVariables[p] for p in positions ], first ) )
+
+    for rule, variables in group :
+      helperAtom = name + "(" + ",".join( [ variables[p] for p in positions ] ) + ")"
+      rewritten[ id( rule ) ] = repr( rule.head ) + " :- " + helperAtom + " ;"
+
+    logging.debug( "  SHARESUBEXPRESSIONS : " + str( len( group ) ) + " rules share body of '" + first.text + "' through '" + name + "'" )
+
+  ruleTexts = []
+  for rule in rules :
+    ruleTexts.append( rewritten.get( id( rule ), rule.text ) )
+
+  return [ helpers, helperRules + ruleTexts ]
+
+
+##################
+#  GET BODY KEY  #
+##################
+# canonical text of a rule body with its variables renamed in order of
+# first appearance. return [ key, variables ] where variables lists the
+# original variable names in that order.
+def getBodyKey( rule ) :
+
+  variables = []
+
+  def rename( tokens ) :
+    renamed = []
+    for kind, text in tokens :
+      if kind == "variable" :
+        if not text in variables :
+          variables.append( text )
+        text = "V" + str( variables.index( text ) )
+      renamed.append( ( kind, text ) )
+    return DatalogParser.joinTokens( renamed )
+
+  items = []
+  for atom in rule.body :
+    args = [ rename( DatalogParser.tokenize( a.value ) ) for a in atom.args ]
+    items.append( ( atom.negated, atom.name, tuple( args ) ) )
+  for q in rule.qualifiers :
+    items.append( rename( DatalogParser.tokenize( q.value ) ) )
+
+  return [ repr( items ), variables ]
+
+
+########################
+#  GET VARIABLE TYPES  #
+########################
+# schema type of each variable, taken from a positive subgoal binding it.
+# return None if some variable cannot be typed.
+def getVariableTypes( rule, variables, schema ) :
+
+  typeList = []
+
+  for v in variables :
+    varType = None
+    for atom in rule.body :
+      atomTypes = schema.get( atom.name )
+      if atom.negated or not atomTypes :
+        continue
+      for i in range( 0, min( len( atom.args ), len( atomTypes ) ) ) :
+        if atom.args[i].kind == "variable" and atom.args[i].value == v :
+          varType = atomTypes[i]
+          break
+      if varType :
+        break
+
+    if varType is None :
+      return None
+    typeList.append( varType )
+
+  return typeList
+
+
+#################
+#  FORMAT RULE  #
+#################
+# text of the helper rule deriving name( headVariables ) from the body of
+# rule.
+def formatRule( name, headVariables, rule ) :
+  items = [ repr( a ) for a in rule.body ] + [ q.value for q in rule.qualifiers ]
+  return name + "(" + ",".join( headVariables ) + ") :- " + ", ".join( items ) + " ;"
+
+
+#########
+#  EOF  #
+#########
@@ -9,10 +9,10 @@ Test_quest.py
 #  IMPORTS  #
 #############
 # standard python packages
-import inspect, logging, os, pickledb, sqlite3, sys, unittest
+import contextlib, ctypes, inspect, logging, multiprocessing, os, pickledb, signal, sqlite3, sys, threading, unittest
 from StringIO import StringIO
 
-import Quest
+import BaseServer, C4Pool, C4Session, C4Wrapper, DatalogParser, FlattenCache, Quest, QuestJob, RelationBuffer, RelationTemplate, ResultCache, RuleOptimizer
 
 
 ################
@@ -24,6 +24,1750 @@ class Test_quest( unittest.TestCase ) :
   logging.basicConfig( format='%(levelname)s:%(message)s', level=logging.INFO )
 
 
+  ################
+  #  MAKE QUEST  #
+  ################
+  # pickledb Quest instance over dbInst with the given rules and schema.
+  def makeQuest( self, dbInst, rules, schema ) :
+
+    q = Quest.Quest( "pickledb", dbInst )
+    for rule in rules :
+      q.setQuery( rule )
+    for rel in schema :
+      q.setSchema( rel, schema[rel] )
+
+    return q
+
+
+  ####################
+  #  COUNTING READS  #
+  ####################
+  # context manager yielding the list of relations read from the store
+  # while it is active.
+  @contextlib.contextmanager
+  def countingReads( self ) :
+
+    reads    = []
+    original = Quest.Adapter.Adapter.get
+
+    def countingGet( ad, relationName, dbcursor ) :
+      reads.append( relationName )
+      return original( ad, relationName, dbcursor )
+
+    Quest.Adapter.Adapter.get = countingGet
+    try :
+      yield reads
+    finally :
+      Quest.Adapter.Adapter.get = original
+
+
+  ################
+  #  EXAMPLE 45  #
+  ################
+  # tests leaving out rules and relations the outputs do not depend on
+  def test_example45( self ) :
+
+    test_id = "test_example45"
+
+    # --------------------------------------------------------------- #
+    logging.info( "  " + test_id + ": initializing pickledb instance." )
+    dbInst = pickledb.load( "./test_quest.db", False )
+
+    # --------------------------------------------------------------- #
+    dbInst.set( "b", { "k0": 1, "k1": 2 } )
+    dbInst.set( "c", [ [ 1, 2 ], 10 ] )
+    dbInst.set( "g", [ 1, 3 ] )
+
+    # --------------------------------------------------------------- #
+    schema = { "a":["string","int"], "x":["string"], "e":["int"], "g":["int"], "b":["string","int"], "c":["int","int"] }
+    rules  = [ "a(K,Z) :- b(K,Y), c(Y,Z) ;", \
+               "e(Y) :- g(Y), notin c(Y,_) ;", \
+               "x(K) :- a(K,_), notin e(1) ;" ]
+
+    reads = []   # relations read by the last runQuest
+
+    def runQuest( **kwargs ) :
+      q = self.makeQuest( dbInst, rules, schema )
+      with self.countingReads() as runReads :
+        allProgramData = q.run( **kwargs )
+      reads[:] = runReads
+      return allProgramData
+
+    # idb relations are looked up in the store as well
+    everything = runQuest( structured=True )
+    self.assertEqual( sorted( reads ), [ "a", "b", "c", "e", "g", "x" ] )
+
+    # only the rules and relations a depends on are evaluated
+    actual = runQuest( structured=True, outputs=[ "a" ] )
+    self.assertEqual( sorted( reads ), [ "a", "b", "c" ] )
+    self.assertEqual( actual[1], [ "a", "b", "c" ] )
+    self.assertEqual( [ s for s in actual[0] if ":-" in s ], rules[:1] )
+    self.assertEqual( sorted( actual[2][ "a" ] ), sorted( everything[2][ "a" ] ) )
+
+    # dependencies are followed through idbs and notin subgoals
+    actual = runQuest( structured=True, outputs=[ "x" ], batch_size=2 )
+    self.assertEqual( sorted( reads ), [ "a", "b", "c", "e", "g", "x" ] )
+    self.assertEqual( [ s for s in actual[0] if ":-" in s ], rules )
+    self.assertEqual( sorted( actual[2][ "x" ] ), sorted( everything[2][ "x" ] ) )
+
+    actual = runQuest( outputs=[ "e" ] )
+    self.assertEqual( sorted( reads ), [ "c", "e", "g" ] )
+    self.assertEqual( actual[1], [ "c", "e", "g" ] )
+
+    # batches are pruned per rule set
+    q = self.makeQuest( dbInst, [], schema )
+    with self.countingReads() as reads :
+      batch = q.runBatch( [ rules, rules ], [ [ "a" ], [ "e" ] ] )
+    self.assertEqual( sorted( reads ), [ "a", "b", "c", "e", "g" ] )
+    self.assertEqual( [ s for s in batch[0][0] if ":-" in s ], [ "a_qb0(K,Z) :- b(K,Y), c(Y,Z) ;", "e_qb1(Y) :- g(Y), notin c(Y,_) ;" ] )
+
+    # store values kept under idb names reach batches as they reach run
+    dbInst.set( "e", [ 7 ] )
+    batch = q.runBatch( [ rules, rules ], [ [ "a" ], [ "e" ] ] )
+    self.assertTrue( "e_qb1(C0) :- e(C0) ;" in batch[0][0] )
+    self.assertEqual( batch[1][2], runQuest( outputs=[ "e" ] )[2] )
+    self.assertTrue( "7" in batch[1][2] )
+
+    # ---------------------------- #
+    dbInst.deldb()
+
+
+  ################
+  #  EXAMPLE 44  #
+  ################
+  # tests deriving rule bodies shared by several rules once
+  def test_example44( self ) :
+
+    test_id = "test_example44"
+
+    # --------------------------------------------------------------- #
+    logging.info( "  " + test_id + ": initializing pickledb instance." )
+    dbInst = pickledb.load( "./test_quest.db", False )
+
+    # --------------------------------------------------------------- #
+    dbInst.set( "b", { "k0": 1, "k1": 2 } )
+    dbInst.set( "c", [ [ 1, 2 ], 10 ] )
+
+    # --------------------------------------------------------------- #
+    schema = { "a":["string","int"], "f":["int","string"], "d":["int"], "b":["string","int"], "c":["int","int"] }
+    rules  = [ "a(K,Z) :- b(K,Y), c(Y,Z) ;", \
+               "f(W,J) :- b(J,X), c(X,W) ;", \
+               "d(Y) :- c(Y,_) ;", \
+               "d(Z) :- b(_,Z), notin c(Z,_) ;" ]
+
+    def runQuest( rules, share, **kwargs ) :
+      q = self.makeQuest( dbInst, rules, schema )
+      q.setShareSubexpressions( share )
+      return q.run( **kwargs )
+
+    expected = runQuest( rules, False )
+    actual   = runQuest( rules, True )
+
+    self.assertEqual( actual[2], expected[2] )
+    self.assertTrue( "define(a_qc0,{string, int});" in actual[0] )
+    self.assertTrue( "a_qc0(K,Z) :- b(K,Y), c(Y,Z) ;" in actual[0] )
+    self.assertTrue( "a(K,Z) :- a_qc0(K,Z) ;" in actual[0] )
+    self.assertTrue( "f(W,J) :- a_qc0(J,W) ;" in actual[0] )
+    self.assertEqual( len( [ s for s in actual[0] if s.startswith( "define(a_qc" ) ] ), 1 )
+    self.assertEqual( runQuest( rules, True, batch_size=2 )[2], expected[2] )
+
+    # helpers only keep the variables some goal reads
+    helpers, shared = RuleOptimizer.shareSubexpressions( [ DatalogParser.parseRule( r ) for r in [ "d(Y) :- c(Y,Z) ;", "d(A) :- c(A,B) ;" ] ], schema )
+    self.assertEqual( helpers, [ [ "d_qc0", [ "int" ] ] ] )
+    self.assertEqual( shared, [ "d_qc0(Y) :- c(Y,Z) ;", "d(Y) :- d_qc0(Y) ;", "d(A) :- d_qc0(A) ;" ] )
+
+    # bodies are shared across the rule sets of a batch
+    q = self.makeQuest( dbInst, [], schema )
+    q.setShareSubexpressions( True )
+    batch = q.runBatch( [ rules[:1], rules[1:2] ] )
+    self.assertEqual( batch[0][2], runQuest( rules[:1], False )[2] )
+    self.assertEqual( batch[1][2], runQuest( rules[1:2], False )[2] )
+    self.assertEqual( len( [ s for s in batch[0][0] if s.startswith( "define(a_qb0_qc" ) ] ), 1 )
+
+    # ---------------------------- #
+    dbInst.deldb()
+
+
+  ################
+  #  EXAMPLE 43  #
+  ################
+  # tests evaluating several rule sets in one batch program
+  def test_example43( self ) :
+
+    test_id = "test_example43"
+
+    # --------------------------------------------------------------- #
+    logging.info( "  " + test_id + ": initializing pickledb instance." )
+    dbInst = pickledb.load( "./test_quest.db", False )
+
+    # --------------------------------------------------------------- #
+    dbInst.set( "b", { "k0": 1, "k1": 2 } )
+    dbInst.set( "c", [ [ 1, 2 ], 10 ] )
+
+    # --------------------------------------------------------------- #
+    schema = { "a":["string","int"], "d":["int"], "b":["string","int"], "c":["int","int"] }
+    ruleSets = [ [ "a(K,Z) :- b(K,Y), c(Y,Z) ;" ], \
+                 [ "d(Y) :- c(Y,_) ;", "a(K,Y) :- b(K,Y), notin d(Y) ;" ], \
+                 [ "d(Z) :- c(_,Z) ;" ] ]
+
+    expected = [ self.makeQuest( dbInst, rules, schema ).run()[2] for rules in ruleSets ]
+    expectedStructured = [ self.makeQuest( dbInst, rules, schema ).run( structured=True )[2] for rules in ruleSets ]
+
+    # every relation is read and installed once for the whole batch
+    with self.countingReads() as reads :
+      batch = self.makeQuest( dbInst, [], schema ).runBatch( ruleSets )
+
+    self.assertEqual( sorted( reads ), [ "a", "b", "c", "d" ] )
+    self.assertEqual( [ entry[2] for entry in batch ], expected )
+    self.assertEqual( [ entry[1] for entry in batch ], [ [ "a", "b", "c" ], [ "d", "c", "a", "b" ], [ "d", "c" ] ] )
+    self.assertTrue( batch[0][0] is batch[1][0] )
+    self.assertTrue( "define(a_qb0,{string, int});" in batch[0][0] )
+    self.assertTrue( "a_qb1(K,Y) :- b(K,Y), notin d_qb1(Y) ;" in batch[0][0] )
+    self.assertEqual( len( [ s for s in batch[0][0] if s.startswith( "b(" ) ] ), 2 )
+
+    # structured results and outputs are split per rule set
+    batch = self.makeQuest( dbInst, [], schema ).runBatch( ruleSets, [ [ "a" ], None, [ "d" ] ], structured=True )
+    self.assertEqual( batch[0][2].getTableList(), [ "a" ] )
+    for i in range( 0, len( ruleSets ) ) :
+      for t in batch[i][2] :
+        self.assertEqual( sorted( batch[i][2][t] ), sorted( expectedStructured[i][t] ) )
+
+    # rule sets are checked under their own names
+    self.assertRaises( SystemExit, self.makeQuest( dbInst, [], schema ).runBatch, [ ruleSets[0], [ "a(K) :- b(K,_) ;" ] ] )
+
+    # ---------------------------- #
+    dbInst.deldb()
+
+
+  ################
+  #  EXAMPLE 42  #
+  ################
+  # tests running many programs over base relations loaded once
+  def test_example42( self ) :
+
+    test_id = "test_example42"
+
+    # --------------------------------------------------------------- #
+    logging.info( "  " + test_id + ": initializing pickledb instance." )
+    dbInst = pickledb.load( "./test_quest.db", False )
+
+    # --------------------------------------------------------------- #
+    dbInst.set( "b", { "k0": 1, "k1": 2 } )
+    dbInst.set( "c", [ [ 1, 2 ], 10 ] )
+
+    # --------------------------------------------------------------- #
+    schema = { "a":["string","int"], "d":["int"], "b":["string","int"], "c":["int","int"] }
+    rules1 = [ "a(K,Z) :- b(K,Y), c(Y,Z) ;" ]
+    rules2 = [ "d(Y) :- c(Y,_) ;", "a(K,Y) :- b(K,Y), d(Y) ;" ]
+
+    expected1 = self.makeQuest( dbInst, rules1, schema ).run( structured=True )[2]
+    expected2 = self.makeQuest( dbInst, rules2, schema ).run()[2]
+
+    for bulk in [ False, True ] :
+      q = self.makeQuest( dbInst, [], schema )
+      q.setBulkLoad( bulk )
+      with self.countingReads() as reads :
+        bs = BaseServer.BaseServer( q, [ "b", "c" ] )
+
+      try :
+        self.assertEqual( sorted( reads ), [ "b", "c" ] )
+        arities = dict( q.edb_arities )
+
+        # programs install only their own rules, never the base again
+        installs = []
+        install  = bs.session.wrapper.install
+        bs.session.wrapper.install = lambda prog : installs.append( prog ) or install( prog )
+        try :
+          actual = bs.run( rules1, [ "a" ], structured=True )
+          self.assertEqual( sorted( actual[ "a" ] ), sorted( expected1[ "a" ] ) )
+          self.assertEqual( bs.run( rules2 ), expected2 )
+          self.assertEqual( len( installs ), 2 )
+          self.assertFalse( any( "k0" in prog for prog in installs ) )
+
+          # the same rules again install nothing
+          self.assertEqual( bs.run( rules2 ), expected2 )
+          self.assertEqual( len( installs ), 2 )
+        finally :
+          bs.session.wrapper.install = install
+
+        # programs see the base as it was loaded
+        dbInst.set( "b", { "k2": 1 } )
+        actual = bs.run( rules1, [ "a" ], structured=True )
+        self.assertEqual( sorted( actual[ "a" ] ), sorted( expected1[ "a" ] ) )
+        dbInst.set( "b", { "k0": 1, "k1": 2 } )
+
+        # bad programs fail before anything is installed
+        self.assertRaises( SystemExit, bs.run, [ "a(K) :- b(K,_) ;" ] )
+        self.assertRaises( SystemExit, bs.run, rules1, [ "x" ] )
+        self.assertEqual( bs.run( rules2 ), expected2 )
+
+        # the Quest is left as it was
+        self.assertEqual( q.edb_arities, arities )
+
+      finally :
+        bs.close()
+
+      self.assertRaises( SystemExit, bs.run, rules1 )
+
+    # the live instance is torn down if installing the base fails
+    def failingInstall( w, prog ) :
+      raise IOError( "bad program" )
+
+    install = C4Wrapper.C4Wrapper.install
+    C4Wrapper.C4Wrapper.install = failingInstall
+    try :
+      q = self.makeQuest( dbInst, [], schema )
+      self.assertRaises( IOError, BaseServer.BaseServer, q, [ "b", "c" ] )
+    finally :
+      C4Wrapper.C4Wrapper.install = install
+    self.assertEqual( C4Wrapper.runtimeUsers, 0 )
+
+    # ---------------------------- #
+    dbInst.deldb()
+
+
+  ################
+  #  EXAMPLE 41  #
+  ################
+  # tests sharing the c4 runtime between threads
+  def test_example41( self ) :
+
+    test_id = "test_example41"
+
+    # --------------------------------------------------------------- #
+    logging.info( "  " + test_id + ": initializing pickledb instance." )
+    dbInst = pickledb.load( "./test_quest.db", False )
+
+    # --------------------------------------------------------------- #
+    dbInst.set( "b", { "k0": 1, "k1": 2 } )
+    dbInst.set( "c", [ [ 1, 2 ], 10 ] )
+
+    # --------------------------------------------------------------- #
+    schema = { "a":["string","int"], "b":["string","int"], "c":["int","int"] }
+    query1 = "a(K,Z) :- b(K,Y), c(Y,Z) ;"
+
+    q        = self.makeQuest( dbInst, [ query1 ], schema )
+    expected = q.run()
+
+    # rules and schema belong to their instance
+    other = Quest.Quest( "pickledb", dbInst )
+    self.assertEqual( [ other.queryList, other.schema, len( q.queryList ) ], [ [], {}, 1 ] )
+
+    # every libc4 call has a prototype
+    lib = C4Wrapper.loadLibrary()
+    self.assertEqual( lib.c4_install_str.argtypes, [ C4Wrapper.C4_POINTER, ctypes.c_char_p ] )
+    self.assertEqual( lib.c4_dump_table.restype, ctypes.c_char_p )
+
+    # the runtime lives as long as its last c4 instance
+    calls      = []
+    initialize = lib.c4_initialize
+    terminate  = lib.c4_terminate
+    lib.c4_initialize = lambda : calls.append( "initialize" )
+    lib.c4_terminate  = lambda : calls.append( "terminate" )
+    try :
+      w1 = C4Wrapper.C4Wrapper()
+      w2 = C4Wrapper.C4Wrapper()
+      w1.open()
+      w2.open()
+      w1.close()
+      w1.close()
+      self.assertEqual( calls, [ "initialize" ] )
+      w2.close()
+      self.assertEqual( calls, [ "initialize", "terminate" ] )
+
+      # runs on several threads share the runtime, and a session is
+      # shared safely
+      calls[:] = []
+      session  = C4Session.C4Session()
+      results  = []
+
+      def runQuest( s ) :
+        q = self.makeQuest( dbInst, [ query1 ], schema )
+        q.setSession( s )
+        results.append( q.run() )
+
+      threads = [ threading.Thread( target=runQuest, args=( s, ) ) for s in [ None, None, None, session, session ] ]
+      for t in threads :
+        t.start()
+      for t in threads :
+        t.join()
+
+      self.assertEqual( [ r[2] for r in results ], [ expected[2] ] * 5 )
+      self.assertEqual( [ calls[0], C4Wrapper.runtimeUsers ], [ "initialize", 1 ] )
+      session.close()
+      self.assertEqual( [ calls[-1], C4Wrapper.runtimeUsers ], [ "terminate", 0 ] )
+
+    finally :
+      lib.c4_initialize = initialize
+      lib.c4_terminate  = terminate
+
+    # forked children start with a fresh runtime, even while the parent
+    # has live c4 instances and another thread holds the runtime lock
+    session = C4Session.C4Session()
+    C4Wrapper.runtimeLock.acquire()
+    try :
+      pool = C4Pool.C4Pool( 1 )
+    finally :
+      C4Wrapper.runtimeLock.release()
+
+    try :
+      self.assertEqual( pool.run( expected[:2] ), expected[2] )
+    finally :
+      pool.close()
+      session.close()
+
+    # ---------------------------- #
+    dbInst.deldb()
+
+
+  ################
+  #  EXAMPLE 40  #
+  ################
+  # tests evaluating programs on a pool of c4 worker processes
+  def test_example40( self ) :
+
+    test_id = "test_example40"
+
+    # --------------------------------------------------------------- #
+    logging.info( "  " + test_id + ": initializing pickledb instance." )
+    dbInst = pickledb.load( "./test_quest.db", False )
+
+    # --------------------------------------------------------------- #
+    dbInst.set( "b", { "k0": 1, "k1": 2 } )
+    dbInst.set( "c", [ [ 1, 2 ], 10 ] )
+
+    # --------------------------------------------------------------- #
+    schema = { "a":["string","int"], "b":["string","int"], "c":["int","int"] }
+    query1 = "a(K,Z) :- b(K,Y), c(Y,Z) ;"
+
+    def makeQuest( pool ) :
+      q = self.makeQuest( dbInst, [ query1 ], schema )
+      q.setEnginePool( pool )
+      return q
+
+    expected = makeQuest( None ).run()
+    expectedStructured = makeQuest( None ).run( structured=True )
+
+    # worker processes crash on programs mentioning "crash"
+    original = C4Wrapper.C4Wrapper.run
+
+    def crashingRun( w, allProgramData, schema=None, stream=False ) :
+      if "crash" in "".join( allProgramData[0] ) :
+        os._exit( 1 )
+      return original( w, allProgramData, schema, stream )
+
+    # replaced workers are forked with crashingRun as well
+    C4Wrapper.C4Wrapper.run = crashingRun
+    pool = C4Pool.C4Pool( 2 )
+
+    try :
+      # concurrent runs share the workers
+      quests = [ makeQuest( pool ) for i in range( 0, 4 ) ]
+      jobs   = [ q.run_async() for q in quests ]
+      for job in jobs :
+        self.assertEqual( job.result( 10 ), expected )
+
+      actual = makeQuest( pool ).run( structured=True, batch_size=2 )
+      self.assertEqual( actual[2][ "a" ], expectedStructured[2][ "a" ] )
+
+      # programs can be mapped over the pool directly
+      programData = [ expected[0], [ "a" ] ]
+      results     = pool.map( [ [ programData, None ], [ programData, schema ] ] )
+      self.assertEqual( results[0], expected[2][ expected[2].index( "a" ) - 1 : expected[2].index( "b" ) - 1 ] )
+      self.assertEqual( results[1][ "a" ], expectedStructured[2][ "a" ] )
+
+      # workers dying while idle or while evaluating are replaced
+      os.kill( pool.workers[0][0].pid, signal.SIGKILL )
+      pool.workers[0][0].join()
+      self.assertEqual( len( pool.map( [ [ programData, None ] ] * 4 ) ), 4 )
+      self.assertEqual( pool.restarts, 1 )
+
+      crashData = [ expected[0] + [ "define(crash,{int});" ], [ "a" ] ]
+      self.assertRaises( SystemExit, pool.run, crashData )
+      self.assertEqual( pool.restarts, 2 )
+      self.assertEqual( [ w[0].is_alive() for w in pool.workers ], [ True, True ] )
+      self.assertEqual( pool.run( programData ), results[0] )
+
+      # c4 errors are reported without losing the worker
+      self.assertRaises( SystemExit, pool.run, [ expected[0], [ "nope" ] ], schema )
+      self.assertEqual( pool.restarts, 2 )
+
+    finally :
+      pool.close()
+      C4Wrapper.C4Wrapper.run = original
+
+    self.assertRaises( SystemExit, pool.run, programData )
+
+    # a worker initializes the runtime once, not once per program
+    lib        = C4Wrapper.loadLibrary()
+    calls      = []
+    initialize = lib.c4_initialize
+    terminate  = lib.c4_terminate
+    lib.c4_initialize = lambda : calls.append( "initialize" )
+    lib.c4_terminate  = lambda : calls.append( "terminate" )
+    try :
+      parentConn, childConn = multiprocessing.Pipe()
+      worker = threading.Thread( target=C4Pool.serveJobs, args=( childConn, ) )
+      worker.start()
+      for i in range( 0, 3 ) :
+        parentConn.send( [ programData, None ] )
+        self.assertEqual( parentConn.recv(), [ results[0], None ] )
+      parentConn.send( None )
+      worker.join()
+      self.assertEqual( calls, [ "initialize", "terminate" ] )
+    finally :
+      lib.c4_initialize = initialize
+      lib.c4_terminate  = terminate
+
+    # ---------------------------- #
+    dbInst.deldb()
+
+
+  ################
+  #  EXAMPLE 39  #
+  ################
+  # tests running in the background and cancelling runs
+  def test_example39( self ) :
+
+    test_id = "test_example39"
+
+    # --------------------------------------------------------------- #
+    logging.info( "  " + test_id + ": initializing pickledb instance." )
+    dbInst = pickledb.load( "./test_quest.db", False )
+
+    # --------------------------------------------------------------- #
+    dbInst.set( "b", { "k0": 1, "k1": 2 } )
+    dbInst.set( "c", [ [ 1, 2 ], 10 ] )
+
+    # --------------------------------------------------------------- #
+    schema = { "a":["string","int"], "b":["string","int"], "c":["int","int"] }
+    query1 = "a(K,Z) :- b(K,Y), c(Y,Z) ;"
+
+    expected = self.makeQuest( dbInst, [ query1 ], schema ).run()
+
+    # a background run returns what run returns
+    done = []
+    job  = self.makeQuest( dbInst, [ query1 ], schema ).run_async( callback=done.append )
+    self.assertEqual( job.result( 10 ), expected )
+    self.assertEqual( [ job.done(), job.cancelled(), done ], [ True, False, [ job ] ] )
+
+    # cancelling a run blocked on the store stops it before c4 gets the
+    # program, and closes the c4 instance of a chunked run
+    gate      = threading.Event()
+    original  = Quest.Adapter.Adapter.get
+    closeCall = C4Wrapper.C4Wrapper.close
+    closed    = []
+
+    def blockingGet( ad, relationName, dbcursor ) :
+      gate.wait( 10 )
+      return original( ad, relationName, dbcursor )
+
+    def countingClose( w ) :
+      closed.append( w )
+      closeCall( w )
+
+    Quest.Adapter.Adapter.get = blockingGet
+    C4Wrapper.C4Wrapper.close = countingClose
+    try :
+      for batch_size in [ None, 1 ] :
+        closed[:] = []
+        q   = self.makeQuest( dbInst, [ query1 ], schema )
+        job = q.run_async( structured=True, batch_size=batch_size )
+        self.assertTrue( job.cancel() )
+        gate.set()
+        self.assertRaises( QuestJob.RunCancelled, job.result, 10 )
+        self.assertEqual( len( closed ), int( bool( batch_size ) ) )
+        gate.clear()
+
+      # each job of an instance is cancelled on its own
+      q    = self.makeQuest( dbInst, [ query1 ], schema )
+      jobs = [ q.run_async(), q.run_async() ]
+      self.assertTrue( jobs[0].cancel() )
+      gate.set()
+      self.assertRaises( QuestJob.RunCancelled, jobs[0].result, 10 )
+      self.assertEqual( jobs[1].result( 10 ), expected )
+    finally :
+      Quest.Adapter.Adapter.get = original
+      C4Wrapper.C4Wrapper.close = closeCall
+
+    # cancelling a finished streamed run closes its cursor
+    job    = self.makeQuest( dbInst, [ query1 ], schema ).run_async( stream=True )
+    cursor = job.result( 10 )[2]
+    self.assertFalse( job.cancel() )
+    self.assertEqual( cursor.c4_obj, None )
+    self.assertRaises( QuestJob.RunCancelled, job.result, 10 )
+
+    # results of a run cancelled after its last check are not returned
+    jobs = []
+    job  = QuestJob.QuestJob( lambda : jobs[0].cancel() and expected )
+    jobs.append( job.start() )
+    self.assertRaises( QuestJob.RunCancelled, job.result, 10 )
+
+    # errors of the run are raised by result
+    q = self.makeQuest( dbInst, [ query1, "a(K) :- b(K,_) ;" ], schema )
+    self.assertRaises( SystemExit, q.run_async().result, 10 )
+
+    # ---------------------------- #
+    dbInst.deldb()
+
+
+  ################
+  #  EXAMPLE 38  #
+  ################
+  # tests serving repeated runs from the result cache
+  def test_example38( self ) :
+
+    test_id = "test_example38"
+
+    # --------------------------------------------------------------- #
+    logging.info( "  " + test_id + ": initializing pickledb instance." )
+    dbInst = pickledb.load( "./test_quest.db", False )
+
+    # --------------------------------------------------------------- #
+    dbInst.set( "b", { "k0": 1, "k1": 2 } )
+    dbInst.set( "c", [ [ 1, 2 ], 10 ] )
+
+    # --------------------------------------------------------------- #
+    schema = { "a":["string","int"], "b":["string","int"], "c":["int","int"] }
+
+    def runQuest( cache, rules, **kwargs ) :
+      q = self.makeQuest( dbInst, rules, schema )
+      q.setResultCache( cache )
+      logging.debug( "  " + test_id + " : calling 'run' with result cache " + str( cache ) )
+      return q.run( **kwargs )
+
+    rules1 = [ "a(K,Z) :- b(K,Y), c(Y,Z) ;", "a(K,Y) :- b(K,Y) ;" ]
+    rules2 = [ "a(K,Y):-b(K,Y);", "a( K, Z ) :- b( K, Y ), c( Y, Z ) ;" ]
+
+    cache    = ResultCache.ResultCache( 2 )
+    expected = runQuest( None, rules1 )
+
+    self.assertEqual( runQuest( cache, rules1 ), expected )
+    self.assertEqual( [ cache.hits, cache.misses ], [ 0, 1 ] )
+
+    # reordered and reformatted rules hit the same entry
+    actual = runQuest( cache, rules2 )
+    self.assertEqual( actual[2], expected[2] )
+    self.assertEqual( [ cache.hits, cache.misses ], [ 1, 1 ] )
+    self.assertEqual( runQuest( cache, rules1, keep_program=False )[0], None )
+
+    # other outputs, other data, and other result modes miss
+    self.assertEqual( runQuest( cache, rules1, outputs=[ "a" ], keep_program=False )[0], None )
+    runQuest( cache, rules1, structured=True )
+    self.assertEqual( [ cache.hits, cache.misses, len( cache ) ], [ 2, 3, 2 ] )
+
+    # runs cached without their program are evaluated again to return it
+    actual = runQuest( cache, rules1, outputs=[ "a" ] )
+    self.assertEqual( actual[0], runQuest( None, rules1, outputs=[ "a" ] )[0] )
+    self.assertEqual( runQuest( cache, rules1, outputs=[ "a" ] )[0], actual[0] )
+    self.assertEqual( [ cache.hits, cache.misses ], [ 3, 4 ] )
+
+    dbInst.set( "b", { "k0": 2 } )
+    actual = runQuest( cache, rules1, structured=True )
+    self.assertEqual( sorted( actual[2][ "a" ] ), [ ( "k0", 2 ), ( "k0", 10 ) ] )
+    self.assertEqual( [ cache.hits, cache.misses ], [ 3, 5 ] )
+
+    # streams are never cached
+    for table, rows in runQuest( cache, rules1, stream=True )[2] :
+      list( rows )
+    self.assertEqual( [ cache.hits, cache.misses ], [ 3, 5 ] )
+
+    # invalidation drops every run that read the relation
+    cache.invalidate( "c" )
+    self.assertEqual( len( cache ), 0 )
+
+    # concurrent use keeps the entries consistent
+    errors = []
+    def hammer( n ) :
+      try :
+        for i in range( 0, 2000 ) :
+          key = ( n + i ) % 5
+          cache.put( key, None, [ i ], [ "r" + str( key ) ] )
+          cache.get( key )
+          if i % 97 == 0 :
+            cache.invalidate( "r" + str( key ) )
+      except Exception as e :
+        errors.append( e )
+    threads = [ threading.Thread( target=hammer, args=( n, ) ) for n in range( 0, 4 ) ]
+    for t in threads :
+      t.start()
+    for t in threads :
+      t.join()
+    self.assertEqual( errors, [] )
+    self.assertTrue( len( cache ) <= 2 )
+
+    # ---------------------------- #
+    dbInst.deldb()
+
+
+  ################
+  #  EXAMPLE 37  #
+  ################
+  # tests reusing the facts of unchanged keys across runs
+  def test_example37( self ) :
+
+    test_id = "test_example37"
+
+    # --------------------------------------------------------------- #
+    logging.info( "  " + test_id + ": initializing pickledb instance." )
+    dbInst = pickledb.load( "./test_quest.db", False )
+
+    # --------------------------------------------------------------- #
+    b = {}
+    for i in range( 0, 20 ) :
+      b[ "id" + str( i ) ] = [ { i : i+1 }, [ i % 3 ] ]
+    dbInst.set( "b", b )
+    dbInst.set( "c", [ [ 0, 1, 2 ], 9 ] )
+
+    # --------------------------------------------------------------- #
+    schema = { "a":["string"], "b":["string","int","int","int"], "c":["int","int"] }
+    query1 = "a(K) :- b(K,_,_,Y), c(Y,_) ;"
+
+    def runQuest( cache, bulk=False ) :
+      q = self.makeQuest( dbInst, [ query1 ], schema )
+      q.setFlattenCache( cache )
+      q.setBulkLoad( bulk )
+      logging.debug( "  " + test_id + " : calling 'run' with flatten cache " + str( cache ) )
+      return q.run( structured=True )
+
+    cache    = FlattenCache.FlattenCache( 1024 * 1024 )
+    expected = runQuest( None )
+
+    # the first run fills the cache, the second one only reads it
+    self.assertEqual( runQuest( cache )[0], expected[0] )
+    self.assertEqual( [ cache.hits, cache.misses, len( cache ) ], [ 0, 20, 20 ] )
+    self.assertEqual( runQuest( cache )[0], expected[0] )
+    self.assertEqual( [ cache.hits, cache.misses ], [ 20, 20 ] )
+
+    # only changed keys are flattened again
+    b[ "id3" ] = [ { 3 : 5 }, [ 2 ] ]
+    dbInst.set( "b", b )
+    actual = runQuest( cache )
+    self.assertEqual( [ cache.hits, cache.misses ], [ 39, 21 ] )
+    self.assertTrue( 'b("id3",3,5,2);' in actual[0] )
+    self.assertEqual( actual[0], runQuest( None )[0] )
+
+    # bulk loading caches rows separately
+    actual = runQuest( cache, bulk=True )
+    self.assertEqual( cache.misses, 41 )
+    self.assertEqual( sorted( actual[2][ "b" ] ), sorted( runQuest( None )[2][ "b" ] ) )
+
+    # least recently used keys are evicted to stay within budget
+    small = FlattenCache.FlattenCache( 1000 )
+    runQuest( small )
+    self.assertTrue( 0 < len( small ) < 20 )
+    self.assertTrue( small.usedBytes <= 1000 )
+
+    cache.invalidate( "b" )
+    self.assertEqual( [ len( cache ), cache.usedBytes ], [ 0, 0 ] )
+
+    # concurrent use keeps the entries and their size consistent
+    shared = FlattenCache.FlattenCache( 2000 )
+    errors = []
+    def hammer( n ) :
+      try :
+        for i in range( 0, 2000 ) :
+          key = ( "r" + str( i % 7 ), i % 50 )
+          shared.put( key, [ n, i ], 10 + i % 30 )
+          shared.get( key )
+          if i % 97 == 0 :
+            shared.invalidate( key[0] )
+      except Exception as e :
+        errors.append( e )
+    threads = [ threading.Thread( target=hammer, args=( n, ) ) for n in range( 0, 4 ) ]
+    for t in threads :
+      t.start()
+    for t in threads :
+      t.join()
+    self.assertEqual( errors, [] )
+    self.assertEqual( shared.usedBytes, sum( size for value, size in shared.entries.values() ) )
+    self.assertTrue( shared.usedBytes <= 2000 )
+
+    # ---------------------------- #
+    dbInst.deldb()
+
+
+  ################
+  #  EXAMPLE 36  #
+  ################
+  # tests formatting facts from rows and from typed columns
+  def test_example36( self ) :
+
+    test_id = "test_example36"
+
+    q = Quest.Quest( "pickledb", None )
+
+    typeList = [ "string", "int", "float", "bool" ]
+    rows     = [ [ "x y", 1, 1.5, True ], [ "100%", -2**70, 3, False ] ]
+    expected = [ 'r("x y",1,1.5,True);', 'r("100%",-1180591620717411303424,3,False);' ]
+
+    self.assertEqual( q.format_edb_statements( "r", rows, typeList ), expected )
+
+    buf = RelationBuffer.RelationBuffer( "r", typeList )
+    buf.extend( rows )
+    self.assertEqual( buf.formatFacts(), expected )
+    self.assertEqual( q.format_edb_statements( "r", buf, typeList ), expected )
+    self.assertEqual( buf[1:].formatFacts( "s" ), [ 's("100%",-1180591620717411303424,3,False);' ] )
+
+    # lengths are still checked before formatting
+    with self.assertRaises( SystemExit ) as cm :
+      q.format_edb_statements( "r", [ [ "x", 1, 1.5 ] ], typeList )
+    self.assertTrue( "inconsistent with length of table schema" in str( cm.exception ) )
+
+
+  ################
+  #  EXAMPLE 35  #
+  ################
+  # tests columnar relation buffers
+  def test_example35( self ) :
+
+    test_id = "test_example35"
+
+    # --------------------------------------------------------------- #
+    # typed columns read back exactly what was appended
+    buf = RelationBuffer.RelationBuffer( "r", [ "string", "int", "float", "bool" ] )
+    buf.extend( [ [ "x", 1, 1.5, True ], [ "x", 2**70, 2, False ] ] )
+
+    self.assertEqual( len( buf ), 2 )
+    self.assertEqual( list( buf ), [ ( "x", 1, 1.5, True ), ( "x", 2**70, 2, False ) ] )
+    self.assertEqual( buf[1], ( "x", 2**70, 2, False ) )
+    self.assertEqual( list( buf[1:] ), [ ( "x", 2**70, 2, False ) ] )
+    self.assertEqual( buf.kinds, [ "string", "object", "object", "bool" ] )
+    self.assertTrue( buf.columns[0][0] is buf.columns[0][1] )
+
+    with self.assertRaises( SystemExit ) as cm :
+      buf.append( [ "x", True, 1.5, True ] )
+    self.assertTrue( "inconsistent with table schema type 'int'" in str( cm.exception ) )
+
+    # batches are checked whole, a bad row anywhere leaves the buffer as it was
+    with self.assertRaises( SystemExit ) as cm :
+      buf.extend( [ [ "y", 3, 1.5, True ], [ "y", 4, 1.5 ] ] )
+    self.assertTrue( "edb = ['y', 4, 1.5]" in str( cm.exception ) )
+    self.assertEqual( len( buf ), 2 )
+    self.assertEqual( [ len( col ) for col in buf.columns ], [ 2, 2, 2, 2 ] )
+
+    # --------------------------------------------------------------- #
+    logging.info( "  " + test_id + ": initializing pickledb instance." )
+    dbInst = pickledb.load( "./test_quest.db", False )
+
+    # --------------------------------------------------------------- #
+    dbInst.set( "b", { "id0": [ { 0:1 }, [11,12] ], "0": [ 0, [ [1, 2], 111, 3 ] ] } )
+    dbInst.set( "c", [ [ 11, 12 ], 5 ] )
+
+    # --------------------------------------------------------------- #
+    schema = { "a":["string"], "b":["string","int","int","int"], "c":["int","int"] }
+    query1 = "a(K) :- b(K,_,_,Y), c(Y,_) ;"
+
+    def runQuest( columnar, **kwargs ) :
+      q = self.makeQuest( dbInst, [ query1 ], schema )
+      q.setColumnar( columnar )
+      if kwargs.pop( "bulk", False ) :
+        q.setBulkLoad( True )
+      if kwargs.pop( "infer", False ) :
+        q.setInferTemplates( True )
+      logging.debug( "  " + test_id + " : calling 'run' with columnar " + str( columnar ) )
+      return q.run( structured=True, **kwargs )
+
+    expected = runQuest( False )
+    self.assertEqual( sorted( expected[2][ "a" ] ), [ ( "id0", ) ] )
+
+    # same program and results through the buffers
+    for kwargs in [ {}, { "infer" : True }, { "batch_size" : 2 }, { "bulk" : True }, { "bulk" : True, "batch_size" : 2 } ] :
+      actual = runQuest( True, **kwargs )
+      if not kwargs.get( "bulk" ) :
+        self.assertEqual( actual[0], expected[0] )
+      for rel in [ "a", "b", "c" ] :
+        self.assertEqual( sorted( actual[2][ rel ] ), sorted( expected[2][ rel ] ) )
+
+    # list relations stream their cross product into the buffer in
+    # batches, in the order of the row lists, never building it whole
+    q     = self.makeQuest( dbInst, [ query1 ], schema )
+    value = [ range( 0, 30 ), range( 0, 40 ), 7, 8 ]
+    rows  = q.getRelationData( "b", value )
+
+    batches = []
+    extend  = RelationBuffer.RelationBuffer.extend
+    RelationBuffer.RelationBuffer.extend = lambda buf, rows : batches.append( len( rows ) ) or extend( buf, rows )
+    mergeSubRelations = RelationTemplate.mergeSubRelations
+    RelationTemplate.mergeSubRelations = None
+    try :
+      q.schema[ "b" ] = [ "int", "int", "int" ]
+      Quest.BUFFER_BATCH = 500
+      buf = q.extractRelationBuffer( "b", value )
+    finally :
+      RelationBuffer.RelationBuffer.extend = extend
+      RelationTemplate.mergeSubRelations   = mergeSubRelations
+      Quest.BUFFER_BATCH = 10000
+
+    self.assertEqual( batches, [ 500, 500, 500, 500, 400 ] )
+    self.assertEqual( list( buf ), [ tuple( row ) for row in rows ] )
+
+    # ---------------------------- #
+    dbInst.deldb()
+
+
+  ################
+  #  EXAMPLE 34  #
+  ################
+  # tests fetching every relation with one get_many call
+  def test_example34( self ) :
+
+    test_id = "test_example34"
+
+    # --------------------------------------------------------------- #
+    logging.info( "  " + test_id + ": initializing pickledb instance." )
+    dbInst = pickledb.load( "./test_quest.db", False )
+
+    # --------------------------------------------------------------- #
+    dbInst.set( "b", { "k0": 1, "k1": 2 } )
+    dbInst.set( "c", [ [ 1, 2 ], 10 ] )
+
+    # --------------------------------------------------------------- #
+    schema = { "a":["string","int"], "b":["string","int"], "c":["int","int"] }
+    query1 = "a(K,Z) :- b(K,Y), c(Y,Z) ;"
+
+    def runQuest() :
+      return self.makeQuest( dbInst, [ query1 ], schema ).run()
+
+    expected = runQuest()
+
+    # serve all reads from a multi-get
+    calls = []
+    def get_many( ad, relations, dbcursor ) :
+      calls.append( list( relations ) )
+      values = {}
+      for rel in relations :
+        if dbcursor.get( rel ) :
+          values[ rel ] = dbcursor.get( rel )
+      return values
+
+    Quest.Adapter.Adapter.get_many = get_many
+    try :
+      actual = runQuest()
+      self.assertEqual( calls, [ [ "a", "b", "c" ] ] )
+      self.assertEqual( actual[0], expected[0] )
+      self.assertEqual( actual[2], expected[2] )
+
+      # a failing multi-get falls back to get
+      def failing_get_many( ad, relations, dbcursor ) :
+        raise IOError( "multi-get unavailable" )
+      Quest.Adapter.Adapter.get_many = failing_get_many
+      self.assertEqual( runQuest()[0], expected[0] )
+
+    finally :
+      del Quest.Adapter.Adapter.get_many
+
+    # ---------------------------- #
+    dbInst.deldb()
+
+
+  ################
+  #  EXAMPLE 33  #
+  ################
+  # tests flattening large relations in a process pool
+  def test_example33( self ) :
+
+    test_id = "test_example33"
+
+    # --------------------------------------------------------------- #
+    logging.info( "  " + test_id + ": initializing pickledb instance." )
+    dbInst = pickledb.load( "./test_quest.db", False )
+
+    # --------------------------------------------------------------- #
+    b = {}
+    for i in range( 0, 500 ) :
+      b[ "id" + str( i ) ] = [ { i : i+1 }, [ i % 7, i % 5 ] ]
+    dbInst.set( "b", b )
+    dbInst.set( "c", { "k0" : [ [ 1, 2 ], 3 ] } )
+
+    # --------------------------------------------------------------- #
+    schema = { "a":["string"], "b":["string","int","int","int"], "c":["string","int","int"] }
+    query1 = "a(K) :- b(K,_,_,Y), c(_,Y,_) ;"
+
+    def runQuest( pool, template=None, **kwargs ) :
+      q = self.makeQuest( dbInst, [ query1 ], schema )
+      q.setParallelFlatten( pool, 100 )
+      if template :
+        q.setTemplate( "b", template )
+      logging.debug( "  " + test_id + " : calling 'run' with flatten pool " + str( pool ) )
+      return q.run( outputs=[ "a" ], **kwargs )
+
+    expected = runQuest( None )
+    self.assertEqual( len( expected[0] ), 3 + 1000 + 2 + 1 )
+
+    # one pool serves every run, none is started per run
+    pool      = multiprocessing.Pool( 2 )
+    poolClass = multiprocessing.Pool
+    multiprocessing.Pool = None
+    try :
+      # the merged shards match the in-process program, with or without a template
+      self.assertEqual( runQuest( pool )[0], expected[0] )
+      self.assertEqual( runQuest( pool, { "id": [ { 0:1 }, [ 2 ] ] } )[0], expected[0] )
+      self.assertEqual( runQuest( pool, batch_size=64 )[0], expected[0] )
+      self.assertEqual( sorted( runQuest( pool )[2] ), sorted( expected[2] ) )
+
+      # bulk loading gets the rows back instead of statements
+      q = self.makeQuest( dbInst, [ query1 ], schema )
+      q.setParallelFlatten( pool, 100 )
+      q.setBulkLoad( True )
+      self.assertEqual( sorted( q.run( outputs=[ "a" ] )[2] ), sorted( expected[2] ) )
+
+      # relations that cannot be flattened are skipped as in-process
+      b[ "id7" ] = [ { 0 : { 1 : 2 } } ]
+      dbInst.set( "b", b )
+      self.assertEqual( runQuest( pool )[0], runQuest( None )[0] )
+
+      # bad values still abort the run
+      b[ "id7" ] = [ { 7 : 8 }, [ "x", 1 ] ]
+      dbInst.set( "b", b )
+      with self.assertRaises( SystemExit ) as cm :
+        runQuest( pool )
+      self.assertTrue( "inconsistent with table schema type 'int'" in str( cm.exception ) )
+
+    finally :
+      multiprocessing.Pool = poolClass
+      pool.close()
+      pool.join()
+
+    # ---------------------------- #
+    dbInst.deldb()
+
+
+  ################
+  #  EXAMPLE 32  #
+  ################
+  # tests fetching relations concurrently
+  def test_example32( self ) :
+
+    test_id = "test_example32"
+
+    # --------------------------------------------------------------- #
+    logging.info( "  " + test_id + ": initializing pickledb instance." )
+    dbInst = pickledb.load( "./test_quest.db", False )
+
+    # --------------------------------------------------------------- #
+    schema = { "a":["string"] }
+    rules  = []
+    for i in range( 0, 12 ) :
+      rel = "r" + str( i )
+      dbInst.set( rel, { rel + "_x" : i, rel + "_y" : [ i+1, i+2 ] } )
+      schema[ rel ] = [ "string", "int" ]
+      rules.append( "a(K) :- " + rel + "(K,_) ;" )
+
+    programs = []
+    for concurrency in [ None, 1, 4, 32 ] :
+      q = self.makeQuest( dbInst, rules, schema )
+      q.setFetchConcurrency( concurrency )
+
+      logging.debug( "  " + test_id + " : calling 'run' with fetch concurrency " + str( concurrency ) )
+      allProgramData = q.run( outputs=[ "a" ] )
+      programs.append( allProgramData[0] )
+
+      self.assertEqual( len( allProgramData[2] ), 2 + 24 )
+
+    # facts reach c4 in the same order regardless of concurrency
+    for program in programs[1:] :
+      self.assertEqual( program, programs[0] )
+
+    # ---------------------------- #
+    dbInst.deldb()
+
+
+  ################
+  #  EXAMPLE 31  #
+  ################
+  # tests installing the program in fixed size chunks
+  def test_example31( self ) :
+
+    test_id = "test_example31"
+
+    # --------------------------------------------------------------- #
+    logging.info( "  " + test_id + ": initializing pickledb instance." )
+    dbInst = pickledb.load( "./test_quest.db", False )
+
+    # --------------------------------------------------------------- #
+    dbInst.set( "b", { "id0": [ [ 1, 2, 3 ], [ 3, 4 ] ], "id1": [ [ 5 ], 6 ] } )
+    dbInst.set( "c", [ [ 1, 3, 5 ], 7, 8 ] )
+
+    # --------------------------------------------------------------- #
+    schema = { "a":["string","int"], "b":["string","int","int"], "c":["int","int"] }
+    query1 = "a(K,Z) :- b(K,Y,_), c(Y,Z) ;"
+
+    def runQuest( **kwargs ) :
+      q = self.makeQuest( dbInst, [ query1 ], schema )
+      if kwargs.pop( "bulk", False ) :
+        q.setBulkLoad( True )
+      logging.debug( "  " + test_id + " : calling 'run' with " + str( kwargs ) )
+      return q.run( structured=True, **kwargs )
+
+    expected = runQuest()
+
+    # the chunked program matches the program installed in one piece
+    actual = runQuest( batch_size=2 )
+    self.assertEqual( actual[0], expected[0] )
+    self.assertEqual( actual[1], expected[1] )
+    for rel in [ "a", "b", "c" ] :
+      self.assertEqual( sorted( actual[2][ rel ] ), sorted( expected[2][ rel ] ) )
+
+    # the program text can be dropped, alone or with bulk loading
+    for bulk in [ False, True ] :
+      actual = runQuest( batch_size=3, keep_program=False, bulk=bulk )
+      self.assertEqual( actual[0], None )
+      for rel in [ "a", "b", "c" ] :
+        self.assertEqual( sorted( actual[2][ rel ] ), sorted( expected[2][ rel ] ) )
+    self.assertEqual( runQuest( keep_program=False )[0], None )
+
+    # checks still run before the rules are installed
+    dbInst.set( "c", [ [ 1, 3, 5 ], "x" ] )
+    with self.assertRaises( SystemExit ) as cm :
+      runQuest( batch_size=2 )
+    self.assertTrue( "inconsistent with table schema type 'int'" in str( cm.exception ) )
+
+    # ---------------------------- #
+    dbInst.deldb()
+
+
+  ################
+  #  EXAMPLE 30  #
+  ################
+  # tests bulk loading edb facts from fact files
+  def test_example30( self ) :
+
+    test_id = "test_example30"
+
+    # --------------------------------------------------------------- #
+    logging.info( "  " + test_id + ": initializing pickledb instance." )
+    dbInst = pickledb.load( "./test_quest.db", False )
+
+    # --------------------------------------------------------------- #
+    dbInst.set( "b", { "id0": [ [ 1, 2 ], [ 3, 4 ] ], "id1": [ [ 5 ], 6 ] } )
+    dbInst.set( "c", [ [ "x", "y" ], 1.5, 2.5 ] )
+
+    # --------------------------------------------------------------- #
+    schema = { "a":["string","float"], "b":["string","int","int"], "c":["string","float"] }
+    query1 = "a(K,F) :- b(K,_,_), c(_,F) ;"
+
+    results = []
+    for bulk in [ False, True ] :
+      q = self.makeQuest( dbInst, [ query1 ], schema )
+      q.setBulkLoad( bulk )
+
+      logging.debug( "  " + test_id + " : calling 'run' with bulk load " + str( bulk ) )
+      results.append( q.run( structured=True ) )
+
+    # facts are no longer part of the program text
+    self.assertEqual( results[1][0], [ s for s in results[0][0] if not s.startswith( "b(" ) and not s.startswith( "c(" ) ] )
+    self.assertEqual( q.fact_data, [] )
+    q.getEDBs( [ "b", "c" ] )
+    self.assertEqual( [ [ f[0], len( f[2] ) ] for f in q.fact_data ], [ [ "b", 5 ], [ "c", 4 ] ] )
+
+    # the evaluated results do not change
+    for rel in [ "a", "b", "c" ] :
+      self.assertEqual( sorted( results[0][2][ rel ] ), sorted( results[1][2][ rel ] ) )
+    self.assertEqual( len( results[1][2][ "a" ] ), 4 )
+
+    # quotes and semicolons inside strings do not end a fact early
+    dbInst.set( "c", [ [ 'say "hi";', "back\\slash" ], 1.5 ] )
+    for bulk, columnar in [ [ False, False ], [ True, False ], [ True, True ] ] :
+      q = self.makeQuest( dbInst, [ query1 ], schema )
+      q.setBulkLoad( bulk )
+      q.setColumnar( columnar )
+      actual = q.run( structured=True )[2]
+      self.assertEqual( sorted( actual[ "c" ] ), [ ( "back\\slash", 1.5 ), ( 'say "hi";', 1.5 ) ] )
+    self.assertEqual( q.format_edb_statements( "c", [ [ 'say "hi";', 1.5 ] ] ), [ 'c("say \\"hi\\";",1.5);' ] )
+
+    # bad values are still rejected
+    dbInst.set( "c", [ [ "x", "y" ], "z" ] )
+    q = self.makeQuest( dbInst, [ query1 ], schema )
+    q.setBulkLoad( True )
+    with self.assertRaises( SystemExit ) as cm :
+      q.run()
+    self.assertTrue( "inconsistent with table schema type 'float'" in str( cm.exception ) )
+
+    # ---------------------------- #
+    dbInst.deldb()
+
+
+  ################
+  #  EXAMPLE 29  #
+  ################
+  # tests factorized emission of large edb cross products
+  def test_example29( self ) :
+
+    test_id = "test_example29"
+
+    # --------------------------------------------------------------- #
+    logging.info( "  " + test_id + ": initializing pickledb instance." )
+    dbInst = pickledb.load( "./test_quest.db", False )
+
+    # --------------------------------------------------------------- #
+    dbInst.set( "b", [ [ "x", "y", "z" ], [ 1, 2, 3, 4 ], 7 ] )
+    dbInst.set( "c", { "k0": [ [ 1, 2 ], [ 5, 6 ] ], "k1": [ [ 3 ], 9 ] } )
+
+    # --------------------------------------------------------------- #
+    schema = { "a":["string","int"], "b":["string","int","int"], "c":["string","int","int"] }
+    query1 = "a(X,Z) :- b(X,Y,_), c(_,Y,Z) ;"
+
+    results = []
+    for threshold in [ None, 4 ] :
+      q = self.makeQuest( dbInst, [ query1 ], schema )
+      q.setFactorizeThreshold( threshold )
+
+      logging.debug( "  " + test_id + " : calling 'run' with factorize threshold " + str( threshold ) )
+      allProgramData = q.run( outputs=[ "a" ] )
+      results.append( allProgramData )
+
+    plain_program, factorized_program = results[0][0], results[1][0]
+
+    # b is one 12 row product, c has a 4 row product and a single row
+    self.assertEqual( len( [ s for s in plain_program if s.startswith( "b(" ) ] ), 12 )
+    self.assertEqual( len( [ s for s in factorized_program if s.startswith( "b(" ) and s.endswith( ");" ) ] ), 0 )
+    self.assertTrue( 'define(b_qf0p0,{int, string});' in factorized_program )
+    self.assertEqual( len( [ s for s in factorized_program if s.startswith( "b_qf0p1(" ) and s.endswith( ",4);" ) ] ), 1 )
+    self.assertTrue( 'b(C0,C1,C2) :- b_qf0p0(P,C0), b_qf0p1(P,C1), b_qf0p2(P,C2) ;' in factorized_program )
+    self.assertTrue( 'c(C0,C1,C2) :- c_qf0p0(P,C0), c_qf0p1(P,C1), c_qf0p2(P,C2) ;' in factorized_program )
+    self.assertTrue( 'c("k1",3,9);' in factorized_program )
+    self.assertEqual( len( [ s for s in factorized_program if s.startswith( "c_qf0p1(" ) ] ), 2 )
+
+    # the evaluated results do not change
+    self.assertEqual( sorted( results[0][2] ), sorted( results[1][2] ) )
+
+    # keys holding empty lists add no rows and do not drop the relation
+    dbInst.set( "b", { "k0": [ 1, 2 ], "k1": [], "k2": [ [ 3, 4 ] ] } )
+    schema = { "a":["string","int"], "b":["string","int"] }
+    query2 = "a(K,X) :- b(K,X) ;"
+
+    results = []
+    for threshold in [ None, 1 ] :
+      q = self.makeQuest( dbInst, [ query2 ], schema )
+      q.setFactorizeThreshold( threshold )
+      results.append( q.run( outputs=[ "a" ] ) )
+
+    self.assertEqual( len( results[1][2] ), 6 )
+    self.assertEqual( sorted( results[0][2] ), sorted( results[1][2] ) )
+
+    # helper facts a session kept from an earlier run join with nothing new
+    s = C4Session.C4Session()
+    schema = { "a":["int","int"], "b":["int","int"] }
+    query3 = "a(X,Y) :- b(X,Y) ;"
+
+    results   = []
+    installed = []
+    for value in [ [ [ 1, 2 ], [ 3, 4 ] ], [ [ 5 ], [ 6 ] ], [ [ 5 ], [ 6 ] ] ] :
+      dbInst.set( "b", value )
+      q = self.makeQuest( dbInst, [ query3 ], schema )
+      q.setFactorizeThreshold( 1 )
+      q.setSession( s )
+      results.append( q.run( outputs=[ "a" ] ) )
+      installed.append( len( s.installed ) )
+    s.close()
+
+    self.assertEqual( sorted( results[1][2][2:] ), [ "1,3", "1,4", "2,3", "2,4", "5,6" ] )
+    self.assertEqual( results[2][2], results[1][2] )
+
+    # the same blocks get the same ids, so a repeated run installs nothing
+    self.assertEqual( installed[2], installed[1] )
+
+    # ---------------------------- #
+    dbInst.deldb()
+
+
+  ################
+  #  EXAMPLE 28  #
+  ################
+  # tests registered and inferred relation templates
+  def test_example28( self ) :
+
+    test_id = "test_example28"
+
+    # --------------------------------------------------------------- #
+    logging.info( "  " + test_id + ": initializing pickledb instance." )
+    dbInst = pickledb.load( "./test_quest.db", False )
+
+    # --------------------------------------------------------------- #
+    dbInst.set( "b", { "id0": [ { 0:1 }, [11,12] ], "0": [ 0, [ [1, 2], 111, 3 ] ] } )
+    dbInst.set( "c", { "id1": [ { 0:1 }, [11,12] ], "id2": [ { 5:6 }, [13] ] } )
+
+    # --------------------------------------------------------------- #
+    q = Quest.Quest( "pickledb", dbInst )
+    logging.debug( "  " + test_id + " : instantiated Quest instance '" + str( q ) )
+
+    query1 = "a(Z) :- b(_,Y,_,_), c(_,Y,_,Z) ;"
+    q.setQuery( query1 )
+    logging.debug( "  " + test_id + " : set query '" + query1 + "' to db instance." )
+
+    schema = { "a":["int"], "b":["string","int","int","int"],"c":["string","int","int","int"] }
+
+    for rel in schema :
+      q.setSchema( rel, schema[rel] )
+      logging.debug( "  " + test_id + " : set relation '" + rel + "' to schema " + str( schema[rel] ) )
+
+    # register b by example, infer c on first fetch
+    q.setTemplate( "b", { "id9": [ { 7:8 }, [9] ], "0": [ 1, [ [2], 4 ] ] } )
+    q.setInferTemplates( True )
+
+    logging.debug( "  " + test_id + " : calling 'run' on Quest instance." )
+    allProgramData = q.run( outputs=[ "a" ] )
+
+    actual_program       = allProgramData[0]
+    actual_results_array = allProgramData[2]
+
+    expected_program     = []
+    expected_program.extend( q.getDefineStatements( [ "a", "b", "c" ] ) )
+    expected_program.extend( q.format_edb_statements( "b", q.getRelationData( "b", dbInst.get( "b" ) ) ) )
+    expected_program.extend( q.format_edb_statements( "c", q.getRelationData( "c", dbInst.get( "c" ) ) ) )
+    expected_program.append( query1 )
+
+    self.assertEqual( actual_program, expected_program )
+    self.assertEqual( sorted( actual_results_array ), [ '---------------------------', '11', '12', 'a' ] )
+    self.assertEqual( q.templates[ "c" ].shape, ( "dict", ( "keyed", ( "scalar", ), ( ( "dict", ( "pair", ) ), ( "list", () ) ) ) ) )
+
+    # values that no longer fit fall back to the generic flattener
+    dbInst.set( "c", { "id1": [ 0, 1, [ 11, 12 ] ] } )
+    allProgramData = q.run( outputs=[ "a" ] )
+    self.assertTrue( 'c("id1",0,1,12);' in allProgramData[0] )
+    self.assertEqual( q.templates[ "c" ].shape, ( "dict", ( "keyed", ( "scalar", ), ( ( "scalar", ), ( "scalar", ), ( "list", () ) ) ) ) )
+
+    # ---------------------------- #
+    dbInst.deldb()
+
+
+  ################
+  #  EXAMPLE 27  #
+  ################
+  # tests flattening a relation with thousands of top-level entries
+  def test_example27( self ) :
+
+    test_id = "test_example27"
+
+    # --------------------------------------------------------------- #
+    logging.info( "  " + test_id + ": initializing pickledb instance." )
+    dbInst = pickledb.load( "./test_quest.db", False )
+
+    # --------------------------------------------------------------- #
+    b_value = {}
+    for i in range( 0, 3000 ) :
+      b_value[ "id" + str( i ) ] = [ i, [ 1, 2 ] ]
+    dbInst.set( "b", b_value )
+
+    # --------------------------------------------------------------- #
+    q = Quest.Quest( "pickledb", dbInst )
+    logging.debug( "  " + test_id + " : instantiated Quest instance '" + str( q ) )
+
+    query1 = "a(X) :- b(X,_,2) ;"
+    q.setQuery( query1 )
+    logging.debug( "  " + test_id + " : set query '" + query1 + "' to db instance." )
+
+    schema = { "a":["string"], "b":["string","int","int"] }
+
+    for rel in schema :
+      q.setSchema( rel, schema[rel] )
+      logging.debug( "  " + test_id + " : set relation '" + rel + "' to schema " + str( schema[rel] ) )
+
+    logging.debug( "  " + test_id + " : calling 'run' on Quest instance." )
+    allProgramData = q.run( structured=True )
+
+    actual_program = allProgramData[0]
+    actual_results = allProgramData[2]
+
+    self.assertEqual( len( actual_program ), 2 + 6000 + 1 )
+    self.assertTrue( 'b("id2999",2999,1);' in actual_program )
+    self.assertTrue( 'b("id2999",2999,2);' in actual_program )
+    self.assertEqual( len( actual_results[ "a" ] ), 3000 )
+
+    # the stored value is left untouched
+    self.assertEqual( len( dbInst.get( "b" ) ), 3000 )
+
+    # ---------------------------- #
+    dbInst.deldb()
+
+
+  ################
+  #  EXAMPLE 26  #
+  ################
+  # tests data type verification of edb values and query variables
+  def test_example26( self ) :
+
+    test_id = "test_example26"
+
+    # --------------------------------------------------------------- #
+    logging.info( "  " + test_id + ": initializing pickledb instance." )
+    dbInst = pickledb.load( "./test_quest.db", False )
+
+    # --------------------------------------------------------------- #
+    dbInst.set( "b", { "id0": [ 0, 1 ] } )
+
+    # --------------------------------------------------------------- #
+    q = Quest.Quest( "pickledb", dbInst )
+    logging.debug( "  " + test_id + " : instantiated Quest instance '" + str( q ) )
+
+    query1 = "a(Y) :- b(_,Y) ;"
+    q.setQuery( query1 )
+    logging.debug( "  " + test_id + " : set query '" + query1 + "' to db instance." )
+
+    schema = { "a":["int"], "b":["int","int"], "d":["int"] }
+
+    for rel in schema :
+      q.setSchema( rel, schema[rel] )
+      logging.debug( "  " + test_id + " : set relation '" + rel + "' to schema " + str( schema[rel] ) )
+
+    logging.debug( "  " + test_id + " : calling 'run' on Quest instance." )
+
+    with self.assertRaises(SystemExit) as cm:
+      allProgramData = q.run()
+    self.assertEqual( cm.exception.code, "  FORMAT_EDB_STATEMENTS : ERROR : table 'b' has edb value 'id0' inconsistent with table schema type 'int' : edb = ['id0', 0], table schema = ['int', 'int']" )
+
+    # --------------------------------------------------------------- #
+    q.setSchema( "b", ["string","int"] )
+
+    query2 = "d(X) :- b(X,_) ;"
+    q.setQuery( query2 )
+    logging.debug( "  " + test_id + " : set query '" + query2 + "' to db instance." )
+
+    with self.assertRaises(SystemExit) as cm:
+      allProgramData = q.run()
+    self.assertEqual( cm.exception.code, "ERROR : query 'd(X) :- b(X,_) ;' uses variable X as type string in table 'b' and as type int in table 'd'. aborting..." )
+
+    # ---------------------------- #
+    dbInst.deldb()
+
+
+  ################
+  #  EXAMPLE 25  #
+  ################
+  # tests arities of relations whose names prefix other relation names
+  def test_example25( self ) :
+
+    test_id = "test_example25"
+
+    # --------------------------------------------------------------- #
+    logging.info( "  " + test_id + ": initializing pickledb instance." )
+    dbInst = pickledb.load( "./test_quest.db", False )
+
+    # --------------------------------------------------------------- #
+    dbInst.set( "ab", { "k1":"v1", "k2":"v2" } )
+    dbInst.set( "b", [ "v1" ] )
+
+    # --------------------------------------------------------------- #
+    q = Quest.Quest( "pickledb", dbInst )
+    logging.debug( "  " + test_id + " : instantiated Quest instance '" + str( q ) )
+
+    query1 = "a(X) :- b(Y), ab(X,Y) ;"
+    q.setQuery( query1 )
+    logging.debug( "  " + test_id + " : set query '" + query1 + "' to db instance." )
+
+    schema = { "a":["string"], "ab":["string","string"], "b":["string"] }
+
+    for rel in schema :
+      q.setSchema( rel, schema[rel] )
+      logging.debug( "  " + test_id + " : set relation '" + rel + "' to schema " + str( schema[rel] ) )
+
+    self.assertEqual( q.getQueryListArity( q.queryList, "b" ), 1 )
+    self.assertEqual( q.getQueryListArity( q.queryList, "ab" ), 2 )
+
+    logging.debug( "  " + test_id + " : calling 'run' on Quest instance." )
+    allProgramData = q.run( outputs=[ "a" ] )
+
+    actual_table_list    = allProgramData[1]
+    actual_results_array = allProgramData[2]
+
+    expected_table_list    = ['a', 'b', 'ab']
+    expected_results_array = ['---------------------------', \
+                              'a', \
+                              'k1' ]
+
+    self.assertEqual( actual_table_list, expected_table_list )
+    self.assertEqual( actual_results_array, expected_results_array )
+
+    # parsed rules are kept in a bounded lru cache
+    rule = DatalogParser.parseRule( query1 )
+    size = DatalogParser.RULE_CACHE_SIZE
+    DatalogParser.RULE_CACHE_SIZE = 4
+    try :
+      for i in range( 0, 10 ) :
+        DatalogParser.parseRule( "x" + str( i ) + "(X) :- b(X) ;" )
+        self.assertTrue( DatalogParser.parseRule( query1 ) is rule )
+      self.assertEqual( len( DatalogParser.RULE_CACHE ), 4 )
+      self.assertFalse( "x0(X) :- b(X) ;" in DatalogParser.RULE_CACHE )
+    finally :
+      DatalogParser.RULE_CACHE_SIZE = size
+
+    # ---------------------------- #
+    dbInst.deldb()
+
+
+  ################
+  #  EXAMPLE 24  #
+  ################
+  # tests dumping only the requested output relations
+  def test_example24( self ) :
+
+    test_id = "test_example24"
+
+    # --------------------------------------------------------------- #
+    logging.info( "  " + test_id + ": initializing pickledb instance." )
+    dbInst = pickledb.load( "./test_quest.db", False )
+
+    # --------------------------------------------------------------- #
+    dbInst.set( "b", ["str_10","str_11"] )
+    dbInst.set( "c", ["str_11","str21"] )
+
+    # --------------------------------------------------------------- #
+    q = Quest.Quest( "pickledb", dbInst )
+    logging.debug( "  " + test_id + " : instantiated Quest instance '" + str( q ) )
+
+    query1 = "a(X) :- b(X), c(X) ;"
+    q.setQuery( query1 )
+    logging.debug( "  " + test_id + " : set query '" + query1 + "' to db instance." )
+
+    query2 = "d(X) :- b(X), notin c(X) ;"
+    q.setQuery( query2 )
+    logging.debug( "  " + test_id + " : set query '" + query2 + "' to db instance." )
+
+    schema = { "a":["string"], "b":["string"],"c":["string"], "d":["string"] }
+
+    for rel in schema :
+      q.setSchema( rel, schema[rel] )
+      logging.debug( "  " + test_id + " : set relation '" + rel + "' to schema " + str( schema[rel] ) )
+
+    logging.debug( "  " + test_id + " : calling 'run' on Quest instance." )
+    allProgramData = q.run( outputs=[ "d", "a" ] )
+
+    actual_table_list    = allProgramData[1]
+    actual_results_array = allProgramData[2]
+
+    expected_table_list    = ['a', 'b', 'c', 'd']
+    expected_results_array = ['---------------------------', \
+                              'd', \
+                              'str_10', \
+                              '---------------------------', \
+                              'a', \
+                              'str_11' ]
+
+    self.assertEqual( actual_table_list, expected_table_list )
+    self.assertEqual( actual_results_array, expected_results_array )
+
+    # outputs marked on the instance
+    q.setOutputs( [ "a" ] )
+    allProgramData = q.run( structured=True )
+    self.assertEqual( allProgramData[2].getTableList(), [ "a" ] )
+
+    # unknown outputs are rejected before evaluation
+    with self.assertRaises(SystemExit) as cm:
+      allProgramData = q.run( outputs=[ "e" ] )
+    self.assertEqual( cm.exception.code, "ERROR : output relation 'e' does not appear in any query. aborting..." )
+
+    # ---------------------------- #
+    dbInst.deldb()
+
+
+  ################
+  #  EXAMPLE 23  #
+  ################
+  # tests streaming results through a result cursor
+  def test_example23( self ) :
+
+    test_id = "test_example23"
+
+    # --------------------------------------------------------------- #
+    logging.info( "  " + test_id + ": initializing pickledb instance." )
+    dbInst = pickledb.load( "./test_quest.db", False )
+
+    # --------------------------------------------------------------- #
+    dbInst.set( "b", { "id0": [ 0, 1 ], "0":2 } )
+    dbInst.set( "c", { "id1": [ 0, 1 ], "1":2 } )
+
+    # --------------------------------------------------------------- #
+    q = Quest.Quest( "pickledb", dbInst )
+    logging.debug( "  " + test_id + " : instantiated Quest instance '" + str( q ) )
+
+    query1 = "a(Y) :- b(_,Y), c(_,Y) ;"
+    q.setQuery( query1 )
+    logging.debug( "  " + test_id + " : set query '" + query1 + "' to db instance." )
+
+    schema = { "a":["int"], "b":["string","int"],"c":["string","int"] }
+
+    for rel in schema :
+      q.setSchema( rel, schema[rel] )
+      logging.debug( "  " + test_id + " : set relation '" + rel + "' to schema " + str( schema[rel] ) )
+
+    logging.debug( "  " + test_id + " : calling 'run' on Quest instance." )
+    allProgramData = q.run( stream=True )
+
+    actual_results = []
+    for relationName, rows in allProgramData[2] :
+      actual_results.append( [ relationName, sorted( rows ) ] )
+
+    expected_results = [ [ "a", [ (0,), (1,), (2,) ] ], \
+                         [ "b", [ ("0", 2), ("id0", 0), ("id0", 1) ] ], \
+                         [ "c", [ ("1", 2), ("id1", 0), ("id1", 1) ] ] ]
+
+    self.assertEqual( actual_results, expected_results )
+    self.assertEqual( allProgramData[2].c4_obj, None )
+
+    # ---------------------------- #
+    dbInst.deldb()
+
+
+  ################
+  #  EXAMPLE 22  #
+  ################
+  # tests structured results decoded with the schema types
+  def test_example22( self ) :
+
+    test_id = "test_example22"
+
+    # --------------------------------------------------------------- #
+    logging.info( "  " + test_id + ": initializing pickledb instance." )
+    dbInst = pickledb.load( "./test_quest.db", False )
+
+    # --------------------------------------------------------------- #
+    dbInst.set( "b", { "k,1": [ 10, 11 ] } )
+    dbInst.set( "c", [ 1.5 ] )
+
+    # --------------------------------------------------------------- #
+    q = Quest.Quest( "pickledb", dbInst )
+    logging.debug( "  " + test_id + " : instantiated Quest instance '" + str( q ) )
+
+    query1 = "a(X,Y) :- b(X,Y) ;"
+    q.setQuery( query1 )
+    logging.debug( "  " + test_id + " : set query '" + query1 + "' to db instance." )
+
+    query2 = "d(X) :- c(X) ;"
+    q.setQuery( query2 )
+    logging.debug( "  " + test_id + " : set query '" + query2 + "' to db instance." )
+
+    schema = { "a":["string","int"], "b":["string","int"], "c":["float"], "d":["float"] }
+
+    for rel in schema :
+      q.setSchema( rel, schema[rel] )
+      logging.debug( "  " + test_id + " : set relation '" + rel + "' to schema " + str( schema[rel] ) )
+
+    logging.debug( "  " + test_id + " : calling 'run' on Quest instance." )
+    allProgramData = q.run( structured=True )
+
+    actual_results = allProgramData[2]
+
+    self.assertEqual( actual_results.getTableList(), ['a', 'b', 'd', 'c'] )
+    self.assertEqual( sorted( actual_results[ "a" ] ), [ ("k,1", 10), ("k,1", 11) ] )
+    self.assertEqual( sorted( actual_results[ "b" ] ), [ ("k,1", 10), ("k,1", 11) ] )
+    self.assertEqual( actual_results[ "d" ], [ (1.5,) ] )
+
+    # ---------------------------- #
+    dbInst.deldb()
+
+
+  ################
+  #  EXAMPLE 21  #
+  ################
+  # tests reusing one c4 session across runs
+  def test_example21( self ) :
+
+    test_id = "test_example21"
+
+    # --------------------------------------------------------------- #
+    logging.info( "  " + test_id + ": initializing pickledb instance." )
+    dbInst = pickledb.load( "./test_quest.db", False )
+
+    # --------------------------------------------------------------- #
+    dbInst.set( "b", ["str_10","str_11"] )
+    dbInst.set( "c", ["str_11","str21"] )
+
+    # --------------------------------------------------------------- #
+    q = Quest.Quest( "pickledb", dbInst )
+    logging.debug( "  " + test_id + " : instantiated Quest instance '" + str( q ) )
+
+    s = C4Session.C4Session()
+    q.setSession( s )
+
+    query1 = "a(X) :- b(X), c(X) ;"
+    q.setQuery( query1 )
+    logging.debug( "  " + test_id + " : set query '" + query1 + "' to db instance." )
+
+    schema = { "a":["string"], "b":["string"],"c":["string"], "d":["string"] }
+
+    for rel in schema :
+      q.setSchema( rel, schema[rel] )
+      logging.debug( "  " + test_id + " : set relation '" + rel + "' to schema " + str( schema[rel] ) )
+
+    logging.debug( "  " + test_id + " : calling 'run' on Quest instance." )
+    allProgramData = q.run()
+
+    self.assertEqual( len( s.installed ), len( allProgramData[0] ) )
+    self.assertEqual( allProgramData[2][:3], ['---------------------------', 'a', 'str_11'] )
+
+    # --------------------------------------------------------------- #
+    # second run only installs the new rule and define
+    query2 = "d(X) :- b(X), notin c(X) ;"
+    q.setQuery( query2 )
+    logging.debug( "  " + test_id + " : set query '" + query2 + "' to db instance." )
+
+    num_installed  = len( s.installed )
+    allProgramData = q.run()
+
+    actual_table_list    = allProgramData[1]
+    actual_results_array = allProgramData[2]
+
+    expected_table_list    = ['a', 'b', 'c', 'd']
+    expected_results_array = ['---------------------------', \
+                              'a', \
+                              'str_11', \
+                              '---------------------------', \
+                              'b', \
+                              'str_10', \
+                              'str_11', \
+                              '---------------------------', \
+                              'c', \
+                              'str21', \
+                              'str_11', \
+                              '---------------------------', \
+                              'd', \
+                              'str_10' ]
+
+    self.assertEqual( len( s.installed ), num_installed + 2 )
+    self.assertEqual( actual_table_list, expected_table_list )
+    self.assertEqual( sorted( actual_results_array ), sorted( expected_results_array ) )
+
+    # --------------------------------------------------------------- #
+    # a failed install records nothing, so the next run submits it again
+    q.setSchema( "e", [ "string" ] )
+    q.setQuery( "e(X) :- b(X) ;" )
+
+    num_installed = len( s.installed )
+    install       = s.wrapper.install
+    s.wrapper.install = lambda prog : sys.exit( "ERROR : c4 rejected the program. aborting..." )
+    try :
+      self.assertRaises( SystemExit, q.run )
+    finally :
+      s.wrapper.install = install
+    self.assertEqual( len( s.installed ), num_installed )
+
+    allProgramData = q.run()
+    self.assertEqual( len( s.installed ), num_installed + 2 )
+    self.assertEqual( allProgramData[2][-3:], [ 'e', 'str_10', 'str_11' ] )
+
+    # reset starts over with an empty program
+    s.reset()
+    self.assertEqual( len( s.installed ), 0 )
+    self.assertEqual( sorted( q.run()[2] ), sorted( allProgramData[2] ) )
+    self.assertEqual( len( s.installed ), num_installed + 2 )
+    s.close()
+
+    # a bounded session resets itself once it is full
+    s      = C4Session.C4Session( maxInstalled=1 )
+    opens  = []
+    open_  = s.wrapper.open
+    s.wrapper.open = lambda : opens.append( 1 ) or open_()
+    q.setSession( s )
+    for i in range( 0, 3 ) :
+      self.assertEqual( sorted( q.run()[2] ), sorted( allProgramData[2] ) )
+    self.assertEqual( [ len( opens ), len( s.installed ) ], [ 2, num_installed + 2 ] )
+
+    # ---------------------------- #
+    s.close()
+    dbInst.deldb()
+
+
   ################
   #  EXAMPLE 20  #
   ################
@@ -33,6 +33,31 @@ def unittest_driver() :
   os.system( "python -m unittest Test_quest.Test_quest.test_example18" )
   os.system( "python -m unittest Test_quest.Test_quest.test_example19" )
   os.system( "python -m unittest Test_quest.Test_quest.test_example20" )
+  os.system( "python -m unittest Test_quest.Test_quest.test_example21" )
+  os.system( "python -m unittest Test_quest.Test_quest.test_example22" )
+  os.system( "python -m unittest Test_quest.Test_quest.test_example23" )
+  os.system( "python -m unittest Test_quest.Test_quest.test_example24" )
+  os.system( "python -m unittest Test_quest.Test_quest.test_example25" )
+  os.system( "python -m unittest Test_quest.Test_quest.test_example26" )
+  os.system( "python -m unittest Test_quest.Test_quest.test_example27" )
+  os.system( "python -m unittest Test_quest.Test_quest.test_example28" )
+  os.system( "python -m unittest Test_quest.Test_quest.test_example29" )
+  os.system( "python -m unittest Test_quest.Test_quest.test_example30" )
+  os.system( "python -m unittest Test_quest.Test_quest.test_example31" )
+  os.system( "python -m unittest Test_quest.Test_quest.test_example32" )
+  os.system( "python -m unittest Test_quest.Test_quest.test_example33" )
+  os.system( "python -m unittest Test_quest.Test_quest.test_example34" )
+  os.system( "python -m unittest Test_quest.Test_quest.test_example35" )
+  os.system( "python -m unittest Test_quest.Test_quest.test_example36" )
+  os.system( "python -m unittest Test_quest.Test_quest.test_example37" )
+  os.system( "python -m unittest Test_quest.Test_quest.test_example38" )
+  os.system( "python -m unittest Test_quest.Test_quest.test_example39" )
+  os.system( "python -m unittest Test_quest.Test_quest.test_example40" )
+  os.system( "python -m unittest Test_quest.Test_quest.test_example41" )
+  os.system( "python -m unittest Test_quest.Test_quest.test_example42" )
+  os.system( "python -m unittest Test_quest.Test_quest.test_example43" )
+  os.system( "python -m unittest Test_quest.Test_quest.test_example44" )
+  os.system( "python -m unittest Test_quest.Test_quest.test_example45" )
 
 
 #########################